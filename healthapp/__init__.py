@@ -1,32 +1,116 @@
 from datetime import timedelta
+from pathlib import Path
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_restful import Api
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 
 app = Flask(__name__)
 api = Api(app)
 app.config['SECRET_KEY'] = '4576c836be2d7d51f727e01745901904'
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
+# time an api token is valid for after logging in, and the time a refresh token
+# can be used to renew it without logging in again.
+app.config['API_TOKEN_LIFETIME'] = timedelta(minutes=10)
+app.config['REFRESH_TOKEN_LIFETIME'] = timedelta(hours=12)
+# seconds each process caches the users' token epochs for, which is the longest a revoked
+# api token is still accepted by the processes other than the one that revoked it.
+app.config['TOKEN_EPOCH_TTL'] = 5
+# bcrypt work factor, each extra round doubles the time taken to hash a password.
+app.config['BCRYPT_LOG_ROUNDS'] = 12
+# number of threads hashing passwords at once, and the most passwords that may be waiting
+# or being hashed before further logins are turned away.
+app.config['PASSWORD_HASH_WORKERS'] = 2
+app.config['PASSWORD_QUEUE_LIMIT'] = 32
+# number of user ciphers kept in memory by healthapp.encryption.
+app.config['CIPHER_CACHE_SIZE'] = 256
+# number of keys held in memory by healthapp.keyring, and the seconds they are held for.
+app.config['KEYRING_CACHE_SIZE'] = 1024
+app.config['KEYRING_TTL'] = 300
+# most memory, in bytes, taken by the decrypted records cached by healthapp.records,
+# and the most seconds the decrypted records are held for.
+app.config['RECORD_CACHE_MAX_BYTES'] = 16 * 1024 * 1024
+app.config['RECORD_CACHE_TTL'] = 60
+# number of user snapshots held in memory by healthapp.identity, and the seconds they are held for.
+app.config['IDENTITY_CACHE_SIZE'] = 1024
+app.config['IDENTITY_TTL'] = 300
+# saves new records and posts from concurrent requests in shared transactions, gathering
+# them for GROUP_COMMIT_WINDOW seconds up to GROUP_COMMIT_MAX_ROWS rows per commit.
+app.config['GROUP_COMMIT'] = False
+app.config['GROUP_COMMIT_WINDOW'] = 0.005
+app.config['GROUP_COMMIT_MAX_ROWS'] = 100
+# number of rows re-encrypted per batch after a key is rotated, and the seconds slept
+# between batches, which together limit how much of the database the rotation uses.
+app.config['KEY_ROTATION_BATCH_SIZE'] = 200
+app.config['KEY_ROTATION_BATCH_DELAY'] = 0.5
+# seconds, on top of KEYRING_TTL, an old key is kept after the new key is created. Until then
+# other processes, and requests already running, may still encrypt new data with it.
+app.config['KEY_RETIREMENT_MARGIN'] = 60
+# cipher new data is encrypted with: 'aes-gcm', 'chacha20-poly1305', or 'fernet'.
+# data already written with any of them can still be decrypted.
+app.config['CIPHER_BACKEND'] = 'aes-gcm'
+# decrypts batches of at least PARALLEL_DECRYPT_THRESHOLD rows across a pool of worker
+# processes. Run healthapp/benchmarks/decrypt_benchmark.py to find the threshold for a host.
+app.config['PARALLEL_DECRYPT'] = False
+app.config['PARALLEL_DECRYPT_THRESHOLD'] = 4000
+app.config['PARALLEL_DECRYPT_CHUNK_SIZE'] = 1000
+app.config['PARALLEL_DECRYPT_WORKERS'] = None   # one worker per cpu core.
+# number of rows per page on the web app, and the default and maximum for the api.
+app.config['PAGE_SIZE'] = 20
+app.config['API_PAGE_SIZE'] = 50
+app.config['API_MAX_PAGE_SIZE'] = 200
+# most points a downsampled series of records or samples can be split into.
+app.config['MAX_SERIES_POINTS'] = 1000
+# number of rows read from the database and decrypted at a time when streaming a download.
+app.config['EXPORT_CHUNK_SIZE'] = 500
+# folder the encrypted archives of bulk export jobs are written to, and the time they are
+# kept for, which is only long enough to download them.
+app.config['EXPORT_DIRECTORY'] = str(Path(app.root_path) / 'exports')
+app.config['EXPORT_TTL'] = timedelta(hours=1)
+# number of samples packed into each encrypted block of time-series data (an hour at 1 Hz),
+# and the most samples that can be uploaded, or returned on a page, in one api request.
+app.config['SAMPLE_BLOCK_SIZE'] = 3600
+app.config['MAX_SAMPLES_PER_REQUEST'] = 10000
+# most records that can be uploaded in one batch api request, and the number of them
+# saved per transaction.
+app.config['MAX_RECORDS_PER_REQUEST'] = 10000
+app.config['INGEST_CHUNK_SIZE'] = 500
+# largest request body accepted, in bytes, which leaves room for a full upload of samples.
+# larger requests are turned away with a 413 error before they are read.
+app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
+# requests allowed to each endpoint per user, or per address when not logged in, counted over
+# a moving window.
+app.config['RATELIMIT_DEFAULT'] = '200 per day;100 per hour'
+# budget shared by all the endpoints, which each request uses up by its endpoint's cost.
+app.config['RATELIMIT_APPLICATION'] = '500 per hour'
+app.config['RATELIMIT_STRATEGY'] = 'weighted-moving-window'
+# sqlite database the limits are counted in, shared by all the processes on the host.
+# requests are let through, rather than failing, if it can't be reached.
+app.config['RATELIMIT_STORAGE_URL'] = 'sqlite:///' + str(Path(app.root_path) / 'ratelimit.db')
+app.config['RATELIMIT_SWALLOW_ERRORS'] = True
+# number of hits each endpoint counts as against the limits, if more than one.
+app.config['RATELIMIT_COSTS'] = {'download_data': 10,
+                                 'sampleapi': 5,
+                                 'recordapi': 2,
+                                 'recordbatchapi': 5,
+                                 'astronaut_records': 2}
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
 # app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://<<username>>:<<password>>@<<ip address>>/<<database_name>>'
 db = SQLAlchemy(app)
-# db.init_app(app)
-# migrate = Migrate(app, db)
-
-limiter = Limiter(
-    app,
-    key_func=get_remote_address,
-    default_limits=["200 per day", "100 per hour"]
-)
+# batch mode lets alembic alter tables on sqlite by copying them.
+migrate = Migrate(app, db, directory=str(Path(app.root_path).parent / 'migrations'),
+                  render_as_batch=True)
 
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
+from healthapp.ratelimit import rate_limit_key
+limiter = Limiter(app, key_func=rate_limit_key)
+
 from healthapp.webapp import routes
 from healthapp.restapi import resources
@@ -0,0 +1,67 @@
+"""
+Benchmark comparing the cipher backends on the sizes of data the app stores.
+
+Prints the time taken to encrypt and decrypt a single record with each backend,
+along with the size of the stored ciphertext, for a typical vitals reading and a
+typical message. The fastest backend is a good choice for the CIPHER_BACKEND setting
+on the host the benchmark is run on.
+
+Usage:
+    python -m healthapp.benchmarks.cipher_benchmark
+"""
+
+import time
+from cryptography.fernet import Fernet
+from healthapp.ciphers import cipher_backends
+
+# plaintexts to time each backend with: a 12 character vitals reading and a 500 character message.
+PLAINTEXTS = {'vitals (12 chars)': b'120/80mmHg 1', 'message (500 chars)': b'x' * 500}
+# number of records encrypted and decrypted per run.
+RECORDS = 20000
+# number of runs for each backend, the fastest run is kept.
+REPEATS = 3
+
+
+def time_per_record(function, inputs):
+    """
+    Returns the fastest time, in microseconds, taken to call a function on each input.
+
+    Args:
+        function -- the function to be timed, either encrypt or decrypt.
+        inputs -- list of inputs to call the function on.
+    """
+    fastest = None
+
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for value in inputs:
+            function(value)
+        elapsed = time.perf_counter() - start
+
+        if fastest is None or elapsed < fastest:
+            fastest = elapsed
+
+    return fastest / len(inputs) * 1000000
+
+
+def run_benchmark():
+    """Times encryption and decryption with each backend for each plaintext size."""
+    key = Fernet.generate_key().decode('utf-8')
+
+    print(f'{"backend":>20}{"plaintext":>20}{"encrypt (us)":>14}{"decrypt (us)":>14}'
+          f'{"stored bytes":>14}')
+
+    for label, plaintext in PLAINTEXTS.items():
+        for name, backend in cipher_backends.items():
+            cipher = backend(key)
+            tokens = [cipher.encrypt(plaintext) for _ in range(RECORDS)]
+
+            encrypt_time = time_per_record(cipher.encrypt, [plaintext] * RECORDS)
+            decrypt_time = time_per_record(cipher.decrypt, tokens)
+
+            print(f'{name:>20}{label:>20}{encrypt_time:>14.2f}{decrypt_time:>14.2f}'
+                  f'{len(tokens[0]):>14}')
+
+
+if __name__ == '__main__':
+    run_benchmark()
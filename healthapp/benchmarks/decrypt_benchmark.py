@@ -0,0 +1,89 @@
+"""
+Benchmark comparing serial and parallel decryption for different batch sizes.
+
+Prints the time taken by each mode and the smallest batch size for which the
+worker pool is faster. That size is a good starting point for the
+PARALLEL_DECRYPT_THRESHOLD setting on the host the benchmark is run on.
+
+Usage:
+    python -m healthapp.benchmarks.decrypt_benchmark
+"""
+
+import os
+import time
+from cryptography.fernet import Fernet
+from healthapp.encryption import decrypt_tokens, get_decrypt_pool, get_cipher
+
+# batch sizes to time each mode with.
+BATCH_SIZES = [250, 500, 1000, 2000, 4000, 8000, 16000, 32000]
+# number of times each batch is decrypted, the fastest run is kept.
+REPEATS = 3
+
+
+def build_tokens(size, message_length=500, key_count=4):
+    """
+    Builds a batch of (key, token) pairs like those of an inbox, where the posts
+    are encrypted with the keys of a handful of different recipients.
+
+    Args:
+        size -- the number of tokens in the batch.
+        message_length -- the length of each plaintext message.
+        key_count -- the number of different keys used in the batch.
+    """
+    keys = [Fernet.generate_key().decode('utf-8') for _ in range(key_count)]
+    message = ('x' * message_length).encode()
+
+    return [(keys[i % key_count], get_cipher(keys[i % key_count]).encrypt(message))
+            for i in range(size)]
+
+
+def time_decryption(encrypted_tokens, parallel):
+    """
+    Returns the fastest time, in seconds, taken to decrypt the tokens.
+
+    Args:
+        encrypted_tokens -- list of (key, token) pairs to decrypt.
+        parallel -- whether the worker pool is used.
+    """
+    fastest = None
+
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        decrypt_tokens(encrypted_tokens, parallel)
+        elapsed = time.perf_counter() - start
+
+        if fastest is None or elapsed < fastest:
+            fastest = elapsed
+
+    return fastest
+
+
+def run_benchmark():
+    """Times both decryption modes for each batch size and prints the crossover point."""
+    print(f'cpu cores: {os.cpu_count()}')
+
+    # starts the worker processes before timing so their start up isn't measured.
+    get_decrypt_pool().map(len, [[]] * (os.cpu_count() or 1))
+
+    crossover = None
+    print(f'{"batch size":>12}{"serial (ms)":>14}{"parallel (ms)":>16}{"speed up":>10}')
+
+    for size in BATCH_SIZES:
+        encrypted_tokens = build_tokens(size)
+        serial = time_decryption(encrypted_tokens, parallel=False)
+        parallel = time_decryption(encrypted_tokens, parallel=True)
+
+        print(f'{size:>12}{serial * 1000:>14.1f}{parallel * 1000:>16.1f}'
+              f'{serial / parallel:>9.2f}x')
+
+        if crossover is None and parallel < serial:
+            crossover = size
+
+    if crossover:
+        print(f'\nThe worker pool is faster from {crossover} tokens per batch.')
+    else:
+        print('\nThe worker pool was not faster for any batch size on this host.')
+
+
+if __name__ == '__main__':
+    run_benchmark()
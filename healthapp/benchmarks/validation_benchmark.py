@@ -0,0 +1,92 @@
+"""
+Benchmark comparing the compiled request schemas against reqparse.
+
+Prints the time taken to validate the arguments of typical api requests with the
+compiled RequestSchema of each endpoint, and with a reqparse parser declaring the
+same arguments, for a form body, a query string, and a json body.
+
+Usage:
+    python -m healthapp.benchmarks.validation_benchmark
+"""
+
+import time
+from flask_restful import reqparse
+from healthapp import app
+from healthapp.restapi.parsers import default_locations, post_put_args, record_get_args,\
+        user_put_args
+
+# requests to time each parser with: the schema, and the request's query string, form, and json.
+REQUESTS = {
+    'post put (form)': (post_put_args, {}, {'email': 'astro@email.com', 'title': 'Hello',
+                                            'content': 'x' * 500, 'token': 't' * 200}, None),
+    'record get (query)': (record_get_args, {'email': 'astro@email.com', 'limit': '50',
+                                             'from': '2021-01-01T00:00:00Z', 'points': '100',
+                                             'token': 't' * 200}, {}, None),
+    'user put (json)': (user_put_args, {}, None, {'email': 'new@email.com', 'first_name': 'New',
+                                                  'last_name': 'User', 'role': 'Astronaut',
+                                                  'password': 'password', 'token': 't' * 200}),
+}
+# number of requests validated per run.
+CALLS = 20000
+# number of runs for each parser, the fastest run is kept.
+REPEATS = 3
+
+
+def build_reqparse(schema):
+    """
+    Builds a reqparse parser declaring the same arguments as a schema.
+
+    Args:
+        schema -- the compiled RequestSchema.
+    """
+    parser = reqparse.RequestParser()
+
+    for name, field in schema.fields.items():
+        parser.add_argument(name, type=field.type, help=field.help, required=field.required,
+                            dest=field.dest, location=field.location or default_locations)
+
+    return parser
+
+
+def time_per_call(parse):
+    """
+    Returns the fastest time, in microseconds, taken to validate a request.
+
+    Args:
+        parse -- the parse_args function to be timed.
+    """
+    fastest = None
+
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for _ in range(CALLS):
+            parse()
+        elapsed = time.perf_counter() - start
+
+        if fastest is None or elapsed < fastest:
+            fastest = elapsed
+
+    return fastest / CALLS * 1000000
+
+
+def run_benchmark():
+    """Times the compiled schema and reqparse for each request."""
+    print(f'{"request":>20}{"schema (us)":>14}{"reqparse (us)":>16}{"speedup":>10}')
+
+    for label, (schema, query, form, body) in REQUESTS.items():
+        with app.test_request_context('/', method='POST', query_string=query, data=form,
+                                      json=body):
+            parser = build_reqparse(schema)
+
+            # both parsers must return the same arguments for the timings to be comparable.
+            assert schema.parse_args() == parser.parse_args()
+
+            schema_time = time_per_call(schema.parse_args)
+            reqparse_time = time_per_call(parser.parse_args)
+
+        print(f'{label:>20}{schema_time:>14.2f}{reqparse_time:>16.2f}'
+              f'{reqparse_time / schema_time:>9.1f}x')
+
+
+if __name__ == '__main__':
+    run_benchmark()
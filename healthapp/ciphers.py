@@ -0,0 +1,254 @@
+"""Module containing the cipher backends used to encrypt stored data.
+
+Every ciphertext starts with a one byte header naming the backend that wrote it,
+so data written by any registered backend can be decrypted whichever backend is
+used for new writes. Fernet tokens already start with their version byte, 0x80,
+which serves as the Fernet backend's header.
+
+All the backends use the same user keys, the url-safe base64 Fernet keys stored
+in the EncryptionKey table and looked up through healthapp.keyring. The AEAD backends
+derive their own 256 bit key from it with HKDF, so no key material is shared between
+algorithms.
+
+Classes:
+    RawFernet -- Fernet encryption working on raw, binary tokens.
+    AesGcmCipher -- AES-256-GCM encryption.
+    ChaCha20Poly1305Cipher -- ChaCha20-Poly1305 encryption.
+    KeyCipher -- encrypts with the chosen backend and decrypts with any backend, for one key.
+
+Functions:
+    register_cipher_backend -- adds a cipher backend to the registry.
+"""
+
+import base64
+import os
+import struct
+import time
+from cryptography.exceptions import InvalidSignature, InvalidTag
+from cryptography.fernet import InvalidToken
+from cryptography.hazmat.primitives import hashes, padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.hmac import HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+
+def decode_key(key):
+    """Returns the 32 raw bytes of a url-safe base64 Fernet key.
+
+    Args:
+        key -- the encryption key as a utf-8 string.
+    """
+
+    raw_key = base64.urlsafe_b64decode(key)
+
+    if len(raw_key) != 32:
+        raise ValueError('Fernet key must be 32 url-safe base64-encoded bytes.')
+
+    return raw_key
+
+
+class RawFernet:
+    """
+    Fernet encryption that reads and writes the raw bytes of the tokens, rather than their
+    url-safe base64 encoding. The tokens are otherwise the same as Fernet's: a version
+    byte, timestamp, iv, AES-128-CBC ciphertext, and HMAC-SHA256 of all of those.
+    """
+
+    # the version byte of the tokens, which is also the backend's header.
+    header = b'\x80'
+    # length of the version, timestamp, and iv at the start of a token, and the hmac at the end.
+    header_length = 25
+    hmac_length = 32
+
+    def __init__(self, key):
+        # the key holds the signing key followed by the encryption key.
+        raw_key = decode_key(key)
+        self._signing_key = raw_key[:16]
+        self._encryption_key = raw_key[16:]
+
+    def encrypt(self, data):
+        """
+        Encrypts data, returning the token as bytes.
+
+        Args:
+            data -- the byte string to be encrypted.
+        """
+        iv = os.urandom(16)
+
+        padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        padded_data = padder.update(data) + padder.finalize()
+        encryptor = Cipher(algorithms.AES(self._encryption_key), modes.CBC(iv)).encryptor()
+        ciphertext = encryptor.update(padded_data) + encryptor.finalize()
+
+        token = self.header + struct.pack('>Q', int(time.time())) + iv + ciphertext
+
+        signature = HMAC(self._signing_key, hashes.SHA256())
+        signature.update(token)
+
+        return token + signature.finalize()
+
+    def decrypt(self, token):
+        """
+        Decrypts a token, raising InvalidToken if it is malformed or has been tampered with.
+
+        Args:
+            token -- the token bytes returned by encrypt.
+        """
+        if len(token) < self.header_length + self.hmac_length or token[:1] != self.header:
+            raise InvalidToken
+
+        # checks the hmac before decrypting anything.
+        signature = HMAC(self._signing_key, hashes.SHA256())
+        signature.update(token[:-self.hmac_length])
+        try:
+            signature.verify(token[-self.hmac_length:])
+        except InvalidSignature as error:
+            raise InvalidToken from error
+
+        iv = token[9:self.header_length]
+        decryptor = Cipher(algorithms.AES(self._encryption_key), modes.CBC(iv)).decryptor()
+        padded_data = decryptor.update(token[self.header_length:-self.hmac_length]) \
+            + decryptor.finalize()
+
+        unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+        try:
+            return unpadder.update(padded_data) + unpadder.finalize()
+        except ValueError as error:
+            raise InvalidToken from error
+
+
+class AeadCipher:
+    """
+    Base class for the AEAD backends. A ciphertext is the backend's header byte,
+    a random 12 byte nonce, and the encrypted data with its 16 byte tag. The header is
+    authenticated along with the data, so a ciphertext can't be passed off as another
+    backend's.
+    """
+
+    header = None       # header byte identifying the backend.
+    algorithm = None    # the AEAD class from cryptography.
+    nonce_length = 12
+
+    def __init__(self, key):
+        # derives a key for this algorithm only from the user's key.
+        derived_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                           info=b'healthapp ' + self.header).derive(decode_key(key))
+        self._aead = self.algorithm(derived_key)
+
+    def encrypt(self, data):
+        """
+        Encrypts data, returning the header, nonce, and ciphertext as bytes.
+
+        Args:
+            data -- the byte string to be encrypted.
+        """
+        nonce = os.urandom(self.nonce_length)
+
+        return self.header + nonce + self._aead.encrypt(nonce, data, self.header)
+
+    def decrypt(self, token):
+        """
+        Decrypts a ciphertext, raising InvalidToken if it is malformed or has been tampered with.
+
+        Args:
+            token -- the ciphertext bytes returned by encrypt.
+        """
+        nonce = token[1:1 + self.nonce_length]
+
+        try:
+            return self._aead.decrypt(nonce, token[1 + self.nonce_length:], self.header)
+        except (InvalidTag, ValueError) as error:
+            # ValueError is raised when the ciphertext is too short to hold a nonce.
+            raise InvalidToken from error
+
+
+class AesGcmCipher(AeadCipher):
+    """AES-256-GCM encryption, hardware accelerated on most cpus."""
+
+    header = b'\x01'
+    algorithm = AESGCM
+
+
+class ChaCha20Poly1305Cipher(AeadCipher):
+    """ChaCha20-Poly1305 encryption, fast on cpus without AES instructions."""
+
+    header = b'\x02'
+    algorithm = ChaCha20Poly1305
+
+
+# registered backends by name, and by the header byte their ciphertexts start with.
+cipher_backends = {}
+backends_by_header = {}
+
+
+def register_cipher_backend(name, backend):
+    """Adds a cipher backend to the registry.
+
+    Args:
+        name -- name used to choose the backend in the app config.
+        backend -- the backend class, built from a key and with encrypt and decrypt methods.
+    """
+
+    if backend.header in backends_by_header:
+        raise ValueError(f'Cipher header {backend.header} is already registered.')
+
+    cipher_backends[name] = backend
+    backends_by_header[backend.header] = backend
+
+
+register_cipher_backend('fernet', RawFernet)
+register_cipher_backend('aes-gcm', AesGcmCipher)
+register_cipher_backend('chacha20-poly1305', ChaCha20Poly1305Cipher)
+
+
+class KeyCipher:
+    """
+    Encrypts data with one of the backends and decrypts data written by any of them,
+    all using the same user key. The backends are built the first time they are needed.
+    """
+
+    def __init__(self, key, backend_name):
+        if backend_name not in cipher_backends:
+            raise ValueError(f'Cipher backend must be in {list(cipher_backends)}.')
+
+        self.key = key
+        self.backend_name = backend_name    # name of the backend used to encrypt.
+        self._backends = {}
+
+    def get_backend(self, backend):
+        """
+        Returns the instance of a backend class for this key.
+
+        Args:
+            backend -- the registered backend class.
+        """
+        instance = self._backends.get(backend.header)
+
+        if instance is None:
+            instance = self._backends[backend.header] = backend(self.key)
+
+        return instance
+
+    def encrypt(self, data):
+        """
+        Encrypts data with the chosen backend, returning the ciphertext as bytes.
+
+        Args:
+            data -- the byte string to be encrypted.
+        """
+        return self.get_backend(cipher_backends[self.backend_name]).encrypt(data)
+
+    def decrypt(self, token):
+        """
+        Decrypts a ciphertext with the backend named in its header.
+
+        Args:
+            token -- the ciphertext bytes, as written by any registered backend.
+        """
+        backend = backends_by_header.get(token[:1])
+
+        if backend is None:
+            raise InvalidToken
+
+        return self.get_backend(backend).decrypt(token)
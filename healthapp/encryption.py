@@ -1,98 +1,294 @@
 """Module containing functions for encrypting/decrypting data.
 
+Encrypted data is stored as raw bytes, with a header naming the cipher backend from
+healthapp.ciphers that wrote it. New data is encrypted with the CIPHER_BACKEND
+set in the app config, and data written by any backend can be decrypted. Keys are
+referred to by their id, and looked up through healthapp.keyring.
+
+With PARALLEL_DECRYPT turned on, large batches are decrypted by a pool of worker
+processes. The user keys of the batch are sent to the workers along with the tokens,
+pickled over the pool's pipes, so key material leaves the server process, though it is
+never written to disk. The workers are started with the spawn method, so they don't
+inherit a copy of the server's memory, threads, or open database connections.
+
+Classes:
+    CipherCache -- bounded cache of KeyCipher instances, keyed by encryption key.
+
 Functions:
+    get_cipher -- returns the cached KeyCipher instance for a key.
+    get_decrypt_pool -- returns the worker pool used for parallel decryption.
+    decrypt_tokens -- decrypts a list of (key, token) pairs, in parallel for large batches.
+    encrypt_data -- encrypts a byte string using the key with a given id.
+    encrypt_many -- encrypts a list of byte strings using the key with a given id.
     encrypt_medical_record -- encrypts a given medical record using the user key.
-    decrypt_medical_record -- decrypts a number of posts using the key.
-    encrypted_post -- encrypts a post using the recipient's key.
-    decrypt_post -- decrypts a number of posts using the key.
+    decrypt_medical_record -- decrypts a number of records, each with its own key.
+    encrypt_post -- encrypts a post using the recipient's key.
+    decrypt_batch -- decrypts a list of rows, each with its own key, in one pass.
+    post_view -- builds the decrypted view of a post.
+    record_view -- builds the decrypted view of a medical record.
 """
 
-from cryptography.fernet import Fernet
-from healthapp.models import User
+from collections import OrderedDict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from threading import Lock
+from healthapp import app
+from healthapp.ciphers import KeyCipher
+from healthapp.keyring import keyring
+
+
+class CipherCache:
+    """
+    Least recently used cache of KeyCipher instances, keyed by the encryption key string.
+    Building a cipher decodes and derives keys, so reusing them takes
+    that work out of the per-row decryption loop.
+    """
+
+    def __init__(self, max_size, backend_name):
+        self.max_size = max_size    # maximum number of ciphers held before evicting.
+        self.backend_name = backend_name    # name of the backend new data is encrypted with.
+        self._ciphers = OrderedDict()
+        self._lock = Lock()     # requests are served from several threads.
+
+    def get(self, key):
+        """
+        Returns the KeyCipher instance for the key, creating it if it isn't cached.
+
+        Args:
+            key -- the encryption key as a utf-8 string.
+        """
+        with self._lock:
+            cipher = self._ciphers.get(key)
 
+            if cipher is not None:
+                # marks the cipher as the most recently used.
+                self._ciphers.move_to_end(key)
+                return cipher
 
-def encrypt_medical_record(new_entry, user_key):
-    """Encrypts a record using the given key.
+            cipher = KeyCipher(key, self.backend_name)
+            self._ciphers[key] = cipher
+
+            # evicts the least recently used cipher once the cache is full.
+            if len(self._ciphers) > self.max_size:
+                self._ciphers.popitem(last=False)
+
+            return cipher
+
+    def clear(self):
+        """Removes all cached ciphers."""
+        with self._lock:
+            self._ciphers.clear()
+
+
+# cipher cache shared by all the encryption functions.
+ciphers = CipherCache(app.config['CIPHER_CACHE_SIZE'], app.config['CIPHER_BACKEND'])
+
+
+def get_cipher(key):
+    """Returns the cached KeyCipher instance for the given key.
 
     Args:
-        new_entry -- the new record entry that is to be encrypted.
-        user_key -- the key of the user that the record is associated with.
+        key -- the encryption key as a utf-8 string.
     """
 
-    # encodes the new record entry as a byte string as required by Fernet.
-    encoded_data = new_entry.encode()
+    return ciphers.get(key)
+
+
+# worker pool for parallel decryption, created on first use.
+decrypt_pool = None
+decrypt_pool_lock = Lock()
 
-    # encrypts the record with the user's key, and decodes the encrypted data
-    # to a utf-8 string to be passed into the database.
-    encrypted_data = Fernet(user_key.encode()).encrypt(encoded_data).decode('utf-8')
-    return encrypted_data
 
+def get_decrypt_pool():
+    """Returns the process pool used for parallel decryption, creating it if needed."""
 
-def decrypt_medical_record(encrypted_posts, key):
-    """Decrypts records using the given key.
+    global decrypt_pool
+
+    with decrypt_pool_lock:
+        if decrypt_pool is None:
+            # forking a threaded server can copy locks held by other threads, so the
+            # workers are started fresh. None uses one worker process per cpu core.
+            decrypt_pool = ProcessPoolExecutor(max_workers=app.config['PARALLEL_DECRYPT_WORKERS'],
+                                               mp_context=multiprocessing.get_context('spawn'))
+
+        return decrypt_pool
+
+
+def decrypt_chunk(chunk, decode=True):
+    """Decrypts a chunk of (key, token) pairs. Runs inside the worker processes.
 
     Args:
-         encrypted_posts -- posts to be decrypted.
-         key -- encryption key associated with the records.
+        chunk -- list of (key, token) pairs, where the token is the ciphertext bytes.
+        decode -- whether the plaintext is decoded to a utf-8 string.
     """
 
-    decrypted_posts = []    # empty list for decrypted posts the be appended to.
+    if not decode:
+        return [ciphers.get(key).decrypt(token) for key, token in chunk]
+
+    return [ciphers.get(key).decrypt(token).decode('utf-8') for key, token in chunk]
 
-    for post in encrypted_posts:
-        encrypted_data = post.record.encode()   # encodes post as a byte string required by Fernet.
 
-        # decrypts the data using fernet and the user's key, and decodes it to a utf-8 string.
-        decrypted_data = Fernet(key.encode()).decrypt(encrypted_data).decode('utf-8')
+def decrypt_tokens(encrypted_tokens, parallel=None, decode=True):
+    """Decrypts a list of tokens, keeping their order.
 
-        # writes the decrypted record to a dictionary, along with other record
-        # info from the database.
-        decrypted_posts.append({'id': post.id,
-                                'author': post.author.email,
-                                'date_posted': post.date_posted.strftime('%Y-%m-%d'),
-                                'record': decrypted_data})
+    Batches of at least PARALLEL_DECRYPT_THRESHOLD tokens are split into chunks of
+    PARALLEL_DECRYPT_CHUNK_SIZE and decrypted across the worker pool if
+    PARALLEL_DECRYPT is enabled. Smaller batches are decrypted on the calling thread,
+    as the cost of sending them to the workers outweighs the decryption itself.
 
-    return decrypted_posts
+    Args:
+        encrypted_tokens -- list of (key, token) pairs, where the token is the ciphertext bytes.
+        parallel -- True or False to force or disable the worker pool,
+                    None to decide using the app config.
+        decode -- True to return utf-8 strings, False to return the plaintext bytes.
+    """
 
+    if parallel is None:
+        parallel = app.config['PARALLEL_DECRYPT'] \
+                   and len(encrypted_tokens) >= app.config['PARALLEL_DECRYPT_THRESHOLD']
 
-def encrypt_post(post, recipient):
-    """Encrypts a user post using the recipient's key.
+    if parallel:
+        chunk_size = app.config['PARALLEL_DECRYPT_CHUNK_SIZE']
+        chunks = [encrypted_tokens[i:i + chunk_size]
+                  for i in range(0, len(encrypted_tokens), chunk_size)]
+
+        # map returns the chunks in the order they were submitted.
+        decrypted_tokens = []
+        for decrypted_chunk in get_decrypt_pool().map(partial(decrypt_chunk, decode=decode),
+                                                      chunks):
+            decrypted_tokens.extend(decrypted_chunk)
+
+        return decrypted_tokens
+
+    decrypted_tokens = []   # empty list for the decrypted tokens to be appended to.
+    token_ciphers = {}      # ciphers used in this batch, saves locking the cache per token.
+
+    for key, token in encrypted_tokens:
+        cipher = token_ciphers.get(key)
+
+        if cipher is None:
+            cipher = token_ciphers[key] = ciphers.get(key)
+
+        plaintext = cipher.decrypt(token)
+        decrypted_tokens.append(plaintext.decode('utf-8') if decode else plaintext)
+
+    return decrypted_tokens
+
+
+def post_view(post, content):
+    """Builds the dictionary a decrypted post is displayed and returned as.
 
     Args:
-        post -- The post to be encrypted.
-        recipient -- the recipient of the post
+        post -- the encrypted post, as selected by healthapp.messages.
+        content -- the decrypted content of the post.
     """
 
-    # gets the recipient's key form the database.
-    encryption_key = User.query.filter_by(email=recipient).first().key
-    # encodes post as a byte string.
-    encoded_data = post.encode()
-    # encrypts post using the key and decodes it to utf-8 string to pass into the database.
-    encrypted_post = Fernet(encryption_key.encode()).encrypt(encoded_data).decode('utf-8')
+    return {'id': post.id,
+            'author': post.author_email,
+            'recipient': post.recipient_email,
+            'date_posted': post.date_posted.strftime('%Y-%m-%d'),
+            'title': post.title,
+            'content': content}
 
-    return encrypted_post
 
+def record_view(record, data, author_email):
+    """Builds the dictionary a decrypted medical record is displayed and returned as.
 
-def decrypt_post(encrypted_posts, key):
-    """Decrypts posts using the given key.
+    Args:
+        record -- the encrypted record from the database.
+        data -- the decrypted record data.
+        author_email -- the email of the user the record belongs to, passed in rather than
+                        loaded from each record.
+    """
+
+    return {'id': record.id,
+            'author': author_email,
+            'date_posted': record.date_posted.strftime('%Y-%m-%d'),
+            'record': data}
+
+
+def decrypt_batch(encrypted_rows, view, parallel=None):
+    """Decrypts a list of rows, where each row may be encrypted with a different key.
+
+    Args:
+        encrypted_rows -- list of rows to be decrypted, each with the key_id of its key.
+        view -- function building the decrypted view from a row and its plaintext,
+                either post_view or a record_view with the author's email.
+        parallel -- passed to decrypt_tokens, None to decide using the app config.
+    """
+
+    # finds all the keys used in the batch at once.
+    keys = keyring.get_keys([row.key_id for row in encrypted_rows])
+
+    # posts store their ciphertext as content, medical records as record.
+    if view is post_view:
+        encrypted_tokens = [(keys[row.key_id], row.content) for row in encrypted_rows]
+    else:
+        encrypted_tokens = [(keys[row.key_id], row.record) for row in encrypted_rows]
+
+    decrypted_data = decrypt_tokens(encrypted_tokens, parallel)
+
+    return [view(row, data) for row, data in zip(encrypted_rows, decrypted_data)]
+
+
+def encrypt_data(data, key_id):
+    """Encrypts a byte string with the key with the given id, returning the ciphertext bytes.
+
+    Args:
+        data -- the byte string to be encrypted.
+        key_id -- the id of the key to encrypt with.
+    """
+
+    return get_cipher(keyring.get_key(key_id)).encrypt(data)
+
+
+def encrypt_many(data, key_id):
+    """Encrypts a list of byte strings with the key with the given id, looking the key and
+    its cipher up once for the whole list. Returns the ciphertext bytes, in order.
 
     Args:
-          encrypted_posts -- the posts to be decrypted.
-          key -- recipient key associated with the encrypted posts.
+        data -- the byte strings to be encrypted.
+        key_id -- the id of the key to encrypt with.
     """
 
-    decrypted_posts = []    # empty list for decrypted post to be appended to.
+    cipher = get_cipher(keyring.get_key(key_id))
 
-    for post in encrypted_posts:
-        encrypted_data = post.content.encode()  # encodes post to a byte string.
-        # decrypts post using the passed in key and decodes it to a utf-8 string.
-        decrypted_data = Fernet(key.encode()).decrypt(encrypted_data).decode('utf-8')
+    return [cipher.encrypt(plaintext) for plaintext in data]
 
-        # writes decrypted post to a dictionary along with appropriate post data from the database.
-        decrypted_posts.append({'id': post.id,
-                                'author': post.author.email,
-                                'recipient': post.recipient,
-                                'date_posted': post.date_posted.strftime('%Y-%m-%d'),
-                                'title': post.title,
-                                'content': decrypted_data})
 
-    return decrypted_posts
+def encrypt_medical_record(new_entry, key_id):
+    """Encrypts a record using the key with the given id.
+
+    Args:
+        new_entry -- the new record entry that is to be encrypted.
+        key_id -- the id of the current key of the user that the record is associated with.
+    """
+
+    # encodes the new record entry as a byte string, and encrypts it with the user's key.
+    # the ciphertext bytes are stored as they are.
+    return encrypt_data(new_entry.encode(), key_id)
+
+
+def decrypt_medical_record(encrypted_posts, author_email):
+    """Decrypts records of one user, each with the key it was encrypted with.
+
+    Args:
+         encrypted_posts -- records to be decrypted.
+         author_email -- the email of the user the records belong to.
+    """
+
+    return decrypt_batch(encrypted_posts, partial(record_view, author_email=author_email))
+
+
+def encrypt_post(post, key_id):
+    """Encrypts a user post using the recipient's key.
+
+    Args:
+        post -- The post to be encrypted.
+        key_id -- the id of the recipient's current key.
+    """
+
+    # encodes post as a byte string and encrypts it using the key.
+    # the ciphertext bytes are stored as they are.
+    return encrypt_data(post.encode(), key_id)
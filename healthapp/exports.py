@@ -0,0 +1,488 @@
+"""Module containing the csv exports of records and posts, and the bulk export jobs.
+
+Exports are written as csv a chunk of rows at a time. The rows are read from the database
+EXPORT_CHUNK_SIZE at a time and decrypted a chunk at a time, so the memory used doesn't
+grow with the size of the export. Each chunk is read as a page of a keyset paginated query
+in a short transaction of its own, so a slow download doesn't keep a read transaction open,
+which would hold up writers to the sqlite database.
+
+Single downloads are streamed straight to the user by healthapp.webapp.downloads. Bulk
+exports of several users and record types take too long for one request, so they are
+submitted as jobs, which are run one at a time on a background worker. Each job writes a
+zip archive with a csv file per user and record type to EXPORT_DIRECTORY, and records its
+progress in the ExportJob table after each file, so it can be polled from any process.
+
+Archives are never written as plaintext. Each job has its own AES-256-GCM key, which is
+returned once to the user submitting the job and is otherwise only held in memory by the
+worker, so the archive can't be read from the disk or database alone. The archive is
+encrypted ARCHIVE_CHUNK_SIZE bytes at a time, with the chunk's index as its nonce and the
+last chunk marked, so a download can start at any chunk and a truncated archive is detected.
+Jobs and their archives expire after EXPORT_TTL, and can no longer be followed or
+downloaded. Expired jobs are deleted whenever a job is submitted, followed, or downloaded,
+and by the purge-exports command. A job interrupted by a restart can't be run again, since
+its key is lost, so the clear-interrupted-exports command marks it failed for the user to
+submit again.
+
+Classes:
+    EncryptedArchiveWriter -- file object encrypting what is written to it a chunk at a time.
+
+Functions:
+    decrypt_in_chunks -- reads and decrypts the rows of a query a page at a time.
+    csv_lines -- writes rows as csv, a chunk of lines at a time.
+    post_lines -- writes the posts between two users as csv.
+    record_lines -- writes a user's records of one type as csv.
+    generate_archive_key -- returns a new random key for a job's archive.
+    chunk_cipher -- returns the cipher of an archive key.
+    chunk_nonce -- returns the nonce of a chunk of an archive.
+    archive_path -- returns the path of a job's archive.
+    read_archive -- decrypts a range of bytes of a job's archive.
+    job_view -- builds the dictionary a job's status is returned as.
+    job_expired -- returns whether a job is older than EXPORT_TTL.
+    purge_expired_jobs -- deletes the jobs and archives older than EXPORT_TTL.
+    delete_user_archives -- deletes the archives requested by a deleted user.
+    submit_export -- creates a job and queues it to be run in the background.
+    write_archive -- writes the encrypted archive of a job.
+    write_files -- writes the csv files of a job to a zip archive.
+    run_export -- runs a job on the export worker.
+    clear_interrupted_exports -- cli command marking jobs interrupted by a restart as failed.
+    purge_exports -- cli command deleting the expired jobs and archives.
+"""
+
+import base64
+import csv
+import io
+import logging
+import os
+import secrets
+import struct
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from healthapp import app, db
+from healthapp.models import ExportJob, Post, Record, user_deleted_callbacks
+from healthapp.encryption import decrypt_batch, post_view, record_view
+from healthapp.identity import identities
+from healthapp.messages import message_query
+from healthapp.pagination import paginate
+from healthapp.records import get_record_type
+
+logger = logging.getLogger(__name__)
+
+# columns of the exported csv files.
+post_fieldnames = ['id', 'author', 'recipient', 'date_posted', 'title', 'content']
+record_fieldnames = ['id', 'author', 'date_posted', 'record']
+
+# a single worker, so only one job is run at a time.
+export_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export')
+
+# bytes of the archive encrypted at a time, and the length of the tag added to each chunk.
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+ARCHIVE_TAG_SIZE = 16
+
+
+def decrypt_in_chunks(query, columns, view):
+    """Reads the rows of a query EXPORT_CHUNK_SIZE at a time, newest first, and yields a
+    list of the decrypted views of each chunk. Each chunk is read in its own transaction,
+    which is ended before the chunk is decrypted and sent.
+
+    Args:
+        query -- the query selecting the encrypted rows.
+        columns -- the columns to page through the rows by, ending with the id.
+        view -- function building the decrypted view from a row and its plaintext.
+    """
+
+    chunk_size = app.config['EXPORT_CHUNK_SIZE']
+    cursor = None
+
+    while True:
+        rows, cursor = paginate(query, columns, cursor, chunk_size)
+
+        # ends the read transaction. the rows are plain tuples, so they stay loaded.
+        db.session.commit()
+
+        if rows:
+            yield decrypt_batch(rows, view)
+
+        if cursor is None:
+            return
+
+
+def csv_lines(fieldnames, chunks):
+    """Yields the header and then each chunk of rows as csv text.
+
+    Args:
+        fieldnames -- the columns of the csv.
+        chunks -- iterable of lists of rows, as dictionaries.
+    """
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+        # empties the buffer for the next chunk.
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def post_lines(user, other_user):
+    """Yields the posts between two users as csv text, newest first.
+
+    Args:
+        user -- the user exporting the posts.
+        other_user -- the other user of the conversation.
+    """
+
+    return csv_lines(post_fieldnames,
+                     decrypt_in_chunks(message_query(user, other_user),
+                                       (Post.date_posted, Post.id), post_view))
+
+
+def record_lines(user, record_type):
+    """Yields a user's records of one type as csv text, newest first.
+
+    Args:
+        user -- the user the records belong to.
+        record_type -- the type of the records.
+    """
+
+    # only the columns written to the csv are read, and the author is always the user.
+    query = db.session.query(Record.id, Record.date_posted, Record.record, Record.key_id) \
+        .filter_by(user_id=user.id, metric_type=record_type.name)
+
+    return csv_lines(record_fieldnames,
+                     decrypt_in_chunks(query, (Record.date_posted, Record.id),
+                                       partial(record_view, author_email=user.email)))
+
+
+def generate_archive_key():
+    """Returns a new random AES-256-GCM key for a job's archive, as url-safe base64."""
+
+    return base64.urlsafe_b64encode(AESGCM.generate_key(bit_length=256)).decode('utf-8')
+
+
+def chunk_cipher(key):
+    """Returns the AESGCM cipher of an archive key, raising a ValueError if the key isn't
+    32 url-safe base64 encoded bytes.
+
+    Args:
+        key -- the archive key as a url-safe base64 string.
+    """
+
+    return AESGCM(base64.urlsafe_b64decode(key.encode('utf-8')))
+
+
+def chunk_nonce(index):
+    """Returns the nonce of a chunk of an archive. Each key only encrypts one archive, so
+    the chunk's index is never reused as a nonce.
+
+    Args:
+        index -- the position of the chunk in the archive.
+    """
+
+    return struct.pack('>4xQ', index)
+
+
+class EncryptedArchiveWriter:
+    """
+    File object which encrypts what is written to it ARCHIVE_CHUNK_SIZE bytes at a time.
+    It can't seek, so zipfile writes the archive in order, which is all it needs.
+    """
+
+    def __init__(self, file, key):
+        self._file = file
+        self._cipher = chunk_cipher(key)
+        self._buffer = bytearray()
+        self._index = 0
+        self._position = 0
+
+    def _write_chunk(self, chunk, last):
+        """Encrypts a chunk and writes it to the file. The last chunk is authenticated as
+        such, so the end of the archive can't be cut off without it being detected."""
+        self._file.write(self._cipher.encrypt(chunk_nonce(self._index), bytes(chunk),
+                                              b'last' if last else b''))
+        self._index += 1
+
+    def write(self, data):
+        """
+        Buffers data, encrypting and writing each full chunk. Returns the length of data.
+
+        Args:
+            data -- the bytes to be written.
+        """
+        self._buffer += data
+        self._position += len(data)
+
+        while len(self._buffer) >= ARCHIVE_CHUNK_SIZE:
+            self._write_chunk(self._buffer[:ARCHIVE_CHUNK_SIZE], last=False)
+            del self._buffer[:ARCHIVE_CHUNK_SIZE]
+
+        return len(data)
+
+    def tell(self):
+        """Returns the number of bytes written."""
+        return self._position
+
+    def flush(self):
+        """Flushes the file. Partial chunks are kept until they are full or closed."""
+        self._file.flush()
+
+    def close(self):
+        """Encrypts and writes the last chunk, which may be empty."""
+        self._write_chunk(self._buffer, last=True)
+        self._buffer = bytearray()
+
+
+def archive_path(job):
+    """Returns the path a job's encrypted archive is written to. Archives are named after
+    the user who requested them, so they can be found when the user is deleted.
+
+    Args:
+        job -- the export job.
+    """
+
+    return Path(app.config['EXPORT_DIRECTORY']) / f'{job.user_id}-{job.id}.enc'
+
+
+def read_archive(job, key, start, stop):
+    """Decrypts the bytes from start to stop of a finished job's archive, yielding them a
+    chunk at a time. Only the chunks holding the range are read. Raises an InvalidTag error
+    if the key is wrong or the archive has been changed.
+
+    Args:
+        job -- the finished export job.
+        key -- the archive key returned when the job was submitted.
+        start -- the position of the first byte.
+        stop -- the position after the last byte.
+    """
+
+    cipher = chunk_cipher(key)
+    last_index = job.size // ARCHIVE_CHUNK_SIZE
+    path = archive_path(job)
+
+    def chunks():
+        with open(path, 'rb') as file:
+            for index in range(start // ARCHIVE_CHUNK_SIZE,
+                               (stop - 1) // ARCHIVE_CHUNK_SIZE + 1):
+                file.seek(index * (ARCHIVE_CHUNK_SIZE + ARCHIVE_TAG_SIZE))
+                chunk = cipher.decrypt(chunk_nonce(index),
+                                       file.read(ARCHIVE_CHUNK_SIZE + ARCHIVE_TAG_SIZE),
+                                       b'last' if index == last_index else b'')
+
+                # trims the first and last chunks to the range.
+                offset = index * ARCHIVE_CHUNK_SIZE
+                yield chunk[max(start - offset, 0):stop - offset]
+
+    return chunks()
+
+
+def job_view(job):
+    """Builds the dictionary a job's status is returned as.
+
+    Args:
+        job -- the export job.
+    """
+
+    return {'job': job.id,
+            'emails': job.emails.split(','),
+            'record_types': job.record_types.split(','),
+            'status': job.status,
+            'progress': job.progress,
+            'total': job.total,
+            'size': job.size,
+            'created_at': job.created_at.isoformat(),
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None}
+
+
+def job_expired(job):
+    """Returns whether a job was created more than EXPORT_TTL ago, so it can no longer be
+    followed or downloaded, even if it hasn't been deleted yet.
+
+    Args:
+        job -- the export job.
+    """
+
+    return job.created_at < datetime.utcnow() - app.config['EXPORT_TTL']
+
+
+def purge_expired_jobs():
+    """Deletes the jobs created more than EXPORT_TTL ago, and their archives. Returns the
+    number of jobs deleted."""
+
+    expired = ExportJob.query.filter(
+        ExportJob.created_at < datetime.utcnow() - app.config['EXPORT_TTL']).all()
+
+    for job in expired:
+        archive_path(job).unlink(missing_ok=True)
+        db.session.delete(job)
+
+    db.session.commit()
+
+    return len(expired)
+
+
+def delete_user_archives(user_id):
+    """Deletes the archives requested by a deleted user. Their jobs are deleted with them.
+
+    Args:
+        user_id -- the id of the deleted user.
+    """
+
+    for path in Path(app.config['EXPORT_DIRECTORY']).glob(f'{user_id}-*'):
+        path.unlink(missing_ok=True)
+
+
+user_deleted_callbacks.append(delete_user_archives)
+
+
+def submit_export(user, emails, record_types):
+    """Creates an export job and queues it to be run in the background, returning the job
+    and the key its archive is encrypted with. The key isn't stored, so it is only known
+    to the caller and the worker.
+
+    Args:
+        user -- the user requesting the export.
+        emails -- the emails of the users whose data is exported.
+        record_types -- the names of the record types exported, which may include Posts.
+    """
+
+    purge_expired_jobs()
+
+    job = ExportJob(id=secrets.token_urlsafe(16), user_id=user.id, emails=','.join(emails),
+                    record_types=','.join(record_types),
+                    total=len(emails) * len(record_types))
+    db.session.add(job)
+    db.session.commit()
+
+    key = generate_archive_key()
+    export_pool.submit(run_export, job.id, key)
+
+    return job, key
+
+
+def write_archive(job, path, key):
+    """Writes a job's encrypted archive to the given path, committing its progress after
+    each file. Returns the size of the archive once decrypted.
+
+    Args:
+        job -- the export job.
+        path -- the path the archive is written to.
+        key -- the key the archive is encrypted with.
+    """
+
+    # the posts exported are the ones between the requesting user and each exported user.
+    requester = identities.get(job.user_id)
+
+    with open(path, 'wb') as file:
+        writer = EncryptedArchiveWriter(file, key)
+        write_files(job, requester, writer)
+        writer.close()
+
+    return writer.tell()
+
+
+def write_files(job, requester, writer):
+    """Writes the zip archive of a job's csv files to a file object.
+
+    Args:
+        job -- the export job.
+        requester -- the user who requested the export.
+        writer -- the file object the archive is written to.
+    """
+
+    with zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for email in job.emails.split(','):
+            user = identities.get_by_email(email)
+
+            for type_name in job.record_types.split(','):
+                # users deleted since the job was submitted are left out.
+                if user is not None:
+                    if type_name == 'Posts':
+                        lines = post_lines(requester, user)
+                    else:
+                        lines = record_lines(user, get_record_type(type_name))
+
+                    # the csv is compressed as it is written, rather than built in memory.
+                    with archive.open(f'{email}/{type_name}.csv', 'w') as csvfile:
+                        for text in lines:
+                            csvfile.write(text.encode('utf-8'))
+
+                job.progress += 1
+                db.session.commit()
+
+
+def run_export(job_id, key):
+    """Writes the archive of a job on the export worker, inside an app context of its own.
+    The archive is written to a temporary file, which is only renamed once it is complete.
+
+    Args:
+        job_id -- the id of the job.
+        key -- the key the archive is encrypted with.
+    """
+
+    with app.app_context():
+        job = ExportJob.query.get(job_id)
+
+        # the job has expired, or its user has been deleted, since it was queued.
+        if job is None:
+            return
+
+        start = time.perf_counter()
+        path = archive_path(job)
+        partial_path = path.with_suffix('.part')
+        os.makedirs(path.parent, exist_ok=True)
+
+        job.status = 'running'
+        job.progress = 0
+        db.session.commit()
+
+        try:
+            size = write_archive(job, partial_path, key)
+            os.replace(partial_path, path)
+        except Exception:   # pylint: disable=broad-except
+            logger.exception('Export job %s failed', job_id)
+            db.session.rollback()
+            partial_path.unlink(missing_ok=True)
+            job.status = 'failed'
+        else:
+            job.status = 'complete'
+            job.size = size
+            logger.info('Exported %d files for job %s in %.3f s', job.total, job_id,
+                        time.perf_counter() - start)
+
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+@app.cli.command('clear-interrupted-exports')
+def clear_interrupted_exports():
+    """Marks the export jobs that are queued or were interrupted by a restart as failed,
+    and deletes their partial archives. Their keys were only held in memory by the server,
+    so they can't be run again, and must be submitted again instead."""
+
+    jobs = ExportJob.query.filter(ExportJob.status.in_(['queued', 'running'])).all()
+
+    for job in jobs:
+        archive_path(job).with_suffix('.part').unlink(missing_ok=True)
+        job.status = 'failed'
+        job.finished_at = datetime.utcnow()
+        print(f'Job {job.id}: failed.')
+
+    db.session.commit()
+
+
+@app.cli.command('purge-exports')
+def purge_exports():
+    """Deletes the export jobs and archives older than EXPORT_TTL, for running on a
+    schedule while no jobs are being submitted or downloaded."""
+
+    print(f'Deleted {purge_expired_jobs()} expired export jobs.')
@@ -0,0 +1,159 @@
+"""Module containing the identity cache, which looks up users by their id or email.
+
+Every web request loads the logged in user, and most pages and forms look up other
+users by their email. The cache keeps an immutable snapshot of each user's id, email,
+role, and names for IDENTITY_TTL seconds, so loading the logged in user doesn't query the
+User table. Lookups by email that write or authorise anything read the User table, since
+another process may have deleted the user since they were cached.
+Passwords aren't part of the snapshots, so logging in still reads the User row.
+Each user's current key id is cached by healthapp.keyring rather than here.
+
+Everything that creates, changes, or deletes users invalidates their snapshots
+through this module.
+
+Classes:
+    UserSnapshot -- immutable copy of a user's details, usable as the flask-login user.
+    IdentityCache -- finds user snapshots by id or email, caching them.
+
+Functions:
+    load_user -- loads the logged in user for flask-login.
+"""
+
+from flask_login import UserMixin
+from healthapp import app, db, login_manager
+from healthapp.models import User, user_deleted_callbacks
+from healthapp.keyring import TtlCache
+
+
+class UserSnapshot(UserMixin):
+    """
+    Immutable copy of a user's details. Has the attributes of User used by the pages,
+    and the methods flask-login needs of the logged in user. It isn't a tuple, so
+    flask-restful marshals a single snapshot as an object rather than a list.
+    """
+
+    fields = ('id', 'email', 'role', 'first_name', 'last_name')
+    __slots__ = fields
+
+    def __init__(self, *values):
+        for field, value in zip(self.fields, values):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('user snapshots are immutable')
+
+    def __repr__(self):
+        return f'UserSnapshot(id={self.id!r}, email={self.email!r})'
+
+    @classmethod
+    def columns(cls):
+        """Returns the User columns a snapshot is built from, in order."""
+        return [getattr(User, field) for field in cls.fields]
+
+
+class IdentityCache:
+    """
+    Finds users by their id or email, caching snapshots of them.
+    """
+
+    def __init__(self, max_size, ttl):
+        self._users = TtlCache(max_size, ttl)   # snapshots by user id.
+        self._user_ids = TtlCache(max_size, ttl)    # user ids by email.
+
+    def _cache(self, snapshot):
+        """Caches a snapshot under its id and email, returning it."""
+        self._users.set(snapshot.id, snapshot)
+        self._user_ids.set(snapshot.email, snapshot.id)
+
+        return snapshot
+
+    def get(self, user_id):
+        """
+        Returns the snapshot of the user with the given id, or None if there isn't one.
+
+        Args:
+            user_id -- the id of the user.
+        """
+        snapshot = self._users.get(user_id)
+
+        if snapshot is None:
+            row = db.session.query(*UserSnapshot.columns()).filter(User.id == user_id).first()
+
+            if row is None:
+                return None
+
+            snapshot = self._cache(UserSnapshot(*row))
+
+        return snapshot
+
+    def get_by_email(self, email, cached=False):
+        """
+        Returns the snapshot of the user with the given email, or None if there isn't one.
+        The user is read from the database unless cached is True, since a cached id may
+        belong to a user deleted or recreated by another process. A cached id that no
+        longer matches the database is dropped.
+
+        Args:
+            email -- the email of the user.
+            cached -- True to use the cached snapshot, for lookups that only display the
+                      user, and don't write or authorise anything.
+        """
+        user_id = self._user_ids.get(email)
+
+        if cached and user_id is not None:
+            snapshot = self.get(user_id)
+
+            # the email may have been changed since the id was cached, so it is checked too.
+            if snapshot is not None and snapshot.email == email:
+                return snapshot
+
+        row = db.session.query(*UserSnapshot.columns()).filter(User.email == email).first()
+
+        # drops the cached id if the user has been deleted, or recreated under a new id.
+        if user_id is not None and (row is None or row.id != user_id):
+            self.invalidate(user_id=user_id, email=email)
+
+        if row is None:
+            return None
+
+        return self._cache(UserSnapshot(*row))
+
+    def invalidate(self, user_id=None, email=None):
+        """
+        Removes a user's snapshot from the cache, so it is read from the database next time.
+        Called whenever a user is created, changed, or deleted.
+
+        Args:
+            user_id -- the id of the user, if known.
+            email -- an email of the user, old or new, if known.
+        """
+        if user_id is not None:
+            snapshot = self._users.get(user_id)
+            self._users.invalidate(user_id)
+
+            if snapshot is not None:
+                self._user_ids.invalidate(snapshot.email)
+
+        if email is not None:
+            self._user_ids.invalidate(email)
+
+    def clear(self):
+        """Removes all cached snapshots."""
+        self._users.clear()
+        self._user_ids.clear()
+
+
+# identity cache shared by the web app and api.
+identities = IdentityCache(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_TTL'])
+user_deleted_callbacks.append(lambda user_id: identities.invalidate(user_id=user_id))
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    """Loads user as current_user.
+
+    Args:
+        user_id -- id of logged in user.
+    """
+
+    return identities.get(int(user_id))
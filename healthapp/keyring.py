@@ -0,0 +1,198 @@
+"""Module containing the keyring, which looks up the users' encryption keys.
+
+Keys are stored in the EncryptionKey table rather than on the User row, and every
+encrypted row refers to the key it was encrypted with by the key's id. The keyring
+keeps the key material, and the id of each user's current key, in memory for
+KEYRING_TTL seconds, so decrypting and encrypting don't query the database for keys.
+
+Nothing tells the other processes when a key or user is deleted, so key and user ids are
+never reused, and a cached id can only ever name the key or user it was cached for.
+
+Classes:
+    TtlCache -- bounded cache whose entries expire after a number of seconds.
+    Keyring -- finds keys by id, the current key of each user, and creates new keys.
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+from cryptography.fernet import Fernet
+from healthapp import app, db
+from healthapp.models import EncryptionKey, user_deleted_callbacks
+
+
+class TtlCache:
+    """
+    Least recently used cache whose entries expire a number of seconds after being added.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size    # maximum number of entries held before evicting.
+        self.ttl = ttl      # number of seconds an entry is kept for.
+        self._entries = OrderedDict()   # (expiry time, value) pairs by name.
+        self._lock = Lock()     # requests are served from several threads.
+
+    def get(self, name):
+        """
+        Returns the cached value, or None if it isn't cached or has expired.
+
+        Args:
+            name -- the name the value was cached under.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+
+            if entry is None:
+                return None
+
+            if entry[0] < time.monotonic():
+                del self._entries[name]
+                return None
+
+            # marks the entry as the most recently used.
+            self._entries.move_to_end(name)
+            return entry[1]
+
+    def set(self, name, value):
+        """
+        Caches a value until it expires.
+
+        Args:
+            name -- the name to cache the value under.
+            value -- the value to be cached.
+        """
+        with self._lock:
+            self._entries[name] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(name)
+
+            # evicts the least recently used entry once the cache is full.
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, name):
+        """
+        Removes a value from the cache, if it is cached.
+
+        Args:
+            name -- the name the value was cached under.
+        """
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def clear(self):
+        """Removes all cached values."""
+        with self._lock:
+            self._entries.clear()
+
+
+class Keyring:
+    """
+    Finds encryption keys by their id, and the id of the key each user's new data is
+    encrypted with, caching both.
+    """
+
+    def __init__(self, max_size, ttl):
+        self._keys = TtlCache(max_size, ttl)    # key material by key id.
+        self._current_key_ids = TtlCache(max_size, ttl)    # current key id by user id.
+
+    def get_keys(self, key_ids):
+        """
+        Returns a dictionary of the key material for each of the key ids. Keys that aren't
+        cached are loaded in a single query. Raises a KeyError if a key doesn't exist.
+
+        Args:
+            key_ids -- the ids of the keys to be found.
+        """
+        keys = {}
+        missing_key_ids = set()
+
+        for key_id in set(key_ids):
+            key = self._keys.get(key_id)
+
+            if key is None:
+                missing_key_ids.add(key_id)
+            else:
+                keys[key_id] = key
+
+        if missing_key_ids:
+            for key_id, key in db.session.query(EncryptionKey.id, EncryptionKey.key) \
+                    .filter(EncryptionKey.id.in_(missing_key_ids)):
+                self._keys.set(key_id, key)
+                keys[key_id] = key
+
+            for key_id in missing_key_ids - keys.keys():
+                raise KeyError(f'Encryption key {key_id} not found')
+
+        return keys
+
+    def get_key(self, key_id):
+        """
+        Returns the key material for a key id. Raises a KeyError if the key doesn't exist.
+
+        Args:
+            key_id -- the id of the key to be found.
+        """
+        return self.get_keys([key_id])[key_id]
+
+    def current_key_id(self, user_id):
+        """
+        Returns the id of the key new data for the user is encrypted with, which is the
+        user's newest key. Raises a KeyError if the user has no keys.
+
+        Args:
+            user_id -- the id of the user.
+        """
+        key_id = self._current_key_ids.get(user_id)
+
+        if key_id is None:
+            key_id = db.session.query(EncryptionKey.id).filter_by(user_id=user_id) \
+                .order_by(EncryptionKey.id.desc()).limit(1).scalar()
+
+            if key_id is None:
+                raise KeyError(f'User {user_id} has no encryption key')
+
+            self._current_key_ids.set(user_id, key_id)
+
+        return key_id
+
+    def create_key(self, user):
+        """
+        Generates a new key for a user and adds it to the session, where it becomes the
+        user's current key once the session is committed.
+
+        Args:
+            user -- the user the key is for.
+        """
+        key = EncryptionKey(user=user, key=Fernet.generate_key().decode('utf-8'))
+        db.session.add(key)
+        db.session.flush()
+
+        # the new key replaces the user's cached current key once it is committed.
+        self.invalidate(user_id=key.user_id)
+
+        return key
+
+    def invalidate(self, user_id=None, key_id=None):
+        """
+        Removes a user's current key id and a key from the cache, so they are read
+        from the database next time.
+
+        Args:
+            user_id -- the id of the user whose current key id is removed, if given.
+            key_id -- the id of the key whose material is removed, if given.
+        """
+        if user_id is not None:
+            self._current_key_ids.invalidate(user_id)
+
+        if key_id is not None:
+            self._keys.invalidate(key_id)
+
+    def clear(self):
+        """Removes all cached keys and key ids."""
+        self._keys.clear()
+        self._current_key_ids.clear()
+
+
+# keyring shared by all the encryption functions.
+keyring = Keyring(app.config['KEYRING_CACHE_SIZE'], app.config['KEYRING_TTL'])
+user_deleted_callbacks.append(lambda user_id: keyring.invalidate(user_id=user_id))
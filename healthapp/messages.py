@@ -0,0 +1,154 @@
+"""Module containing functions for retrieving and decrypting user posts.
+
+All the pages, API resources, and downloads that show posts get them through
+this module, so the posts, their authors, and their recipients are always loaded
+in a single query and decrypted in one batch.
+
+Functions:
+    select_messages -- builds the query selecting posts with their author and recipient.
+    message_query -- builds the query for the posts involving a user.
+    find_message -- finds a single post by its id.
+    decrypt_messages -- decrypts the posts returned by message_query or find_message.
+    get_messages -- finds and decrypts the posts involving a user.
+    get_message_page -- finds and decrypts one page of the posts involving a user.
+    add_message -- encrypts and saves a new post.
+    timed_decrypt -- decrypts posts, logging how long loading and decrypting took.
+"""
+
+import time
+from sqlalchemy.orm import aliased
+from healthapp import app, db
+from healthapp.models import User, Post
+from healthapp.encryption import decrypt_batch, encrypt_post, post_view
+from healthapp.keyring import keyring
+from healthapp.pagination import paginate
+from healthapp.writes import insert_row
+
+# the User table is joined twice, once for the author and once for the recipient.
+Author = aliased(User)
+Recipient = aliased(User)
+
+
+def select_messages():
+    """Builds a query selecting only the columns needed to decrypt and display posts,
+    with each post's author and recipient joined in the same statement.
+    """
+
+    return db.session.query(Post.id, Post.title, Post.date_posted, Post.content,
+                            Post.user_id, Post.recipient_id, Post.key_id,
+                            Author.email.label('author_email'),
+                            Recipient.email.label('recipient_email')) \
+        .join(Author, Post.user_id == Author.id) \
+        .join(Recipient, Post.recipient_id == Recipient.id)
+
+
+def message_query(user, other_user=None):
+    """Builds a query for the posts sent or received by a user, newest first.
+
+    Args:
+        user -- the user whose posts are to be found.
+        other_user -- if given, only posts between user and other_user are found.
+    """
+
+    query = select_messages()
+
+    if other_user is None:
+        # all posts to or from the user.
+        query = query.where((Post.recipient_id == user.id) | (Post.user_id == user.id))
+    else:
+        # posts between the two users only.
+        query = query.where(((Post.user_id == other_user.id) & (Post.recipient_id == user.id))
+                            | ((Post.user_id == user.id) & (Post.recipient_id == other_user.id)))
+
+    return query.order_by(Post.date_posted.desc())
+
+
+def find_message(post_id):
+    """Finds a single post, returning None if no post has the given id.
+
+    Args:
+        post_id -- id of the post to be found.
+    """
+
+    return select_messages().where(Post.id == post_id).first()
+
+
+def decrypt_messages(encrypted_messages):
+    """Decrypts posts, each with the key of its recipient.
+
+    Args:
+        encrypted_messages -- posts returned by message_query or find_message.
+    """
+
+    return decrypt_batch(encrypted_messages, post_view)
+
+
+def get_messages(user, other_user=None):
+    """Finds and decrypts the posts sent or received by a user, newest first.
+
+    Args:
+        user -- the user whose posts are to be found.
+        other_user -- if given, only posts between user and other_user are found.
+    """
+
+    start = time.perf_counter()
+    encrypted_messages = message_query(user, other_user).all()
+
+    return timed_decrypt(encrypted_messages, start)
+
+
+def get_message_page(user, other_user, cursor, limit):
+    """Finds and decrypts one page of the posts sent or received by a user, newest first.
+    Returns the decrypted posts and the cursor to the next page.
+
+    Args:
+        user -- the user whose posts are to be found.
+        other_user -- if not None, only posts between user and other_user are found.
+        cursor -- the cursor returned with the previous page, or None for the first page.
+        limit -- the maximum number of posts on the page.
+    """
+
+    start = time.perf_counter()
+    encrypted_messages, next_cursor = paginate(message_query(user, other_user),
+                                               (Post.date_posted, Post.id), cursor, limit)
+
+    return timed_decrypt(encrypted_messages, start), next_cursor
+
+
+def add_message(author, recipient, title, content):
+    """Encrypts a new post with the recipient's key and saves it to the database, returning
+    its id.
+
+    Args:
+        author -- the user sending the post.
+        recipient -- the user the post is sent to.
+        title -- the title of the post.
+        content -- the content of the post, which is encrypted.
+    """
+
+    key_id = keyring.current_key_id(recipient.id)
+
+    return insert_row(Post, {'title': title,
+                             'content': encrypt_post(content, key_id),
+                             'user_id': author.id,
+                             'recipient_id': recipient.id,
+                             'key_id': key_id})
+
+
+def timed_decrypt(encrypted_messages, start):
+    """Decrypts posts, logging how long the query and decryption took to help spot
+    slow inboxes.
+
+    Args:
+        encrypted_messages -- posts returned by message_query.
+        start -- time the query was started, from time.perf_counter().
+    """
+
+    loaded = time.perf_counter()
+    messages = decrypt_messages(encrypted_messages)
+
+    app.logger.debug('Loaded %d posts in %.1fms and decrypted them in %.1fms',
+                     len(messages), (loaded - start) * 1000,
+                     (time.perf_counter() - loaded) * 1000)
+
+    return messages
@@ -1,29 +1,25 @@
 """Module containing the data models for the app.
 
+The logged in user is loaded through the identity cache in healthapp.identity.
+
 Classes:
     User -- database model for users.
+    EncryptionKey -- database model for the users' encryption keys.
     Post -- database model for user posts.
-    BloodPressure -- database model for blood pressure records.
-    Weight -- database model for weight records.
+    Record -- database model for medical records of every type.
+    SampleBlock -- database model for encrypted blocks of time-series samples.
+    RefreshToken -- database model for the api refresh tokens issued to users.
+    TokenEpoch -- database model for the epochs of the users whose api tokens were revoked.
+    ExportJob -- database model for the bulk export jobs requested by users.
 
 Functions:
     delete_user_from_db -- deletes a user and all associated data from the database.
 """
 
+import time
 from datetime import datetime
 from flask_login import UserMixin
-from healthapp import db, login_manager
-
-
-@login_manager.user_loader
-def load_user(user_id):
-    """Loads user as current_user.
-
-    Args:
-        user_id -- id of logged in user.
-    """
-
-    return User.query.get(int(user_id))
+from healthapp import app, db
 
 
 class User(db.Model, UserMixin):
@@ -36,12 +32,38 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String, unique=True, nullable=False)
     password = db.Column(db.String, nullable=False)
     role = db.Column(db.String, nullable=False)
-    key = db.Column(db.String, nullable=False)
 
     # relationships with the other tables in the database.
-    posts = db.relationship('Post', backref='author', lazy=True)
-    blood_pressure = db.relationship('BloodPressure', backref='author', lazy=True)
-    weight = db.relationship('Weight', backref='author', lazy=True)
+    keys = db.relationship('EncryptionKey', backref='user', lazy=True)
+    posts = db.relationship('Post', backref='author', lazy=True, foreign_keys='Post.user_id')
+    received_posts = db.relationship('Post', backref='recipient', lazy=True,
+                                     foreign_keys='Post.recipient_id')
+    records = db.relationship('Record', backref='author', lazy=True)
+    sample_blocks = db.relationship('SampleBlock', backref='author', lazy=True)
+    refresh_tokens = db.relationship('RefreshToken', backref='user', lazy=True)
+    export_jobs = db.relationship('ExportJob', backref='user', lazy=True)
+
+    # the ids of deleted users are never handed out again, as other processes may still
+    # have them cached.
+    __table_args__ = {'sqlite_autoincrement': True}
+
+
+class EncryptionKey(db.Model):
+    """Encryption key table in database. Stores the keys each user's data is encrypted with.
+    Encrypted rows refer to the key they were encrypted with by its id, and a user's newest
+    key is used for new data. Keys are looked up through healthapp.keyring."""
+
+    # database columns.
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # foreign key for the backref in the User table.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+    # the ids of deleted keys are never handed out again, so a key cached by another
+    # process under its id can't belong to a different key or user.
+    __table_args__ = {'sqlite_autoincrement': True}
 
 
 class Post(db.Model):
@@ -50,68 +72,164 @@ class Post(db.Model):
     # database columns.
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String, nullable=False)
-    recipient = db.Column(db.String, nullable=False)
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    content = db.Column(db.Text, nullable=False)
+    content = db.Column(db.LargeBinary, nullable=False)    # raw bytes of the encrypted post.
 
-    # foreign key for the backref in the User table.
+    # foreign keys for the author and recipient backrefs in the User table.
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_post_recipient_id_user'),
+                             nullable=False)
+    # the recipient's key the post is encrypted with.
+    key_id = db.Column(db.Integer, db.ForeignKey('encryption_key.id',
+                                                 name='fk_post_key_id_encryption_key'),
+                       nullable=False)
+
+    # indexes for finding the posts received and sent by a user, newest first.
+    __table_args__ = (db.Index('ix_post_recipient_id_date_posted', 'recipient_id', 'date_posted'),
+                      db.Index('ix_post_user_id_date_posted', 'user_id', 'date_posted'))
 
 
-class BloodPressure(db.Model):
-    """Blood pressure table in database. Stores blood pressure records for all astronauts."""
+class Record(db.Model):
+    """Record table in database. Stores the medical records of every type for all astronauts.
+    The record types are listed in the registry in healthapp.records."""
 
     # database columns.
     id = db.Column(db.Integer, primary_key=True)
-    record = db.Column(db.String, nullable=False)
+    metric_type = db.Column(db.String, nullable=False)
+    record = db.Column(db.LargeBinary, nullable=False)     # raw bytes of the encrypted record.
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
-    # foreign key for the backref int eh User table.
+    # foreign key for the backref in the User table.
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # the user's key the record is encrypted with.
+    key_id = db.Column(db.Integer, db.ForeignKey('encryption_key.id',
+                                                 name='fk_record_key_id_encryption_key'),
+                       nullable=False)
 
+    # index for finding a user's records of one type, newest first.
+    __table_args__ = (db.Index('ix_record_user_id_metric_type_date_posted',
+                               'user_id', 'metric_type', 'date_posted'),)
 
-class Weight(db.Model):
-    """Weight table in database. Stores weight records for all astronauts."""
+
+class SampleBlock(db.Model):
+    """Sample block table in database. Stores high frequency time-series data, such as from
+    wearables, with many consecutive samples of one record type compressed and encrypted
+    together. The time range of the samples is kept unencrypted so that range reads
+    only decrypt the blocks they overlap."""
 
     # database columns.
     id = db.Column(db.Integer, primary_key=True)
-    record = db.Column(db.String, nullable=False)
-    date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    metric_type = db.Column(db.String, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    sample_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)   # raw bytes of the encrypted samples.
 
-    # foreign key for the backref int eh User table.
+    # foreign key for the backref in the User table.
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # the user's key the samples are encrypted with.
+    key_id = db.Column(db.Integer, db.ForeignKey('encryption_key.id',
+                                                 name='fk_sample_block_key_id_encryption_key'),
+                       nullable=False)
+
+    # index for finding the blocks of one record type that overlap a time range.
+    __table_args__ = (db.Index('ix_sample_block_user_id_metric_type_start_time',
+                               'user_id', 'metric_type', 'start_time'),)
+
+
+class RefreshToken(db.Model):
+    """Refresh token table in database. Stores a hash of each refresh token issued to an api
+    user, which can be exchanged for a new access token without the user's password."""
+
+    # database columns.
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String, nullable=False, unique=True)    # sha-256 of the token.
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    # foreign key for the backref in the User table.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+
+class TokenEpoch(db.Model):
+    """Token epoch table in database. Stores the epoch of each user whose api tokens have
+    been revoked, shared by all the processes serving the api. Tokens issued before the
+    epoch was bumped are rejected. The rows outlive their users, so the tokens of deleted
+    users stay revoked, which is safe as user ids are never reused."""
+
+    # database columns.
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    epoch = db.Column(db.Integer, nullable=False)
+
+
+class ExportJob(db.Model):
+    """Export job table in database. Stores each bulk export requested by a user, and its
+    progress, while it is run in the background by healthapp.exports."""
+
+    # database columns.
+    id = db.Column(db.String, primary_key=True)    # random, so jobs can't be guessed.
+    emails = db.Column(db.String, nullable=False)  # comma separated emails of the users exported.
+    record_types = db.Column(db.String, nullable=False)    # comma separated, may include Posts.
+    status = db.Column(db.String, nullable=False, default='queued')
+    progress = db.Column(db.Integer, nullable=False, default=0)    # files written so far.
+    total = db.Column(db.Integer, nullable=False)  # files in the finished archive.
+    size = db.Column(db.Integer)   # bytes in the finished archive.
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    # foreign key for the backref in the User table, the user who requested the export.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+
+# functions called with the id of each deleted user, to drop anything cached for them.
+user_deleted_callbacks = []
 
 
 def delete_user_from_db(email):
-    """Deletes user and all associated data, if the user exists.
+    """Deletes user and all associated data, if the user exists. Each table is cleared
+    with a single bulk delete, and all the deletes are committed in one transaction.
+    Returns the number of rows deleted from each table, or None if the user doesn't exist.
 
     Args:
         email -- email of the user to be deleted.
     """
 
+    start = time.perf_counter()
+
     # pulls user from the database
     user = User.query.filter_by(email=email).first()
 
-    if user:
-        # finds all data associated with the user in the database.
-        posts_received = Post.query.filter_by(recipient=user.email).all()
-        posts_sent = Post.query.filter_by(user_id=user.id).all()
-        blood_pressures = BloodPressure.query.filter_by(user_id=user.id).all()
-        weights = Weight.query.filter_by(user_id=user.id).all()
+    if not user:
+        return None
+
+    user_id = user.id
+
+    # deletes all data associated with the user without loading it into the session.
+    posts = Post.query.filter((Post.user_id == user.id) | (Post.recipient_id == user.id))
+    deleted = {
+        'record': Record.query.filter_by(user_id=user.id).delete(synchronize_session=False),
+        'sample_block': SampleBlock.query.filter_by(user_id=user.id).delete(
+            synchronize_session=False),
+        'post': posts.delete(synchronize_session=False),
+        'refresh_token': RefreshToken.query.filter_by(user_id=user.id).delete(
+            synchronize_session=False),
+        'export_job': ExportJob.query.filter_by(user_id=user.id).delete(
+            synchronize_session=False),
+    }
 
-        # deletes all associated data from the database.
-        for weight in weights:
-            db.session.delete(weight)
+    # the keys go last, as the user's encrypted rows refer to them.
+    deleted['encryption_key'] = EncryptionKey.query.filter_by(user_id=user.id).delete(
+        synchronize_session=False)
 
-        for blood_pressure in blood_pressures:
-            db.session.delete(blood_pressure)
+    # deletes user from the database and commits the changes.
+    deleted['user'] = User.query.filter_by(id=user.id).delete(synchronize_session=False)
+    db.session.commit()
 
-        for post in posts_sent:
-            db.session.delete(post)
+    # drops anything cached for the user, and revokes their api tokens.
+    for callback in user_deleted_callbacks:
+        callback(user_id)
 
-        for post in posts_received:
-            db.session.delete(post)
+    app.logger.info('Deleted user %s and their data %s in %.1fms', email, deleted,
+                    (time.perf_counter() - start) * 1000)
 
-        # deletes user form the database and commits the changes.
-        db.session.delete(user)
-        db.session.commit()
+    return deleted
@@ -0,0 +1,116 @@
+"""Module containing functions for keyset pagination.
+
+Pages are read by seeking past the last row of the previous page,
+rather than with an offset, so every page costs the same however far back it is.
+The position of the next page is passed around as an opaque cursor.
+
+Functions:
+    encode_cursor -- builds the cursor pointing after a row.
+    decode_cursor -- reads the column values stored in a cursor.
+    paginate -- returns one page of a query and the cursor to the next page.
+"""
+
+import base64
+import json
+from datetime import datetime
+from flask import abort
+
+
+def encode_cursor(row, columns):
+    """Builds an opaque cursor from the values of the given columns in a row.
+
+    Args:
+        row -- the last row on the current page.
+        columns -- the columns the query is ordered by.
+    """
+
+    values = []
+
+    for column in columns:
+        value = getattr(row, column.key)
+        # dates are stored as iso format strings so the cursor can be json encoded.
+        values.append(value.isoformat() if isinstance(value, datetime) else value)
+
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode('utf-8')
+
+
+def decode_cursor(cursor, columns):
+    """Reads the column values from a cursor. Raises a ValueError if it is invalid.
+
+    Args:
+        cursor -- the cursor built by encode_cursor.
+        columns -- the columns the query is ordered by.
+    """
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as error:
+        raise ValueError('Invalid cursor') from error
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('Invalid cursor')
+
+    decoded_values = []
+
+    for column, value in zip(columns, values):
+        # booleans are ints to isinstance, but are never stored in a cursor.
+        if isinstance(value, bool):
+            raise ValueError('Invalid cursor')
+
+        if column.type.python_type is datetime:
+            if not isinstance(value, str):
+                raise ValueError('Invalid cursor')
+
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError as error:
+                raise ValueError('Invalid cursor') from error
+
+        elif not isinstance(value, column.type.python_type):
+            raise ValueError('Invalid cursor')
+
+        decoded_values.append(value)
+
+    return decoded_values
+
+
+def paginate(query, columns, cursor, limit, descending=True):
+    """Returns one page of a query along with the cursor to the next page.
+    The cursor is None when there are no more pages. An invalid cursor returns a
+    bad request error.
+
+    Args:
+        query -- the query to be paginated.
+        columns -- the columns to order by, ending with a unique column such as the id.
+        cursor -- the cursor returned with the previous page, or None for the first page.
+        limit -- the maximum number of rows on the page.
+        descending -- True for newest first, False for oldest first.
+    """
+
+    # replaces any existing ordering with the columns the cursor is built from.
+    if descending:
+        query = query.order_by(None).order_by(*[column.desc() for column in columns])
+    else:
+        query = query.order_by(None).order_by(*columns)
+
+    if cursor:
+        try:
+            values = decode_cursor(cursor, columns)
+        except ValueError:
+            return abort(400, 'Invalid page cursor.')
+
+        # rows that come after the cursor: (a < x) or (a = x and b < y) and so on.
+        condition = None
+        for i in reversed(range(len(columns))):
+            after = columns[i] < values[i] if descending else columns[i] > values[i]
+            condition = after if condition is None else after | ((columns[i] == values[i])
+                                                                 & condition)
+        query = query.where(condition)
+
+    # one extra row is read to find out if there is a next page.
+    rows = query.limit(limit + 1).all()
+
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1], columns)
+
+    return rows, None
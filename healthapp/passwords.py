@@ -0,0 +1,96 @@
+"""Module containing functions for hashing and checking passwords.
+
+Bcrypt is deliberately slow, so hashing on the request threads lets a burst of logins
+hold up every other request. Instead, passwords are hashed on a dedicated pool of
+PASSWORD_HASH_WORKERS threads, which caps the cpu time spent on hashing at once,
+and the requests wait for their result. At most PASSWORD_QUEUE_LIMIT passwords may be
+waiting or being hashed, and further logins are turned away with a 503 error
+until the queue drains. The queue depth is logged and returned with the error. The bcrypt work factor is set by BCRYPT_LOG_ROUNDS.
+
+Classes:
+    PasswordQueueFull -- error returned when too many passwords are waiting to be hashed.
+
+Functions:
+    queue_depth -- returns the number of passwords waiting or being hashed.
+    run_in_pool -- runs a bcrypt function on the password pool.
+    hash_password -- hashes a new password.
+    check_password -- checks a password against its hash.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from werkzeug.exceptions import ServiceUnavailable
+from healthapp import app, bcrypt
+
+
+class PasswordQueueFull(ServiceUnavailable):
+    """
+    Error returned when the password queue is full. Sent as a 503 response asking the
+    client to retry after a second, by both the web app and the api, with the number of
+    passwords queued.
+    """
+
+    def __init__(self, depth):
+        super().__init__(f'Too many logins at once, with {depth} waiting. '
+                         f'Please try again shortly.', retry_after=1)
+        self.depth = depth
+
+
+# bcrypt releases the gil while hashing, so the threads hash in parallel.
+password_pool = ThreadPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                                   thread_name_prefix='password')
+# number of passwords waiting or being hashed.
+pending = 0
+pending_lock = Lock()
+
+
+def queue_depth():
+    """Returns the number of passwords waiting to be hashed or being hashed."""
+
+    return pending
+
+
+def run_in_pool(function, *args):
+    """Runs a bcrypt function on the password pool and returns its result. Raises
+    PasswordQueueFull if PASSWORD_QUEUE_LIMIT passwords are already queued.
+
+    Args:
+        function -- the function to be run.
+        args -- the arguments to call the function with.
+    """
+
+    global pending
+
+    with pending_lock:
+        if pending >= app.config['PASSWORD_QUEUE_LIMIT']:
+            app.logger.warning('Password queue full with %d passwords', queue_depth())
+            raise PasswordQueueFull(queue_depth())
+
+        pending += 1
+
+    try:
+        return password_pool.submit(function, *args).result()
+    finally:
+        with pending_lock:
+            pending -= 1
+
+
+def hash_password(password):
+    """Returns the bcrypt hash of a password as a utf-8 string, to be stored in the database.
+
+    Args:
+        password -- the password to be hashed.
+    """
+
+    return run_in_pool(bcrypt.generate_password_hash, password).decode('utf-8')
+
+
+def check_password(password_hash, password):
+    """Returns whether a password matches its stored hash.
+
+    Args:
+        password_hash -- the hash stored in the database.
+        password -- the password to be checked.
+    """
+
+    return run_in_pool(bcrypt.check_password_hash, password_hash, password)
@@ -0,0 +1,292 @@
+"""Module containing the storage and key functions used by the request limiter.
+
+The limiter's default memory storage belongs to a single process, so with several
+worker processes each enforced its own limits, and the counts were lost on a restart.
+Instead, hits are recorded in a small sqlite database, RATELIMIT_DATABASE, shared by
+every process on the host, and limits are enforced over a moving window rather than
+fixed hours and days.
+
+Limits are counted per user, taken from the api token or the web app session, and per
+address for requests that aren't logged in. Each endpoint costs RATELIMIT_COSTS[endpoint]
+hits, or one hit if it isn't listed, so exports and bulk reads use up more of a user's
+limits than single reads.
+
+Classes:
+    SqliteStorage -- limiter storage recording hits in a shared sqlite database.
+    WeightedMovingWindowRateLimiter -- moving window strategy charging each endpoint's cost.
+
+Functions:
+    request_cost -- returns the number of hits the current request costs.
+    rate_limit_key -- returns the key the current request is limited by.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from flask import current_app, has_request_context, request, session
+from flask_limiter.util import get_remote_address
+from limits.storage import Storage
+from limits.strategies import STRATEGIES, MovingWindowRateLimiter
+
+# seconds between clearing out the expired hits of every key.
+PURGE_INTERVAL = 60
+
+
+class SqliteStorage(Storage):
+    """
+    Limiter storage recording hits in a sqlite database, so the limits are shared by all
+    the processes on a host and kept across restarts. Selected with a storage url of the
+    form sqlite:///<path to database>.
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri, timeout=5, **options):
+        super().__init__(uri, **options)
+        self.path = uri[len('sqlite:///'):]
+        self.timeout = timeout
+        self._local = threading.local()     # sqlite connections can't be shared by threads.
+        self._last_purge = 0
+
+        with self._transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS hit ('
+                               'key TEXT NOT NULL, time REAL NOT NULL, '
+                               'expires_at REAL NOT NULL, cost INTEGER NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_hit_key_time ON hit (key, time)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_hit_expires_at ON hit (expires_at)')
+            connection.execute('CREATE TABLE IF NOT EXISTS counter ('
+                               'key TEXT PRIMARY KEY, count INTEGER NOT NULL, '
+                               'expires_at REAL NOT NULL)')
+
+    def _connection(self):
+        """Returns this thread's connection to the database, opening it if needed."""
+        connection = getattr(self._local, 'connection', None)
+
+        # forked workers open connections of their own.
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            # lets the processes read while one of them writes.
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    def _transaction(self):
+        """Returns a context manager running a write transaction on the database. The
+        transaction holds the write lock from the start, so other processes can't count
+        the same hits at once."""
+        return _Transaction(self._connection())
+
+    def _purge(self, connection, now):
+        """Deletes expired hits and counters, at most once every PURGE_INTERVAL seconds."""
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+
+        self._last_purge = now
+        connection.execute('DELETE FROM hit WHERE expires_at < ?', (now,))
+        connection.execute('DELETE FROM counter WHERE expires_at < ?', (now,))
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        """
+        Increments the fixed window counter of a key, returning its new count.
+
+        Args:
+            key -- the rate limit key.
+            expiry -- the seconds the window lasts.
+            elastic_expiry -- whether each hit extends the window.
+            amount -- the number of hits to add.
+        """
+        now = time.time()
+
+        with self._transaction() as connection:
+            row = connection.execute('SELECT count, expires_at FROM counter WHERE key = ?',
+                                     (key,)).fetchone()
+
+            if row is None or row[1] < now:
+                count, expires_at = amount, now + expiry
+            else:
+                count = row[0] + amount
+                expires_at = now + expiry if elastic_expiry else row[1]
+
+            connection.execute('INSERT OR REPLACE INTO counter (key, count, expires_at) '
+                               'VALUES (?, ?, ?)', (key, count, expires_at))
+
+        return count
+
+    def get(self, key):
+        """
+        Returns the fixed window count of a key.
+
+        Args:
+            key -- the rate limit key.
+        """
+        row = self._connection().execute('SELECT count FROM counter '
+                                          'WHERE key = ? AND expires_at >= ?',
+                                          (key, time.time())).fetchone()
+
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        """
+        Returns the time the fixed window of a key ends.
+
+        Args:
+            key -- the rate limit key.
+        """
+        row = self._connection().execute('SELECT expires_at FROM counter WHERE key = ?',
+                                          (key,)).fetchone()
+
+        return int(row[0]) if row else int(time.time())
+
+    def acquire_entry(self, key, limit, expiry, no_add=False, cost=1):
+        """
+        Records a hit of the given cost in the moving window of a key, returning whether
+        it fits within the limit. Hits that don't fit aren't recorded.
+
+        Args:
+            key -- the rate limit key.
+            limit -- the most hits allowed in the window.
+            expiry -- the seconds the window covers.
+            no_add -- whether to only check the hit would fit, without recording it.
+            cost -- the number of hits the request counts as.
+        """
+        now = time.time()
+
+        with self._transaction() as connection:
+            self._purge(connection, now)
+
+            used, = connection.execute('SELECT COALESCE(SUM(cost), 0) FROM hit '
+                                       'WHERE key = ? AND time > ?',
+                                       (key, now - expiry)).fetchone()
+
+            if used + cost > limit:
+                return False
+
+            if not no_add:
+                connection.execute('INSERT INTO hit (key, time, expires_at, cost) '
+                                   'VALUES (?, ?, ?, ?)', (key, now, now + expiry, cost))
+
+        return True
+
+    def get_moving_window(self, key, limit, expiry):
+        """
+        Returns the time of the oldest hit in the moving window of a key, and the total
+        cost of the hits in it.
+
+        Args:
+            key -- the rate limit key.
+            limit -- the most hits allowed in the window.
+            expiry -- the seconds the window covers.
+        """
+        now = time.time()
+        oldest, used = self._connection().execute(
+            'SELECT MIN(time), COALESCE(SUM(cost), 0) FROM hit WHERE key = ? AND time > ?',
+            (key, now - expiry)).fetchone()
+
+        return int(oldest if oldest is not None else now), used
+
+    def check(self):
+        """Returns whether the database can be read."""
+        try:
+            self._connection().execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        """Deletes every hit and counter, returning the number deleted."""
+        with self._transaction() as connection:
+            deleted = connection.execute('DELETE FROM hit').rowcount
+            deleted += connection.execute('DELETE FROM counter').rowcount
+
+        return deleted
+
+    def clear(self, key):
+        """
+        Deletes the hits and counter of a key.
+
+        Args:
+            key -- the rate limit key.
+        """
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM hit WHERE key = ?', (key,))
+            connection.execute('DELETE FROM counter WHERE key = ?', (key,))
+
+
+class _Transaction:
+    """
+    Context manager running an immediate transaction on a connection, committed on
+    success and rolled back on error.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+class WeightedMovingWindowRateLimiter(MovingWindowRateLimiter):
+    """
+    Moving window strategy which charges each request the cost of its endpoint, rather
+    than one hit. Selected with the weighted-moving-window strategy.
+    """
+
+    def hit(self, item, *identifiers):
+        """
+        Records the current request's cost against a limit, returning whether it fits.
+
+        Args:
+            item -- the limit being hit.
+            identifiers -- the key and scope of the limit.
+        """
+        return self.storage().acquire_entry(item.key_for(*identifiers), item.amount,
+                                            item.get_expiry(), cost=request_cost())
+
+
+STRATEGIES['weighted-moving-window'] = WeightedMovingWindowRateLimiter
+
+
+def request_cost():
+    """Returns the number of hits the current request counts as, from RATELIMIT_COSTS."""
+
+    if not has_request_context():
+        return 1
+
+    return current_app.config['RATELIMIT_COSTS'].get(request.endpoint, 1)
+
+
+def rate_limit_key():
+    """Returns the key the current request is limited by: the id of the user logged in to
+    the api or web app, or otherwise the address the request came from."""
+
+    # imported here, as the tokens module needs the app to be set up first.
+    from healthapp.restapi.tokens import read_token  # pylint: disable=import-outside-toplevel
+
+    token = request.values.get('token')
+    header = request.headers.get('Authorization', '')
+
+    if not token and header.startswith('Bearer '):
+        token = header[len('Bearer '):]
+
+    if token:
+        user = read_token(token)
+
+        if user is not None:
+            return f'user:{user.id}'
+
+    # flask-login keeps the id of the logged in user in the session.
+    user_id = session.get('_user_id')
+
+    if user_id is not None:
+        return f'user:{user_id}'
+
+    return f'address:{get_remote_address()}'
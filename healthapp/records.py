@@ -0,0 +1,562 @@
+"""Module containing the record type registry and functions for medical records.
+
+Every type of medical record is stored in the same Record table, tagged with the
+name of its type. New metrics are added by registering them here, and the web
+pages, api, and downloads pick them up without any new tables or routes.
+
+The decrypted records of each user and type are cached, newest first, for
+RECORD_CACHE_TTL seconds. Each cached list is versioned by the id of the user's newest
+record of that type, so reading a page only costs one query for that id while nothing
+has changed, and only the records added since are decrypted when something has. Record
+ids are shared by all users and types, so a new record is added to its cached list when
+the newest id before it, for that user and type, is the list's version.
+
+Records within a time range are read with the index on the user, type, and date posted,
+so only the records in the range are loaded and decrypted.
+
+Classes:
+    RecordType -- describes a type of medical record.
+    CachedRecords -- the cached decrypted records of one type for one user.
+    RecordCache -- bounded cache of decrypted records, by user and record type.
+
+Functions:
+    register_record_type -- adds a record type to the registry.
+    get_record_type -- finds a registered record type by name.
+    record_query -- builds the query for a user's records of one type.
+    in_range -- checks whether a record's time is within a time range.
+    range_query -- builds the query for a user's records of one type within a time range.
+    row_size -- returns the rough number of bytes a cached record takes up.
+    latest_record_id -- finds the id of a user's newest record of one type.
+    decrypt_rows -- decrypts records into the rows held by the cache.
+    current_records -- returns the cached records of one type, brought up to date.
+    add_record -- encrypts and saves a new record.
+    add_records -- encrypts and saves a batch of new records, a chunk at a time.
+    get_records -- finds and decrypts all of a user's records of one type.
+    get_record_page -- finds and decrypts one page of a user's records of one type.
+    get_record_series -- summarises a user's records of one type as a downsampled series.
+"""
+
+import sys
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from threading import Lock
+from flask import abort
+from sqlalchemy import func
+from healthapp import app, db
+from healthapp.models import Record, user_deleted_callbacks
+from healthapp.encryption import encrypt_medical_record, encrypt_many, decrypt_medical_record
+from healthapp.keyring import keyring
+from healthapp.writes import insert_row
+from healthapp.pagination import paginate, encode_cursor, decode_cursor
+from healthapp.series import downsample
+
+# a decrypted record held by the cache, with the columns its pages are ordered by.
+CachedRecord = namedtuple('CachedRecord', ['date_posted', 'id', 'view'])
+# the columns record pages are ordered and paginated by.
+page_columns = (Record.date_posted, Record.id)
+
+
+class RecordType:
+    """
+    A type of medical record, such as blood pressure or weight.
+    """
+
+    def __init__(self, name, label):
+        self.name = name    # name used in urls, the api, and the database.
+        self.label = label  # name shown on the web pages.
+
+
+# registered record types by name, in the order they are listed on the web pages.
+record_types = {}
+
+
+def register_record_type(name, label):
+    """Adds a record type to the registry and returns it.
+
+    Args:
+        name -- name used in urls, the api, and the database.
+        label -- name shown on the web pages.
+    """
+
+    record_types[name] = RecordType(name, label)
+
+    return record_types[name]
+
+
+def get_record_type(name):
+    """Returns the registered record type with the given name, or None if there isn't one.
+
+    Args:
+        name -- name of the record type.
+    """
+
+    return record_types.get(name)
+
+
+# the record types astronauts can submit.
+register_record_type('blood_pressure', 'Blood Pressure')
+register_record_type('weight', 'Weight')
+register_record_type('heart_rate', 'Heart Rate')
+register_record_type('spo2', 'SpO2')
+register_record_type('temperature', 'Temperature')
+
+
+def record_query(record_type, user):
+    """Builds the query for a user's records of one type.
+
+    Args:
+        record_type -- the type of the records.
+        user -- the user the records belong to.
+    """
+
+    return Record.query.filter_by(user_id=user.id, metric_type=record_type.name)
+
+
+def in_range(date_posted, start, end):
+    """Returns whether a record posted at the given time is within a time range.
+
+    Args:
+        date_posted -- the time the record was posted.
+        start -- the earliest time to include, or None for no limit.
+        end -- the latest time to include, or None for no limit.
+    """
+
+    return (start is None or date_posted >= start) and (end is None or date_posted <= end)
+
+
+def range_query(record_type, user, start, end):
+    """Builds the query for a user's records of one type within a time range.
+
+    Args:
+        record_type -- the type of the records.
+        user -- the user the records belong to.
+        start -- the earliest time to include, or None for no limit.
+        end -- the latest time to include, or None for no limit.
+    """
+
+    query = record_query(record_type, user)
+
+    if start is not None:
+        query = query.filter(Record.date_posted >= start)
+    if end is not None:
+        query = query.filter(Record.date_posted <= end)
+
+    return query
+
+
+def row_size(row):
+    """Returns the rough number of bytes of memory a cached record takes up.
+
+    Args:
+        row -- the CachedRecord.
+    """
+
+    return sys.getsizeof(row.view) + sum(map(sys.getsizeof, row.view.values()))
+
+
+class CachedRecords:
+    """
+    The decrypted records of one type for one user, newest first. Holds every record
+    from the newest down to some point, or all of them once complete is True.
+    """
+
+    def __init__(self, latest_id, rows, complete, expires, size=None):
+        self.latest_id = latest_id  # id of the newest record when read, None if there were none.
+        self.rows = rows    # list of CachedRecord, newest first.
+        self.complete = complete    # whether the rows go back to the oldest record.
+        self.expires = expires  # time.monotonic() after which the rows are dropped.
+        # rough number of bytes of memory the decrypted records take up, kept as a running
+        # total by callers that already know it.
+        self.size = sum(map(row_size, rows)) if size is None else size
+
+
+class RecordCache:
+    """
+    Least recently used cache of decrypted records, by user id and record type. The cache
+    is bounded by the memory the records take up rather than the number of lists, and
+    lists are dropped once they are older than the ttl, however often they are updated.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes  # most bytes of records held before evicting.
+        self.ttl = ttl      # number of seconds a list of records is kept for.
+        self._entries = OrderedDict()   # CachedRecords by (user id, record type name).
+        self._size = 0
+        self._lock = Lock()     # requests are served from several threads.
+
+    def _remove(self, name):
+        """Removes an entry, the lock must be held."""
+        entry = self._entries.pop(name, None)
+
+        if entry is not None:
+            self._size -= entry.size
+
+    def get(self, user_id, type_name):
+        """
+        Returns the cached records, or None if they aren't cached or have expired.
+
+        Args:
+            user_id -- the id of the user the records belong to.
+            type_name -- the name of the record type.
+        """
+        with self._lock:
+            entry = self._entries.get((user_id, type_name))
+
+            if entry is None:
+                return None
+
+            if entry.expires < time.monotonic():
+                self._remove((user_id, type_name))
+                return None
+
+            # marks the entry as the most recently used.
+            self._entries.move_to_end((user_id, type_name))
+            return entry
+
+    def put(self, user_id, type_name, latest_id, rows, complete, previous=None, size=None):
+        """
+        Caches a list of records, returning the new entry. Lists too large for the cache
+        on their own aren't cached.
+
+        Args:
+            user_id -- the id of the user the records belong to.
+            type_name -- the name of the record type.
+            latest_id -- the id of the user's newest record of the type, the version.
+            rows -- list of CachedRecord, newest first.
+            complete -- whether the rows go back to the oldest record.
+            previous -- the entry being updated, whose expiry time is kept.
+            size -- the size of the rows, if already known.
+        """
+        expires = previous.expires if previous else time.monotonic() + self.ttl
+        entry = CachedRecords(latest_id, rows, complete, expires, size)
+
+        with self._lock:
+            self._store((user_id, type_name), entry)
+
+        return entry
+
+    def _store(self, name, entry):
+        """Replaces an entry, evicting others until the records fit, the lock must be held."""
+        self._remove(name)
+
+        if entry.size > self.max_bytes:
+            return
+
+        self._entries[name] = entry
+        self._size += entry.size
+
+        # evicts the least recently used lists until the records fit.
+        while self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def add(self, user_id, type_name, row, previous_id):
+        """
+        Adds a newly saved record to the cached list, if the list was up to date before it
+        was saved, which is the case when the newest record before it is the list's newest.
+        Otherwise other records have been saved that the list doesn't have, so the list is
+        dropped, and read again when it is next needed.
+
+        Args:
+            user_id -- the id of the user the record belongs to.
+            type_name -- the name of the record type.
+            row -- the new CachedRecord.
+            previous_id -- the id of the user's newest record of the type before this one,
+                           or None if there wasn't one.
+        """
+        with self._lock:
+            entry = self._entries.get((user_id, type_name))
+
+            if entry is None:
+                return
+
+            # the check and the update are made under the same lock, so concurrent saves
+            # can't both pass it.
+            if entry.latest_id == previous_id and entry.expires >= time.monotonic():
+                self._store((user_id, type_name),
+                            CachedRecords(row.id, [row] + entry.rows, entry.complete,
+                                          entry.expires, entry.size + row_size(row)))
+            else:
+                self._remove((user_id, type_name))
+
+    def invalidate_user(self, user_id):
+        """
+        Removes all the cached records of a user.
+
+        Args:
+            user_id -- the id of the user.
+        """
+        with self._lock:
+            for name in [name for name in self._entries if name[0] == user_id]:
+                self._remove(name)
+
+    def clear(self):
+        """Removes all cached records."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+# cache shared by all the record functions.
+record_cache = RecordCache(app.config['RECORD_CACHE_MAX_BYTES'], app.config['RECORD_CACHE_TTL'])
+user_deleted_callbacks.append(record_cache.invalidate_user)
+
+
+def latest_record_id(record_type, user):
+    """Returns the id of the user's newest record of one type, or None if there are none.
+
+    Args:
+        record_type -- the type of the records.
+        user -- the user the records belong to.
+    """
+
+    return db.session.query(func.max(Record.id)) \
+        .filter_by(user_id=user.id, metric_type=record_type.name).scalar()
+
+
+def decrypt_rows(encrypted_records, user):
+    """Decrypts records, returning them as the CachedRecord rows held by the cache.
+
+    Args:
+        encrypted_records -- the records to be decrypted.
+        user -- the user the records belong to.
+    """
+
+    views = decrypt_medical_record(encrypted_records, user.email)
+
+    return [CachedRecord(record.date_posted, record.id, view)
+            for record, view in zip(encrypted_records, views)]
+
+
+def current_records(record_type, user):
+    """Returns the user's cached records of one type, after adding any records saved since
+    they were cached, along with the id of the user's newest record of the type.
+    The records are None if they aren't cached.
+
+    Args:
+        record_type -- the type of the records.
+        user -- the user the records belong to.
+    """
+
+    latest_id = latest_record_id(record_type, user)
+    entry = record_cache.get(user.id, record_type.name)
+
+    if entry is None or entry.latest_id == latest_id:
+        return entry, latest_id
+
+    # records have been deleted, and their ids may have been reused.
+    if latest_id is None or (entry.latest_id is not None and latest_id < entry.latest_id):
+        record_cache.invalidate_user(user.id)
+        return None, latest_id
+
+    # decrypts only the records saved since the list was cached.
+    query = record_query(record_type, user)
+    if entry.latest_id is not None:
+        query = query.filter(Record.id > entry.latest_id)
+
+    cached_ids = {row.id for row in entry.rows}
+    new_rows = [row for row in decrypt_rows(query.all(), user) if row.id not in cached_ids]
+
+    # records older than the end of an incomplete list are left for the database to page.
+    if not entry.complete:
+        new_rows = [row for row in new_rows if row[:2] > entry.rows[-1][:2]]
+
+    rows = sorted(new_rows + entry.rows, key=lambda row: row[:2], reverse=True)
+
+    return record_cache.put(user.id, record_type.name, latest_id, rows, entry.complete,
+                            entry, entry.size + sum(map(row_size, new_rows))), latest_id
+
+
+def add_record(record_type, user, data):
+    """Encrypts a new record with the user's key and saves it to the database, returning
+    its id.
+
+    Args:
+        record_type -- the type of the record.
+        user -- the user the record belongs to.
+        data -- the record to be saved.
+    """
+
+    key_id = keyring.current_key_id(user.id)
+    date_posted = datetime.utcnow()
+    record_id = insert_row(Record, {'metric_type': record_type.name,
+                                    'record': encrypt_medical_record(data, key_id),
+                                    'date_posted': date_posted,
+                                    'user_id': user.id, 'key_id': key_id})
+
+    # the plaintext is already known, so the new record is added to the cache as it is.
+    view = {'id': record_id, 'author': user.email,
+            'date_posted': date_posted.strftime('%Y-%m-%d'), 'record': data}
+
+    # the user's newest record of the type before this one, which the cached list must end at.
+    previous_id = db.session.query(func.max(Record.id)) \
+        .filter_by(user_id=user.id, metric_type=record_type.name) \
+        .filter(Record.id < record_id).scalar()
+    record_cache.add(user.id, record_type.name, CachedRecord(date_posted, record_id, view),
+                     previous_id)
+
+    return record_id
+
+
+def add_records(user, entries):
+    """Encrypts a batch of new records with the user's key and saves them to the database,
+    committing INGEST_CHUNK_SIZE records per transaction. Returns the ids of the saved
+    records, in order.
+
+    The cached lists pick up the new records when they are next read, as the records may
+    be older than the ones already cached.
+
+    Args:
+        user -- the user the records belong to.
+        entries -- list of (record type, data, date posted) tuples.
+    """
+
+    key_id = keyring.current_key_id(user.id)
+    chunk_size = app.config['INGEST_CHUNK_SIZE']
+    record_ids = []
+
+    for start in range(0, len(entries), chunk_size):
+        chunk = entries[start:start + chunk_size]
+        ciphertexts = encrypt_many([data.encode() for _, data, _ in chunk], key_id)
+
+        records = [Record(metric_type=record_type.name, record=ciphertext,
+                          date_posted=date_posted, user_id=user.id, key_id=key_id)
+                   for (record_type, _, date_posted), ciphertext in zip(chunk, ciphertexts)]
+        db.session.add_all(records)
+
+        # the ids are read before the commit, which would expire the records.
+        db.session.flush()
+        record_ids.extend(record.id for record in records)
+        db.session.commit()
+
+    return record_ids
+
+
+def get_records(record_type, user):
+    """Finds and decrypts all of a user's records of one type, newest first.
+
+    Args:
+        record_type -- the type of the records.
+        user -- the user the records belong to.
+    """
+
+    entry, latest_id = current_records(record_type, user)
+
+    if entry is not None and entry.complete:
+        return [row.view for row in entry.rows]
+
+    encrypted_records = record_query(record_type, user) \
+        .order_by(Record.date_posted.desc(), Record.id.desc()).all()
+    rows = decrypt_rows(encrypted_records, user)
+    record_cache.put(user.id, record_type.name, latest_id, rows, True)
+
+    return [row.view for row in rows]
+
+
+def get_record_page(record_type, user, cursor, limit, start=None, end=None):
+    """Finds and decrypts one page of a user's records of one type, newest first.
+    Returns the decrypted records and the cursor to the next page.
+
+    Pages within the cached records are returned from the cache. Otherwise the page is
+    read from the database, and added to the cache if it carries on from the cached records.
+    Pages of a time range are always read from the database, with the range's index.
+
+    Args:
+        record_type -- the type of the records.
+        user -- the user the records belong to.
+        cursor -- the cursor returned with the previous page, or None for the first page.
+        limit -- the maximum number of records on the page.
+        start -- the earliest time to include, or None for no limit.
+        end -- the latest time to include, or None for no limit.
+    """
+
+    if start is not None or end is not None:
+        encrypted_records, next_cursor = paginate(range_query(record_type, user, start, end),
+                                                  page_columns, cursor, limit)
+
+        return [row.view for row in decrypt_rows(encrypted_records, user)], next_cursor
+
+    entry, latest_id = current_records(record_type, user)
+    rows = entry.rows if entry is not None else []
+    position = None
+
+    if cursor:
+        try:
+            position = tuple(decode_cursor(cursor, page_columns))
+        except ValueError:
+            return abort(400, 'Invalid page cursor.')
+
+    # finds the first cached record after the cursor, the rows being newest first.
+    start = 0
+    if position is not None:
+        low, high = 0, len(rows)
+        while low < high:
+            middle = (low + high) // 2
+            if rows[middle][:2] < position:
+                high = middle
+            else:
+                low = middle + 1
+        start = low
+
+    if entry is not None and (len(rows) - start > limit or entry.complete):
+        page = rows[start:start + limit]
+        next_cursor = encode_cursor(page[-1], page_columns) if len(rows) - start > limit else None
+
+        return [row.view for row in page], next_cursor
+
+    # the cached records after the cursor start the page if they reach the cursor, and the
+    # rest of it is read from the database.
+    carries_on = entry is not None and rows and (position is None or position >= rows[-1][:2])
+
+    if carries_on:
+        cached_rows = rows[start:]
+        after = encode_cursor(rows[-1], page_columns)
+    else:
+        cached_rows = []
+        after = cursor
+
+    encrypted_records, after_cursor = paginate(record_query(record_type, user), page_columns,
+                                               after, max(limit - len(cached_rows), 1))
+    new_rows = decrypt_rows(encrypted_records, user)
+    page = (cached_rows + new_rows)[:limit]
+
+    if after_cursor is not None or len(cached_rows) + len(new_rows) > limit:
+        next_cursor = encode_cursor(page[-1], page_columns)
+    else:
+        next_cursor = None
+
+    # the records read are cached if they carry on from the cached records.
+    if entry is None and position is None:
+        record_cache.put(user.id, record_type.name, latest_id, new_rows, after_cursor is None)
+    elif carries_on:
+        record_cache.put(user.id, record_type.name, latest_id, rows + new_rows,
+                         after_cursor is None, entry)
+
+    return [row.view for row in page], next_cursor
+
+
+def get_record_series(record_type, user, points, start=None, end=None):
+    """Summarises a user's records of one type within a time range in up to the given
+    number of time buckets, oldest first, using healthapp.series.downsample.
+
+    The records are taken from the cache if all of them are cached, and otherwise only
+    the records within the range are read and decrypted.
+
+    Args:
+        record_type -- the type of the records.
+        user -- the user the records belong to.
+        points -- the most buckets to return.
+        start -- the earliest time to include, or None for no limit.
+        end -- the latest time to include, or None for no limit.
+    """
+
+    entry, _ = current_records(record_type, user)
+
+    if entry is not None and entry.complete:
+        rows = [row for row in entry.rows if in_range(row.date_posted, start, end)]
+    else:
+        rows = decrypt_rows(range_query(record_type, user, start, end)
+                            .order_by(Record.date_posted.desc(), Record.id.desc()).all(), user)
+
+    # the rows are newest first, and the series oldest first.
+    return downsample([(row.date_posted, row.view['record']) for row in reversed(rows)], points)
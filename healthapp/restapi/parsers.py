@@ -1,66 +1,341 @@
 """
-Module contains the argument parsers for the resources.
+Module contains the argument schemas for the resources.
+
+Each resource's arguments are declared as a RequestSchema, which is compiled once at
+import into a single validator: a flat tuple of the argument names, converters, and
+error messages. Parsing a request reads each part of it once, then checks every argument
+in one loop. reqparse, which this replaces, rebuilt the merged json and form arguments
+for each argument parsed and tried each converter with three signatures, so it cost
+several times as much per request, as healthapp/benchmarks/validation_benchmark.py shows.
+Errors are returned in reqparse's format, a 400 error naming the first bad argument.
+
+The string arguments are checked against the same length limits as the web app forms,
+so oversized values are turned away with a 400 error before they are hashed, encrypted,
+or stored. The size of the whole request body is capped by MAX_CONTENT_LENGTH, which
+rejects larger requests with a 413 error before they are read.
+
+Classes:
+    Field -- declares one argument of a schema.
+    RequestSchema -- the arguments of a request, compiled into a single validator.
+
+Functions:
+    bounded_str -- returns an argument type accepting strings within a length range.
+    parse_record_entry -- checks one record of a batch upload.
 """
 
-from flask_restful import reqparse
+from collections import namedtuple
+from datetime import datetime
+from flask import request
+from flask_restful import abort
+from healthapp.records import get_record_type, record_types
+from healthapp.samples import parse_timestamp
 
 # valid user roles
 roles = ['Admin', 'Astronaut', 'Medic']
 
-# the UserApi get request parser
-user_get_args = reqparse.RequestParser()
-user_get_args.add_argument('email', type=str, help='User email required. \'all\' for all users.',
-                           required=True)
-user_get_args.add_argument('token', type=str, help='Auth token required', required=True)
-
-# the UserApi put request parser
-user_put_args = reqparse.RequestParser()
-user_put_args.add_argument('email', type=str, help='User email required', required=True)
-user_put_args.add_argument('first_name', type=str, help='User first name required', required=True)
-user_put_args.add_argument('last_name', type=str, help='User last name required', required=True)
-user_put_args.add_argument('role', type=str, help=f'User role required. Must be in {roles}',
-                           required=True)
-user_put_args.add_argument('password', type=str, help='User password required', required=True)
-user_put_args.add_argument('token', type=str, help='Auth token required', required=True)
-
-# the UserApi push request parser
-user_patch_args = reqparse.RequestParser()
-user_patch_args.add_argument('email', type=str, help='User email required', required=True)
-user_patch_args.add_argument('new_email', type=str, help='User email')
-user_patch_args.add_argument('first_name', type=str, help='User first name')
-user_patch_args.add_argument('last_name', type=str, help='User last name')
-user_patch_args.add_argument('role', type=str, help=f'User role must be in {roles}')
-user_patch_args.add_argument('password', type=str, help='User password')
-user_patch_args.add_argument('token', type=str, help='Auth token required', required=True)
-
-# the UserApi delete request parser
-user_delete_args = reqparse.RequestParser()
-user_delete_args.add_argument('email', type=str, help='User email required', required=True)
-user_delete_args.add_argument('token', type=str, help='Auth token required', required=True)
-
-# the LoginApi request parser
-login_args = reqparse.RequestParser()
-login_args.add_argument('email', type=str, help='User email required', required=True)
-login_args.add_argument('password', type=str, help='User password required', required=True)
-
-# the RecordApi post request parser
-record_put_args = reqparse.RequestParser()
-record_put_args.add_argument('record', type=str, help='Record required', required=True)
-record_put_args.add_argument('token', type=str, help='Auth token required', required=True)
-
-# the RecordApi get request parser
-record_get_args = reqparse.RequestParser()
-record_get_args.add_argument('token', type=str, help='Auth token required', required=True)
-record_get_args.add_argument('email', type=str, help='User email required', required=True)
-
-# the PostApi get request parser
-post_get_args = reqparse.RequestParser()
-post_get_args.add_argument('token', type=str, help='Auth token required', required=True)
-post_get_args.add_argument('email', type=str, help='User email required', required=True)
-
-# the PostApi post request parser
-post_put_args = reqparse.RequestParser()
-post_put_args.add_argument('token', type=str, help='Auth token required', required=True)
-post_put_args.add_argument('email', type=str, help='Recipient email required', required=True)
-post_put_args.add_argument('content', type=str, help='Content required', required=True)
-post_put_args.add_argument('title', type=str, help='Title required', required=True)
+# where an argument can be sent, how each is named in errors, and the places an argument
+# is looked for, in order, unless its field names one.
+friendly_locations = {'json': 'the JSON body', 'values': 'the post body or the query string',
+                      'args': 'the query string'}
+default_locations = ('json', 'values')
+
+# marks an argument missing from a part of the request.
+missing = object()
+
+
+def json_source():
+    """Returns the json body of the request, or an empty dict if there isn't a json object."""
+
+    body = request.get_json()
+
+    return body if isinstance(body, dict) else {}
+
+
+# functions reading each part of the request the arguments can be sent in.
+source_readers = {'json': json_source, 'values': lambda: request.values,
+                  'args': lambda: request.args}
+
+
+# one argument of a schema: its converter, error message, whether it must be sent, the
+# key it is returned under if not its name, and the one part of the request it is read from.
+Field = namedtuple('Field', ['type', 'help', 'required', 'dest', 'location'],
+                   defaults=[False, None, None])
+
+
+class RequestSchema:
+    """
+    The arguments of a request, declared as a dict of Fields, and compiled once into a
+    single validator.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+
+        locations = {}
+        compiled = []
+
+        for name, field in fields.items():
+            field_locations = (field.location,) if field.location else default_locations
+            locations.update(dict.fromkeys(field_locations))
+
+            missing_message = 'Missing required parameter in ' + \
+                ' or '.join(friendly_locations[location] for location in field_locations)
+
+            compiled.append((name, field.dest or name, field.type, field.required,
+                             field.help, field_locations, missing_message))
+
+        self._locations = tuple(locations)
+        self._compiled = tuple(compiled)
+
+    @staticmethod
+    def fail(name, help_text, message):
+        """
+        Aborts the request with a 400 error naming the bad argument.
+
+        Args:
+            name -- the name of the argument.
+            help_text -- the argument's error message, formatted with the message.
+            message -- what is wrong with the argument.
+        """
+        abort(400, message={name: help_text.format(error_msg=message) if help_text
+                            else message})
+
+    def parse_args(self):
+        """
+        Returns a dict of the request's arguments, converted by their types, with None for
+        any not sent. Aborts with a 400 error at the first missing or invalid argument.
+        """
+        sources = {location: source_readers[location]() for location in self._locations}
+        args = {}
+
+        for name, dest, convert, required, help_text, field_locations, missing_message \
+                in self._compiled:
+            for location in field_locations:
+                value = sources[location].get(name, missing)
+
+                if value is not missing:
+                    break
+            else:
+                if required:
+                    self.fail(name, help_text, missing_message)
+
+                args[dest] = None
+                continue
+
+            # a null json value is left as None.
+            if value is not None:
+                try:
+                    value = convert(value)
+                except (TypeError, ValueError) as error:
+                    self.fail(name, help_text, str(error))
+
+            args[dest] = value
+
+        return args
+
+
+def bounded_str(max_length, min_length=1):
+    """Returns an argument type which accepts strings of min_length to max_length
+    characters, raising a ValueError naming the limit otherwise.
+
+    Args:
+        max_length -- the most characters allowed.
+        min_length -- the fewest characters allowed.
+    """
+
+    def check_length(value):
+        value = str(value)
+
+        if not min_length <= len(value) <= max_length:
+            raise ValueError(f'Must be {min_length} to {max_length} characters long, '
+                             f'not {len(value)}.')
+
+        return value
+
+    return check_length
+
+
+# argument types, matching the limits of the web app forms where there is one.
+email_str = bounded_str(120)
+name_str = bounded_str(20, min_length=2)
+password_str = bounded_str(128)
+token_str = bounded_str(1024, min_length=0)
+cursor_str = bounded_str(256, min_length=0)
+title_str = bounded_str(60)
+content_str = bounded_str(500)
+role_str = bounded_str(20)
+record_str = bounded_str(12)
+list_str = bounded_str(2000)
+job_str = bounded_str(64)
+archive_key_str = bounded_str(64)
+
+
+# the UserApi get request schema
+user_get_args = RequestSchema({
+    'email': Field(email_str, 'User email required. \'all\' for all users. {error_msg}',
+                   required=True),
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+    'limit': Field(int, 'Page size must be a number'),
+    'cursor': Field(cursor_str, 'Cursor of the next page. {error_msg}'),
+})
+
+# the UserApi put request schema
+user_put_args = RequestSchema({
+    'email': Field(email_str, 'User email required. {error_msg}', required=True),
+    'first_name': Field(name_str, 'User first name required. {error_msg}', required=True),
+    'last_name': Field(name_str, 'User last name required. {error_msg}', required=True),
+    'role': Field(role_str, f'User role required. Must be in {roles}. {{error_msg}}',
+                  required=True),
+    'password': Field(password_str, 'User password required. {error_msg}', required=True),
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+})
+
+# the UserApi patch request schema
+user_patch_args = RequestSchema({
+    'email': Field(email_str, 'User email required. {error_msg}', required=True),
+    'new_email': Field(email_str, 'User email. {error_msg}'),
+    'first_name': Field(name_str, 'User first name. {error_msg}'),
+    'last_name': Field(name_str, 'User last name. {error_msg}'),
+    'role': Field(role_str, f'User role must be in {roles}. {{error_msg}}'),
+    'password': Field(password_str, 'User password. {error_msg}'),
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+})
+
+# the UserApi delete request schema
+user_delete_args = RequestSchema({
+    'email': Field(email_str, 'User email required. {error_msg}', required=True),
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+})
+
+# the KeyApi request schema, used for both get and put requests
+key_args = RequestSchema({
+    'email': Field(email_str, 'User email required. {error_msg}', required=True),
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+})
+
+# the LoginApi request schema
+login_args = RequestSchema({
+    'email': Field(email_str, 'User email required. {error_msg}', required=True),
+    'password': Field(password_str, 'User password required. {error_msg}', required=True),
+})
+
+# the RefreshApi request schema
+refresh_args = RequestSchema({
+    'refresh_token': Field(token_str, 'Refresh token required. {error_msg}', required=True),
+})
+
+# the RecordApi post request schema
+record_put_args = RequestSchema({
+    'record': Field(record_str, 'Record required. {error_msg}', required=True),
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+})
+
+# the RecordApi get request schema
+record_get_args = RequestSchema({
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+    'email': Field(email_str, 'User email required. {error_msg}', required=True),
+    'limit': Field(int, 'Page size must be a number'),
+    'cursor': Field(cursor_str, 'Cursor of the next page. {error_msg}'),
+    'from': Field(parse_timestamp, 'from must be an iso 8601 time or unix timestamp',
+                  dest='start'),
+    'to': Field(parse_timestamp, 'to must be an iso 8601 time or unix timestamp', dest='end'),
+    'points': Field(int, 'Number of points must be a number'),
+})
+
+# the PostApi get request schema
+post_get_args = RequestSchema({
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+    'email': Field(email_str, 'User email required. {error_msg}', required=True),
+    'limit': Field(int, 'Page size must be a number'),
+    'cursor': Field(cursor_str, 'Cursor of the next page. {error_msg}'),
+})
+
+# the PostApi post request schema
+post_put_args = RequestSchema({
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+    'email': Field(email_str, 'Recipient email required. {error_msg}', required=True),
+    'content': Field(content_str, 'Content required. {error_msg}', required=True),
+    'title': Field(title_str, 'Title required. {error_msg}', required=True),
+})
+
+# the RecordBatchApi put request schema. the records are read from the body by the resource.
+record_batch_args = RequestSchema({
+    'token': Field(token_str, 'Auth token. {error_msg}', location='args'),
+})
+
+
+def parse_record_entry(entry):
+    """Checks one record of a batch upload, sent as an object with metric, value, and
+    optional timestamp fields. Returns the record type, the record, and the time it was taken,
+    or raises a ValueError describing the first problem found.
+
+    Args:
+        entry -- the record as decoded from the json.
+    """
+
+    if not isinstance(entry, dict):
+        raise ValueError('Record must be an object with metric, value, and timestamp.')
+
+    record_type = get_record_type(entry.get('metric'))
+
+    if not record_type:
+        raise ValueError(f'metric must be in {list(record_types)}.')
+
+    value = entry.get('value')
+
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError('value must be a string or number.')
+
+    try:
+        data = record_str(value)
+    except ValueError as error:
+        raise ValueError(f'value: {error}') from error
+
+    # records without a timestamp were taken now.
+    if entry.get('timestamp') is None:
+        return record_type, data, datetime.utcnow()
+
+    try:
+        return record_type, data, parse_timestamp(entry['timestamp'])
+    except ValueError as error:
+        raise ValueError('timestamp must be an iso 8601 time or unix timestamp.') from error
+
+
+# the SampleApi get request schema
+sample_get_args = RequestSchema({
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+    'email': Field(email_str, 'User email required. {error_msg}', required=True),
+    'limit': Field(int, 'Page size must be a number'),
+    'cursor': Field(cursor_str, 'Cursor of the next page. {error_msg}'),
+    'from': Field(parse_timestamp, 'from must be an iso 8601 time or unix timestamp',
+                  dest='start'),
+    'to': Field(parse_timestamp, 'to must be an iso 8601 time or unix timestamp', dest='end'),
+    'points': Field(int, 'Number of points must be a number'),
+})
+
+# the SampleApi put request schema
+sample_put_args = RequestSchema({
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+    'samples': Field(list, 'List of [time, value] samples required', required=True,
+                     location='json'),
+})
+
+# the ExportApi put request schema
+export_put_args = RequestSchema({
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+    'emails': Field(list_str, 'Comma separated user emails required. \'all\' for all '
+                              'astronauts. {error_msg}', required=True),
+    'record_types': Field(list_str, 'Comma separated record types, or Posts. {error_msg}'),
+})
+
+# the ExportApi get request schema
+export_get_args = RequestSchema({
+    'token': Field(token_str, 'Auth token. {error_msg}'),
+    'job': Field(job_str, 'Export job required. {error_msg}', required=True),
+})
+
+# the ExportDownloadApi get request schema
+export_download_args = RequestSchema(dict(
+    export_get_args.fields,
+    key=Field(archive_key_str, 'Key returned with the export job required. {error_msg}',
+              required=True)))
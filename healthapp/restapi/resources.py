@@ -3,28 +3,49 @@ Module containing the rest api resources.
 
 Classes:
     LoginApi -- allows login
+    RefreshApi -- allows exchanging a refresh token for new tokens, and revoking it.
     UserApi -- allows viewing, editing, adding, and deleting users.
+    KeyApi -- allows rotating a user's encryption key and checking the rotation's progress.
     RecordApi -- allows viewing and adding medical records.
+    RecordBatchApi -- allows uploading a batch of medical records of any type.
+    SampleApi -- allows viewing and uploading high frequency time-series samples.
     PostApi -- allows viewing and sending posts.
+    ExportApi -- allows exporting the data of several users in the background.
+    ExportDownloadApi -- allows downloading the archive of a finished export.
 
 Functions:
     check_token -- checks if json web token is valid.
     check_user_role -- checks the current user's role.
+    page_limit -- returns the page size for a request.
+    sample_limit -- returns the number of samples on a page for a request.
 """
 
-from datetime import datetime, timedelta
-import jwt
-from flask import jsonify
-from flask_restful import Resource, abort, fields, marshal_with
-from cryptography.fernet import Fernet
-from healthapp import app, db, bcrypt, api
-from healthapp.models import User, Post, BloodPressure, Weight, delete_user_from_db
-from healthapp.encryption import encrypt_post, encrypt_medical_record, \
-    decrypt_medical_record, decrypt_post
-
+import json
+from itertools import chain
+from cryptography.exceptions import InvalidTag
+from flask import Response, jsonify, request
+from flask_restful import Resource, abort, fields, marshal, marshal_with
+from healthapp import app, db, api
+from healthapp.models import User, ExportJob, delete_user_from_db
+from healthapp.keyring import keyring
+from healthapp.identity import identities
+from healthapp.passwords import hash_password, check_password
+from healthapp.rotation import pending_rows, rotate_key
+from healthapp.messages import get_message_page, add_message
+from healthapp.records import record_types, get_record_type, add_record, add_records,\
+        get_record_page, get_record_series
+from healthapp.samples import add_samples, get_samples, get_sample_series
+from healthapp.pagination import paginate
+from healthapp.exports import job_expired, job_view, purge_expired_jobs, read_archive,\
+        submit_export
+
+from healthapp.restapi.tokens import issue_token, read_token, revocations,\
+        issue_refresh_token, use_refresh_token, revoke_refresh_tokens
 from healthapp.restapi.parsers import user_get_args, user_delete_args,\
-        user_put_args, user_patch_args, login_args, record_get_args,\
-        record_put_args, post_get_args, post_put_args
+        user_put_args, user_patch_args, key_args, login_args, refresh_args, record_get_args,\
+        record_put_args, post_get_args, post_put_args, sample_get_args, sample_put_args,\
+        export_get_args, export_put_args, export_download_args, record_batch_args,\
+        parse_record_entry
 
 # structure for how User objects are returned using the @marshall_with decorator.
 user_fields = {'email': fields.String, 'first_name': fields.String,
@@ -34,29 +55,30 @@ user_fields = {'email': fields.String, 'first_name': fields.String,
 def check_token(token):
     """
     Takes a json web token and checks its validity. If it is valid then is returns the
-    current logged in user. If it is invalid then an access denied error is returned.
+    user it was issued to, read from the token's claims. If it is invalid then an access
+    denied error is returned. The token can be sent as the token argument, or in an
+    Authorization: Bearer header.
 
     Args:
-        token -- the json web token to be checked.
+        token -- the json web token to be checked, or None to use the Authorization header.
     """
-    # try to decode the token if it is valid.
-    try:
-        # decodes the token and extracts the data stored in it.
-        data = jwt.decode(token, app.config['SECRET_KEY'], 'HS256')
+    # uses the token in the Authorization header if none was sent as an argument.
+    if not token:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
 
-        # finds the current user's information in the database.
-        current_user = User.query.filter_by(email=data['email']).first()
+        if scheme.lower() != 'bearer' or not token:
+            return abort(403, message='Auth token required')
 
-        # returns current_user if user is found in the database.
-        if current_user:
-            return current_user
+    # the token's signature, expiry time, and cached epoch are checked without a user query.
+    current_user = read_token(token)
 
-        abort(403, message='Invalid token. Please login.')
+    # returns current_user if the token is valid.
+    if current_user:
+        return current_user
 
-    # if an error occurs when decoding the token, or the token is expired,
+    # if the token can't be decoded, is expired, or has been revoked,
     # then the below access denied error is sent along with the message.
-    except (jwt.exceptions.DecodeError, jwt.exceptions.ExpiredSignatureError):
-        return abort(403, message='Invalid token. Please login.')
+    return abort(403, message='Invalid token. Please login.')
 
 
 def check_user_role(current_user, role):
@@ -73,6 +95,56 @@ def check_user_role(current_user, role):
         abort(403, message='Access denied. Invalid user role.')
 
 
+def page_limit(limit):
+    """
+    Returns the number of items to return on a page. Uses the default page size if
+    no limit was sent, and caps the limit at the maximum page size.
+
+    Args:
+        limit -- the limit sent with the request, or None.
+    """
+    if limit is None:
+        return app.config['API_PAGE_SIZE']
+
+    # returns an error if the limit isn't a positive number.
+    if limit < 1:
+        abort(400, message='limit must be at least 1.')
+
+    return min(limit, app.config['API_MAX_PAGE_SIZE'])
+
+
+def sample_limit(limit):
+    """
+    Returns the number of samples to return on a page. Uses and caps the limit at the most
+    samples allowed in one request, MAX_SAMPLES_PER_REQUEST.
+
+    Args:
+        limit -- the limit sent with the request, or None.
+    """
+    if limit is None:
+        return app.config['MAX_SAMPLES_PER_REQUEST']
+
+    # returns an error if the limit isn't a positive number.
+    if limit < 1:
+        abort(400, message='limit must be at least 1.')
+
+    return min(limit, app.config['MAX_SAMPLES_PER_REQUEST'])
+
+
+def series_points(points):
+    """
+    Returns the number of points a downsampled series is split into, or returns an error
+    if it isn't between 1 and the maximum number of points.
+
+    Args:
+        points -- the number of points sent with the request.
+    """
+    if not 1 <= points <= app.config['MAX_SERIES_POINTS']:
+        abort(400, message=f"points must be between 1 and {app.config['MAX_SERIES_POINTS']}.")
+
+    return points
+
+
 class LoginApi(Resource):
     """
     Allows the user to log in.
@@ -87,16 +159,15 @@ class LoginApi(Resource):
         user = User.query.filter_by(email=args['email']).first()
 
         # checks that the user is in the database and the password is correct.
-        if user and bcrypt.check_password_hash(user.password, args['password']):
-            # generates a new json web token with the user email
-            # and expiry time stored in it.
-            # 'exp' is the expiry time: login time + an amount of time.
-            token = jwt.encode({'email': user.email,
-                                'exp': datetime.utcnow() + timedelta(minutes=10)},
-                               app.config['SECRET_KEY'], algorithm='HS256')
+        if user and check_password(user.password, args['password']):
+            # generates a new json web token with the user's id, email, role,
+            # and expiry time stored in it, along with a refresh token for renewing it.
+            token = issue_token(user)
+            refresh_token = issue_refresh_token(user)
+            db.session.commit()
 
-            # returns the web token.
-            return {'token': token}
+            # returns the web token and refresh token.
+            return {'token': token, 'refresh_token': refresh_token}
 
         #returns error message if log in fails.
         return {'message': 'Login error. Check username and password.'}
@@ -106,6 +177,49 @@ class LoginApi(Resource):
 api.add_resource(LoginApi, '/api/login')
 
 
+class RefreshApi(Resource):
+    """
+    Allows a logged in user to renew their token without sending their password again.
+    """
+    def post(self):
+        """
+        Exchanges a refresh token for a new web token and refresh token. The refresh token
+        sent can't be used again.
+        """
+        # Parses the sent arguments using refresh arguments parser.
+        args = refresh_args.parse_args()
+        # finds the user the refresh token was issued to, using up the token.
+        user = use_refresh_token(args['refresh_token'])
+
+        if not user:
+            return abort(403, message='Invalid refresh token. Please login.')
+
+        # generates a new web token and refresh token for the user.
+        token = issue_token(user)
+        refresh_token = issue_refresh_token(user)
+        db.session.commit()
+
+        return {'token': token, 'refresh_token': refresh_token}
+
+    def delete(self):
+        """
+        Revokes a refresh token, such as when logging out.
+        """
+        # Parses the sent arguments using refresh arguments parser.
+        args = refresh_args.parse_args()
+
+        if not use_refresh_token(args['refresh_token']):
+            return abort(403, message='Invalid refresh token.')
+
+        db.session.commit()
+
+        return {'message': 'Refresh token revoked.'}
+
+
+# adds the RefreshApi resource to the api.
+api.add_resource(RefreshApi, '/api/token/refresh')
+
+
 class UserApi(Resource):
     """
     Allows the registered users to be viewed, users to be added,
@@ -115,10 +229,9 @@ class UserApi(Resource):
         # list of available user roles.
         self.user_roles = ['Admin', 'Astronaut', 'Medic']
 
-    @marshal_with(user_fields)
     def get(self):
         """
-        Gets a  user, or a list of all users in the database if the current user is an admin.
+        Gets a  user, or a page of the users in the database if the current user is an admin.
         """
         # Parses the arguments passed in the request.
         args = user_get_args.parse_args()
@@ -128,21 +241,23 @@ class UserApi(Resource):
         # checks the user is an admin
         check_user_role(current_user, 'Admin')
 
-        # if all is passed as the email argument then a list of all users is returned.
+        # if all is passed as the email argument then a page of the users is returned,
+        # along with the cursor to the next page.
         if args['email'] == 'all':
-            users = User.query.all()
-            return users
-
+            users, next_cursor = paginate(User.query, (User.id,), args['cursor'],
+                                          page_limit(args['limit']), descending=False)
+            return {'users': marshal(users, user_fields), 'next': next_cursor}
 
-        # looks for the user with the passed in email in the database
-        user = User.query.filter_by(email=args['email']).first()
+        # looks for the user with the passed in email, which is only displayed, so a cached
+        # snapshot is used.
+        user = identities.get_by_email(args['email'], cached=True)
 
         # if the no user is found then a not found error is returned.
         if not user:
             abort(404, message="Could not find user")
 
         # returns the user info.
-        return user
+        return marshal(user, user_fields)
 
     @marshal_with(user_fields)
     def put(self):
@@ -158,7 +273,7 @@ class UserApi(Resource):
         check_user_role(current_user, 'Admin')
 
         # looks for a user with the passed in email in the database.
-        user = User.query.filter_by(email=args['email']).first()
+        user = identities.get_by_email(args['email'])
 
         # if a user with the email already exists then the below error is returned.
         if user:
@@ -171,19 +286,21 @@ class UserApi(Resource):
 
         # the passed in password is hashed and decoded to a utf-8 string
         # to be stored in the database.
-        hashed_pw = bcrypt.generate_password_hash(args['password']).decode('utf-8')
+        hashed_pw = hash_password(args['password'])
 
         # a new User object containing the relevant user information.
         new_user = User(email=args['email'],
                         first_name=args['first_name'],
                         last_name=args['last_name'],
                         role=args['role'],
-                        password=hashed_pw,
-                        key=Fernet.generate_key().decode('utf-8'))
+                        password=hashed_pw)
 
-        # adds the new user to the database and commits the change.
+        # adds the new user and a newly generated encryption key to the database
+        # and commits the change.
         db.session.add(new_user)
+        keyring.create_key(new_user)
         db.session.commit()
+        identities.invalidate(user_id=new_user.id, email=new_user.email)
 
         # returns the new user info.
         return new_user, 201
@@ -228,11 +345,15 @@ class UserApi(Resource):
 
         if args['password']:
             # hashes new password
-            hashed_pw = bcrypt.generate_password_hash(args['password']).decode('utf-8')
+            hashed_pw = hash_password(args['password'])
             user.password = hashed_pw
 
-        # commits the changes to the database.
+        # the user's refresh tokens are revoked, and the changes committed to the database.
+        revoke_refresh_tokens(user.id)
         db.session.commit()
+        # the user's tokens and cached snapshot hold their old details, so they are dropped.
+        revocations.revoke(user.id)
+        identities.invalidate(user_id=user.id, email=args['email'])
 
         # returns the user with updated info.
         return user
@@ -250,37 +371,103 @@ class UserApi(Resource):
         # if the email argument is the current user's email then
         # the user is deleted and the below message is returned.
         if current_user.email == args['email']:
-            delete_user_from_db(current_user.email)
+            deleted = delete_user_from_db(current_user.email)
 
         else:
             # checks the user is an admin.
             check_user_role(current_user, 'Admin')
 
             # looks for a user with the passed in email in the database.
-            user = User.query.filter_by(email=args['email']).first()
+            user = identities.get_by_email(args['email'])
 
             # if the user is not in the database then returns a not found error.
             if not user:
                 abort(404, message="User does not exist, cannot be deleted.")
 
             # deletes the all information associated with the passed in email from the database.
-            delete_user_from_db(args['email'])
+            deleted = delete_user_from_db(args['email'])
 
-        return {'message': f'User {args["email"]} deleted'}
+        # returns the number of rows deleted from each table along with the message.
+        return {'message': f'User {args["email"]} deleted', 'deleted': deleted}
 
 
 # adds the UserApi resource to the api.
 api.add_resource(UserApi, '/api/user')
 
 
-class RecordApi(Resource):
+class KeyApi(Resource):
     """
-    Allows user medical records to be viewed and added.
+    Allows a user's encryption key to be rotated, and the re-encryption of their
+    existing data to be followed.
     """
-    def __init__(self):
-        # valid record types.
-        self.record_types = ['blood_pressure', 'weight']
+    @staticmethod
+    def find_user(args):
+        """
+        Returns the user whose key is requested. Users can manage their own key,
+        and admins can manage any user's key.
+
+        Args:
+            args -- the parsed request arguments.
+        """
+        # checks the token sent with the request.
+        current_user = check_token(args['token'])
+
+        # checks the user is an admin if the key isn't their own.
+        if current_user.email != args['email']:
+            check_user_role(current_user, 'Admin')
+
+        # looks for a user with the passed in email in the database.
+        user = identities.get_by_email(args['email'])
+
+        # if the user is not in the database then returns a not found error.
+        if not user:
+            abort(404, message='User does not exist.')
+
+        return user
+
+    def get(self):
+        """
+        Returns the number of the user's rows still waiting to be re-encrypted.
+        """
+        # Parses the arguments passed in the request.
+        args = key_args.parse_args()
+        user = self.find_user(args)
+
+        pending = pending_rows(user.id)
 
+        return {'email': user.email, 'pending': pending, 'complete': not any(pending.values())}
+
+    def put(self):
+        """
+        Rotates the user's key. New data is encrypted with the new key straight away,
+        and the existing data is re-encrypted in the background.
+        """
+        # Parses the arguments passed in the request.
+        args = key_args.parse_args()
+        user = self.find_user(args)
+
+        # rotating the key needs the user's row, rather than their snapshot.
+        user_row = User.query.get(user.id)
+
+        # the user may have been deleted since they were looked up.
+        if user_row is None:
+            identities.invalidate(user_id=user.id, email=user.email)
+            abort(404, message='User does not exist.')
+
+        key = rotate_key(user_row)
+
+        return {'message': f'Key rotated for {user.email}',
+                'created_at': key.created_at.isoformat()}, 201
+
+
+# adds the KeyApi resource to the api.
+api.add_resource(KeyApi, '/api/user/key')
+
+
+class RecordApi(Resource):
+    """
+    Allows user medical records of any registered type to be viewed and added.
+    """
     def get(self, record_type):
         """
         Allows users to view the records of different users, depending on their role.
@@ -289,111 +476,247 @@ class RecordApi(Resource):
         args = record_get_args.parse_args()
         # checks the token sent with the request.
         current_user = check_token(args['token'])
+        # looks for the record type in the registry.
+        record_type = get_record_type(record_type)
 
-        if record_type == 'blood_pressure':
+        if record_type:
 
             if current_user.email == args['email']:
                 # if the current user is requesting their own records then they are decrypted
                 # and returned as json.
-                encrypted_bp = BloodPressure.query.filter_by(user_id=current_user.id).order_by(
-                    BloodPressure.date_posted.desc()).all()
+                user = current_user
 
-                posts = decrypt_medical_record(encrypted_bp, current_user.key)
-
-                return jsonify(posts)
-
-            if current_user.role in ['Admin', 'Medic']:
+            elif current_user.role in ['Admin', 'Medic']:
                 # if the current user is an admin or medic then the requested
                 # records are decrypted and returned as json.
 
-                user = User.query.filter_by(email=args['email']).first()
+                user = identities.get_by_email(args['email'])
 
                 if not user or user.role != 'Astronaut':
                     return abort(404, message='User not found or not an astronaut.')
 
-                encrypted_bp = BloodPressure.query.filter_by(user_id=user.id).order_by(
-                    BloodPressure.date_posted.desc()).all()
+            else:
+                user = None
 
-                posts = decrypt_medical_record(encrypted_bp,
-                                               User.query.filter_by(email=args['email']).\
-                                               first().key)
+            if user is not None:
+                # the records within the time range are returned as a downsampled series
+                # if a number of points was sent.
+                if args['points'] is not None:
+                    series = get_record_series(record_type, user, series_points(args['points']),
+                                               args['start'], args['end'])
 
-                return jsonify(posts)
+                    return jsonify({'series': series})
 
-        if record_type == 'weight':
+                posts, next_cursor = get_record_page(record_type, user, args['cursor'],
+                                                     page_limit(args['limit']),
+                                                     args['start'], args['end'])
 
-            if current_user.email == args['email']:
-                # if the current user is requesting their own records then they are decrypted
-                # and returned as json.
-                encrypted_weight = Weight.query.filter_by(user_id=current_user.id).order_by(
-                    Weight.date_posted.desc()).all()
+                return jsonify({'records': posts, 'next': next_cursor})
+
+        # access denied error
+        return abort(403, message='Access denied. Check token or request records')
+
+    def put(self, record_type):
+        """
+        Allows astronauts to add new medical records to the database.
+        """
+        # Parses the arguments passed in the request.
+        args = record_put_args.parse_args()
+        # checks the token sent with the request.
+        current_user = check_token(args['token'])
+        # checks the current user is an astronaut.
+        check_user_role(current_user, 'Astronaut')
+        # looks for the record type in the registry.
+        record_type = get_record_type(record_type)
+
+        if record_type:
+            # new record is encrypted using the current user's key,
+            # added to the database, and the change is committed.
+            add_record(record_type, current_user, args['record'])
+
+            # returns success message.
+            return {'message': f'{record_type.label} record added.'}
+
+        # record type error message.
+        return {'message': f'record_type must be in {list(record_types)}.'}
+
+
+# adds the RecordApi resource to the api.
+api.add_resource(RecordApi, '/api/record/<string:record_type>')
+
+
+class RecordBatchApi(Resource):
+    """
+    Allows astronauts to upload many medical records at once, such as from a health monitor
+    or a backlog of readings, rather than one record per request.
+    """
+    @staticmethod
+    def read_entries():
+        """
+        Returns the records sent in the request body, either as a json array, a json object
+        with a records array, or newline delimited json with one record per line. Lines of
+        newline delimited json that can't be decoded are returned as None.
+        """
+        if request.mimetype == 'application/x-ndjson':
+            entries = []
 
-                posts = decrypt_medical_record(encrypted_weight, current_user.key)
+            for line in request.get_data().splitlines():
+                # blank lines, such as a trailing newline, are skipped.
+                if not line.strip():
+                    continue
 
-                return jsonify(posts)
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    entries.append(None)
 
-            if current_user.role in ['Admin', 'Medic']:
+            return entries
+
+        body = request.get_json(silent=True)
+
+        if isinstance(body, dict):
+            body = body.get('records')
+
+        if not isinstance(body, list):
+            return abort(400, message='Records must be sent as a json array, or as newline '
+                                      'delimited json.')
+
+        return body
+
+    def put(self):
+        """
+        Adds a batch of records, each with its metric, value, and the time it was taken.
+        The valid records are saved, and the result of each record is returned in order.
+        """
+        # Parses the arguments passed in the request.
+        args = record_batch_args.parse_args()
+        # checks the token sent with the request.
+        current_user = check_token(args['token'])
+        # checks the current user is an astronaut.
+        check_user_role(current_user, 'Astronaut')
+
+        entries = self.read_entries()
+
+        # returns an error if too many records are sent at once.
+        if len(entries) > app.config['MAX_RECORDS_PER_REQUEST']:
+            abort(413, message=f'At most {app.config["MAX_RECORDS_PER_REQUEST"]} records '
+                               f'can be sent per request.')
+
+        results = []
+        valid_entries = []
+
+        for index, entry in enumerate(entries):
+            try:
+                valid_entries.append(parse_record_entry(entry))
+                results.append({'index': index})
+            except ValueError as error:
+                results.append({'index': index, 'error': str(error)})
+
+        # the valid records are encrypted and saved in chunks, a transaction per chunk.
+        record_ids = iter(add_records(current_user, valid_entries))
+
+        for result in results:
+            if 'error' not in result:
+                result['id'] = next(record_ids)
+
+        return {'message': f'{len(valid_entries)} records added.',
+                'added': len(valid_entries),
+                'rejected': len(entries) - len(valid_entries),
+                'results': results}
+
+
+# adds the RecordBatchApi resource to the api.
+api.add_resource(RecordBatchApi, '/api/records')
+
+
+class SampleApi(Resource):
+    """
+    Allows high frequency time-series samples, such as from wearables, to be viewed and
+    uploaded for any registered record type.
+    """
+    def get(self, record_type):
+        """
+        Allows users to view the samples of different users within a time range,
+        depending on their role.
+        """
+        # Parses the arguments passed in the request.
+        args = sample_get_args.parse_args()
+        # checks the token sent with the request.
+        current_user = check_token(args['token'])
+        # looks for the record type in the registry.
+        record_type = get_record_type(record_type)
+
+        if record_type:
+
+            if current_user.email == args['email']:
+                # if the current user is requesting their own samples then they are decrypted
+                # and returned as json.
+                user = current_user
+
+            elif current_user.role in ['Admin', 'Medic']:
                 # if the current user is an admin or medic then the requested
-                # records are decrypted and returned as json.
+                # samples are decrypted and returned as json.
 
-                user = User.query.filter_by(email=args['email']).first()
+                user = identities.get_by_email(args['email'])
 
                 if not user or user.role != 'Astronaut':
                     return abort(404, message='User not found or not an astronaut.')
 
-                encrypted_weight = Weight.query.filter_by(user_id=user.id).order_by(
-                    Weight.date_posted.desc()).all()
+            else:
+                user = None
+
+            if user is not None:
+                # the samples are returned as a downsampled series if a number of points
+                # was sent.
+                if args['points'] is not None:
+                    series = get_sample_series(record_type, user, series_points(args['points']),
+                                               args['start'], args['end'])
 
-                posts = decrypt_medical_record(encrypted_weight,
-                                               User.query.filter_by(email=args['email']).\
-                                               first().key)
+                    return jsonify({'series': series})
 
-                return jsonify(posts)
+                # finds and decrypts a page of the samples in the range.
+                samples, next_cursor = get_samples(record_type, user, args['start'], args['end'],
+                                                   args['cursor'], sample_limit(args['limit']))
+
+                return jsonify({'samples': samples, 'next': next_cursor})
 
         # access denied error
         return abort(403, message='Access denied. Check token or request records')
 
     def put(self, record_type):
         """
-        Allows astronauts to add new medical records to the database.
+        Allows astronauts to upload a batch of samples, which are packed into encrypted blocks.
         """
         # Parses the arguments passed in the request.
-        args = record_put_args.parse_args()
+        args = sample_put_args.parse_args()
         # checks the token sent with the request.
         current_user = check_token(args['token'])
         # checks the current user is an astronaut.
         check_user_role(current_user, 'Astronaut')
+        # looks for the record type in the registry.
+        record_type = get_record_type(record_type)
 
-        if record_type == 'blood_pressure':
-            # new blood pressure is encrypted using the current user's key
-            encrypted_blood_pressure = encrypt_medical_record(args['record'], current_user.key)
+        if not record_type:
+            # record type error message.
+            return {'message': f'record_type must be in {list(record_types)}.'}
 
-            # new blood pressure object is added to the database and the change is committed.
-            bp = BloodPressure(record=encrypted_blood_pressure, user_id=current_user.id)
-            db.session.add(bp)
-            db.session.commit()
+        # returns an error if too many samples are sent at once.
+        if len(args['samples']) > app.config['MAX_SAMPLES_PER_REQUEST']:
+            abort(413, message=f'At most {app.config["MAX_SAMPLES_PER_REQUEST"]} samples '
+                               f'can be sent per request.')
 
-            # returns success message.
-            return {'message': 'Blood pressure record added.'}
+        try:
+            count = add_samples(record_type, current_user, args['samples'])
+        except ValueError as error:
+            # returns an error if any of the samples are invalid.
+            return abort(400, message=str(error))
 
-        if record_type == 'weight':
-            # new weight is encrypted using the current user's key
-            encrypted_weight = encrypt_medical_record(args['record'], current_user.key)
+        # returns success message.
+        return {'message': f'{count} {record_type.label} samples added.'}
 
-            # new weight object is added to the database and the change is committed.
-            weight = Weight(record=encrypted_weight, user_id=current_user.id)
-            db.session.add(weight)
-            db.session.commit()
 
-            # returns success message.
-            return {'message': 'Weight record added.'}
-
-        # record type error message.
-        return {'message': f'record_type must be in {self.record_types}.'}
-
-
-# adds the RecordApi resource to the api.
-api.add_resource(RecordApi, '/api/record/<string:record_type>')
+# adds the SampleApi resource to the api.
+api.add_resource(SampleApi, '/api/record/<string:record_type>/samples')
 
 
 class PostApi(Resource):
@@ -413,53 +736,25 @@ class PostApi(Resource):
             # decrypts all conversations involving the current user if
             # the email argument passed in is 'all'
 
-            # pulls all posts involving the current user from the database.
-            encrypted_posts = db.session.query(Post) \
-                .where((Post.recipient == current_user.email) | (Post.user_id == current_user.id)) \
-                .order_by(Post.date_posted.desc()).all()
-
-            posts = []		# empty list for decrypted posts to be appended to.
-
-            for post in encrypted_posts:
-                post_list = [post]    # decrypt_post() takes a list as an arg.
-
-                # decrypts the posts using the appropriate key.
-                if post_list[0].recipient == current_user.email:
-                    posts.append(decrypt_post(post_list, current_user.key)[0])
+            # pulls and decrypts a page of the posts involving the current user.
+            posts, next_cursor = get_message_page(current_user, None, args['cursor'],
+                                                  page_limit(args['limit']))
 
-                else:
-                    user = User.query.filter_by(email=post.recipient).first()
-                    posts.append(decrypt_post(post_list, user.key)[0])
-
-            # returns the posts as json.
-            return jsonify(posts)
+            # returns the posts and the cursor to the next page as json.
+            return jsonify({'posts': posts, 'next': next_cursor})
 
         # looks for a user with the passed in email address in the database.
-        user = User.query.filter_by(email=args['email']).first()
+        user = identities.get_by_email(args['email'])
 
         if not user:
             return abort(404, message='User not found.')
 
-        # finds all posts between the current user and the user passed in.
-        encrypted_posts = db.session.query(Post) \
-            .where(((Post.user_id == user.id) & (Post.recipient == current_user.email))
-                   | ((Post.user_id == current_user.id) & (Post.recipient == user.email))) \
-            .order_by(Post.date_posted.desc()).all()
-
-        posts = []		# empty list for decrypted posts to be appended to.
-
-        for post in encrypted_posts:
-            post_list = [post]		# decrypt_post() takes a list as an arg.
+        # finds and decrypts a page of the posts between the current user and the user passed in.
+        posts, next_cursor = get_message_page(current_user, user, args['cursor'],
+                                              page_limit(args['limit']))
 
-            # decrypts the posts using the appropriate key.
-            if post_list[0].recipient == current_user.email:
-                posts.append(decrypt_post(post_list, current_user.key)[0])
-
-            if post_list[0].recipient == user.email:
-                posts.append(decrypt_post(post_list, user.key)[0])
-
-        # returns the posts as json.
-        return jsonify(posts)
+        # returns the posts and the cursor to the next page as json.
+        return jsonify({'posts': posts, 'next': next_cursor})
 
     def put(self):
         """
@@ -471,25 +766,16 @@ class PostApi(Resource):
         current_user = check_token(args['token'])
 
         # looks for a user with the passed in email address in the database.
-        user = User.query.filter_by(email=args['email']).first()
+        user = identities.get_by_email(args['email'])
 
         # if the user is not in the database then returns a not found error.
         if not user:
             return abort(404, message='Recipient not found')
 
         else:
-            # encrypts the content passed in the request.
-            encrypted_content = encrypt_post(args['content'], args['email'])
-
-            # new post object containing the pass in data.
-            post = Post(recipient=args['email'],
-                        title=args['title'],
-                        content=encrypted_content,
-                        user_id=current_user.id)
-
-            # new post added to the database and the change is committed.
-            db.session.add(post)
-            db.session.commit()
+            # encrypts the content passed in the request with the recipient's key,
+            # and saves the new post to the database.
+            add_message(current_user, user, args['title'], args['content'])
 
             # returns success message.
             return {'message': f'Post sent to {args["email"]}.'}
@@ -497,3 +783,146 @@ class PostApi(Resource):
 
 # adds the PostApi resource to the api.
 api.add_resource(PostApi, '/api/post')
+
+
+class ExportApi(Resource):
+    """
+    Allows the data of several users to be exported in the background, and the export's
+    progress to be followed.
+    """
+    def get(self):
+        """
+        Returns the status and progress of an export job.
+        """
+        # Parses the arguments passed in the request.
+        args = export_get_args.parse_args()
+        # checks the token sent with the request.
+        current_user = check_token(args['token'])
+
+        job = ExportJob.query.get(args['job'])
+
+        # users can only follow their own jobs.
+        if not job or job.user_id != current_user.id:
+            return abort(404, message='Export job not found.')
+
+        # expired jobs are deleted, along with any others, rather than followed.
+        if job_expired(job):
+            purge_expired_jobs()
+            return abort(410, message='Export job has expired.')
+
+        return job_view(job)
+
+    def put(self):
+        """
+        Submits a job exporting the records and posts of the given users to a zip archive.
+        Users can export their own data, and admins and medics can export any astronaut's.
+        The key the archive is encrypted with is only returned here.
+        """
+        # Parses the arguments passed in the request.
+        args = export_put_args.parse_args()
+        # checks the token sent with the request.
+        current_user = check_token(args['token'])
+
+        if args['emails'] == 'all':
+            # every astronaut, for admins and medics.
+            if current_user.role not in ['Admin', 'Medic']:
+                return abort(403, message='Access denied. Invalid user role.')
+
+            emails = [email for email, in db.session.query(User.email)
+                      .filter_by(role='Astronaut').order_by(User.id)]
+        else:
+            emails = list(dict.fromkeys(email.strip() for email in args['emails'].split(',')))
+
+        for email in emails:
+            if email != current_user.email:
+                if current_user.role not in ['Admin', 'Medic']:
+                    return abort(403, message='Access denied. Invalid user role.')
+
+                user = identities.get_by_email(email)
+
+                if not user or user.role != 'Astronaut':
+                    return abort(404, message=f'User {email} not found or not an astronaut.')
+
+        # every record type and the posts if none are given.
+        if args['record_types']:
+            type_names = list(dict.fromkeys(name.strip()
+                                            for name in args['record_types'].split(',')))
+        else:
+            type_names = list(record_types) + ['Posts']
+
+        for type_name in type_names:
+            if type_name != 'Posts' and not get_record_type(type_name):
+                return abort(400, message=f'record_types must be in {list(record_types)} '
+                                          f'or Posts.')
+
+        if not emails:
+            return abort(404, message='No users to export.')
+
+        job, key = submit_export(current_user, emails, type_names)
+
+        return dict(job_view(job), key=key), 202
+
+
+# adds the ExportApi resource to the api.
+api.add_resource(ExportApi, '/api/export')
+
+
+class ExportDownloadApi(Resource):
+    """
+    Allows the archive of a finished export job to be downloaded.
+    """
+    def get(self):
+        """
+        Decrypts and sends the archive of a finished export job, with the key returned
+        when the job was submitted. Range requests are supported, so an interrupted download
+        can be resumed.
+        """
+        # Parses the arguments passed in the request.
+        args = export_download_args.parse_args()
+        # checks the token sent with the request.
+        current_user = check_token(args['token'])
+
+        job = ExportJob.query.get(args['job'])
+
+        # users can only download their own jobs.
+        if not job or job.user_id != current_user.id:
+            return abort(404, message='Export job not found.')
+
+        # expired archives are deleted, along with any others, rather than sent.
+        if job_expired(job):
+            purge_expired_jobs()
+            return abort(410, message='Export job has expired.')
+
+        if job.status != 'complete':
+            return abort(409, message=f'Export job is {job.status}.')
+
+        headers = {'Content-Disposition': f'attachment; filename=export-{job.id}.zip',
+                   'Accept-Ranges': 'bytes'}
+        status = 200
+        start, stop = 0, job.size
+
+        if request.range:
+            byte_range = request.range.range_for_length(job.size)
+
+            if byte_range is None:
+                return abort(416, message='Range not satisfiable.')
+
+            start, stop = byte_range
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{job.size}'
+            status = 206
+
+        # the first chunk is decrypted before responding, so a wrong key is an error.
+        try:
+            chunks = read_archive(job, args['key'], start, stop)
+            first_chunk = next(chunks)
+        except (InvalidTag, ValueError):
+            return abort(403, message='Invalid export key.')
+
+        headers['Content-Length'] = str(stop - start)
+
+        return Response(chain([first_chunk], chunks), status, headers,
+                        mimetype='application/zip')
+
+
+# adds the ExportDownloadApi resource to the api.
+api.add_resource(ExportDownloadApi, '/api/export/download')
@@ -0,0 +1,95 @@
+import time
+import requests
+from healthapp.restapi.tests.rebuild_db import rebuild_db
+
+
+def export_put_test(BASE, admin_token, astro_token, medic_token):
+
+    print('Medic exports every astronaut:')
+    job = requests.put(BASE + '/api/export', {'emails': 'all',
+                                              'token': medic_token}).json()
+    print(job)
+
+    print('\nAstronaut exports their own weight records and posts:')
+    print(
+        requests.put(BASE + '/api/export', {'emails': 'astro@email.com',
+                                            'record_types': 'weight,Posts',
+                                            'token': astro_token}).json()
+    )
+
+    print('\nAstronaut exports another user:')
+    print(
+        requests.put(BASE + '/api/export', {'emails': 'doc@email.com',
+                                            'token': astro_token}).json()
+    )
+
+    print('\nBad record type:')
+    print(
+        requests.put(BASE + '/api/export', {'emails': 'astro@email.com',
+                                            'record_types': 'blood',
+                                            'token': medic_token}).json()
+    )
+
+    return job['job'], job['key']
+
+
+def export_get_test(BASE, admin_token, astro_token, medic_token, job, key):
+
+    print('Export progress:')
+    print(
+        requests.get(BASE + '/api/export', {'job': job, 'token': medic_token}).json()
+    )
+
+    # waits for the background job to write the archive.
+    time.sleep(2)
+
+    print('\nExport progress once complete:')
+    print(
+        requests.get(BASE + '/api/export', {'job': job, 'token': medic_token}).json()
+    )
+
+    print('\nAnother user\'s job:')
+    print(
+        requests.get(BASE + '/api/export', {'job': job, 'token': admin_token}).json()
+    )
+
+    print('\nDownload the archive:')
+    response = requests.get(BASE + '/api/export/download', {'job': job, 'key': key,
+                                                            'token': medic_token})
+    print(response.status_code, response.headers['Content-Type'], len(response.content))
+
+    print('\nResume the download from byte 100:')
+    response = requests.get(BASE + '/api/export/download', {'job': job, 'key': key,
+                                                            'token': medic_token},
+                            headers={'Range': 'bytes=100-'})
+    print(response.status_code, response.headers['Content-Range'])
+
+    print('\nDownload with the wrong key:')
+    print(
+        requests.get(BASE + '/api/export/download', {'job': job, 'key': 'A' * 43 + '=',
+                                                     'token': medic_token}).json()
+    )
+
+
+if __name__ == '__main__':
+    rebuild_db()
+
+    BASE = 'http://127.0.0.1:5000/'
+
+    admin_token = requests.post(BASE + '/api/login',
+                                {'email': 'admin@email.com',
+                                 'password': 'password'}). \
+        json()['token']
+
+    astro_token = requests.post(BASE + '/api/login',
+                                {'email': 'astro@email.com',
+                                 'password': 'testing'}). \
+        json()['token']
+
+    medic_token = requests.post(BASE + '/api/login',
+                                {'email': 'doc@email.com',
+                                 'password': 'test123'}). \
+        json()['token']
+
+    job, key = export_put_test(BASE, admin_token, astro_token, medic_token)
+    export_get_test(BASE, admin_token, astro_token, medic_token, job, key)
@@ -0,0 +1,84 @@
+import time
+import requests
+from healthapp.restapi.tests.rebuild_db import rebuild_db
+
+
+def key_put_test(BASE, admin_token, astro_token, medic_token):
+
+    print('Rotate own key:')
+    print(
+        requests.put(BASE + '/api/user/key', {'email': 'astro@email.com',
+                                              'token': astro_token}).json()
+    )
+
+    print('\nRecords can still be read during the rotation:')
+    print(
+        requests.get(BASE + '/api/record/weight', {'email': 'astro@email.com',
+                                                   'token': astro_token}).json()
+    )
+
+    print('\nAdmin rotates another user\'s key:')
+    print(
+        requests.put(BASE + '/api/user/key', {'email': 'doc@email.com',
+                                              'token': admin_token}).json()
+    )
+
+    print('\nNon admin rotates another user\'s key:')
+    print(
+        requests.put(BASE + '/api/user/key', {'email': 'admin@email.com',
+                                              'token': medic_token}).json()
+    )
+
+    print('\nBad email:')
+    print(
+        requests.put(BASE + '/api/user/key', {'email': '@email.com',
+                                              'token': admin_token}).json()
+    )
+
+
+def key_get_test(BASE, admin_token, astro_token, medic_token):
+
+    print('Rotation progress:')
+    print(
+        requests.get(BASE + '/api/user/key', {'email': 'astro@email.com',
+                                              'token': astro_token}).json()
+    )
+
+    # waits for the background job to re-encrypt the rows.
+    time.sleep(2)
+
+    print('\nRotation progress once complete:')
+    print(
+        requests.get(BASE + '/api/user/key', {'email': 'astro@email.com',
+                                              'token': admin_token}).json()
+    )
+
+    print('\nRecords after the rotation:')
+    print(
+        requests.get(BASE + '/api/record/weight', {'email': 'astro@email.com',
+                                                   'token': medic_token}).json()
+    )
+
+
+if __name__ == '__main__':
+    rebuild_db()
+
+    BASE = 'http://127.0.0.1:5000/'
+
+    admin_token = requests.post(BASE + '/api/login',
+                                {'email': 'admin@email.com',
+                                 'password': 'password'}). \
+        json()['token']
+
+    astro_token = requests.post(BASE + '/api/login',
+                                {'email': 'astro@email.com',
+                                 'password': 'testing'}). \
+        json()['token']
+
+    medic_token = requests.post(BASE + '/api/login',
+                                {'email': 'doc@email.com',
+                                 'password': 'test123'}). \
+        json()['token']
+
+    key_put_test(BASE, admin_token, astro_token, medic_token)
+    key_get_test(BASE, admin_token, astro_token, medic_token)
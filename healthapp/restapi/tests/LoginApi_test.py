@@ -56,6 +56,40 @@ def login_test():
 
     print(missing_pw)
 
+    print('\nRefresh token:')
+
+    login = requests.post(BASE + '/api/login',
+                          {'email': 'astro@email.com',
+                           'password': 'testing'}).json()
+
+    refreshed = requests.post(BASE + '/api/token/refresh',
+                              {'refresh_token': login['refresh_token']}).json()
+
+    print(refreshed)
+
+    print('\nUsed refresh token:')
+    print(
+        requests.post(BASE + '/api/token/refresh',
+                      {'refresh_token': login['refresh_token']}).json()
+    )
+
+    print('\nRevoke refresh token:')
+    print(
+        requests.delete(BASE + '/api/token/refresh',
+                        data={'refresh_token': refreshed['refresh_token']}).json()
+    )
+
+    print('\nToken in the Authorization header:')
+    print(
+        requests.get(BASE + '/api/user', {'email': 'astro@email.com'},
+                     headers={'Authorization': 'Bearer ' + admin_token}).json()
+    )
+
+    print('\nMissing token:')
+    print(
+        requests.get(BASE + '/api/user', {'email': 'astro@email.com'}).json()
+    )
+
     print('\nBad token:')
     print(
         requests.get(BASE + '/api/user', {'email': 'astro@email.com',
@@ -18,6 +18,29 @@ def post_get_test(BASE, admin_token, astro_token, medic_token):
         requests.get(BASE + '/api/post', {'email': 'an@email.com', 'token': astro_token}).json()
     )
 
+    print('\nFirst page of two posts:')
+    first_page = requests.get(BASE + '/api/post', {'email': 'all', 'limit': 2,
+                                                   'token': astro_token}).json()
+    print(first_page)
+
+    print('\nNext page of two posts:')
+    print(
+        requests.get(BASE + '/api/post', {'email': 'all', 'limit': 2, 'cursor': first_page['next'],
+                                          'token': astro_token}).json()
+    )
+
+    print('\nBad cursor:')
+    print(
+        requests.get(BASE + '/api/post', {'email': 'all', 'cursor': 'cursor123',
+                                          'token': astro_token}).json()
+    )
+
+    print('\nCursor holding numbers instead of a date:')
+    print(
+        requests.get(BASE + '/api/post', {'email': 'all', 'cursor': 'WzEsMl0=',
+                                          'token': astro_token}).json()
+    )
+
 
 def post_put_test(BASE, admin_token, astro_token, medic_token):
     print('New post:')
@@ -41,6 +64,22 @@ def post_put_test(BASE, admin_token, astro_token, medic_token):
                                           'token': astro_token}).json()
     )
 
+    print('\nContent too long:')
+    print(
+        requests.put(BASE + '/api/post', {'email': 'admin@email.com',
+                                          'content': 'test ' * 200,
+                                          'title': 'API test post',
+                                          'token': astro_token}).json()
+    )
+
+    print('\nRequest body too large:')
+    print(
+        requests.put(BASE + '/api/post', {'email': 'admin@email.com',
+                                          'content': 'x' * 2 * 1024 * 1024,
+                                          'title': 'API test post',
+                                          'token': astro_token}).status_code
+    )
+
 
 if __name__ == '__main__':
     rebuild_db()
@@ -48,6 +48,18 @@ def record_get_test(BASE, admin_token, astro_token, medic_token):
         requests.get(BASE + '/api/record/blood', {'email': 'astro@email.com', 'token': medic_token}).json()
     )
 
+    print('\nFirst page of two weights:')
+    first_page = requests.get(BASE + '/api/record/weight', {'email': 'astro@email.com', 'limit': 2,
+                                                            'token': medic_token}).json()
+    print(first_page)
+
+    print('\nNext page of two weights:')
+    print(
+        requests.get(BASE + '/api/record/weight', {'email': 'astro@email.com', 'limit': 2,
+                                                   'cursor': first_page['next'],
+                                                   'token': medic_token}).json()
+    )
+
 
 def record_put_test(BASE, admin_token, astro_token, medic_token):
     print('Blood pressure new post:')
@@ -70,6 +82,16 @@ def record_put_test(BASE, admin_token, astro_token, medic_token):
         requests.get(BASE + '/api/record/weight', {'email': 'astro@email.com', 'token': astro_token}).json()
     )
 
+    print('\nHeart rate new post:')
+    print(
+        requests.put(BASE + '/api/record/heart_rate', {'record': '62bpm', 'token': astro_token}).json()
+    )
+
+    print('\nHeart rate get showing new entry:')
+    print(
+        requests.get(BASE + '/api/record/heart_rate', {'email': 'astro@email.com', 'token': astro_token}).json()
+    )
+
     print('\nNot astronaut:')
     print(
         requests.put(BASE + '/api/record/blood_pressure', {'record': '123/456mmhg', 'token': admin_token}).json()
@@ -81,6 +103,54 @@ def record_put_test(BASE, admin_token, astro_token, medic_token):
     )
 
 
+def record_batch_test(BASE, admin_token, astro_token, medic_token):
+    print('Batch of records as a json array:')
+    print(
+        requests.put(BASE + '/api/records', params={'token': astro_token},
+                     json=[{'metric': 'weight', 'value': '51kg', 'timestamp': '2021-03-01T08:00:00Z'},
+                           {'metric': 'heart_rate', 'value': 64, 'timestamp': 1614589200},
+                           {'metric': 'blood', 'value': '62bpm'}]).json()
+    )
+
+    print('\nBatch of records as newline delimited json:')
+    print(
+        requests.put(BASE + '/api/records', params={'token': astro_token},
+                     headers={'Content-Type': 'application/x-ndjson'},
+                     data='{"metric": "weight", "value": "52kg", "timestamp": "2021-03-02T08:00:00"}\n'
+                          '{"metric": "weight", "value": "53kg", "timestamp": "2021-03-03T08:00:00"}\n').json()
+    )
+
+    print('\nWeight get showing the records at the times they were taken:')
+    print(
+        requests.get(BASE + '/api/record/weight', {'email': 'astro@email.com', 'token': astro_token}).json()
+    )
+
+    print('\nWeights between two times:')
+    print(
+        requests.get(BASE + '/api/record/weight', {'email': 'astro@email.com', 'from': '2021-03-02T00:00:00Z',
+                                                   'to': '2021-03-03T23:59:59Z', 'token': medic_token}).json()
+    )
+
+    print('\nWeights in March as a series of two points:')
+    print(
+        requests.get(BASE + '/api/record/weight', {'email': 'astro@email.com', 'from': '2021-03-01T00:00:00Z',
+                                                   'to': '2021-03-31T23:59:59Z', 'points': 2,
+                                                   'token': medic_token}).json()
+    )
+
+    print('\nBad points:')
+    print(
+        requests.get(BASE + '/api/record/weight', {'email': 'astro@email.com', 'points': 0,
+                                                   'token': medic_token}).json()
+    )
+
+    print('\nNot astronaut:')
+    print(
+        requests.put(BASE + '/api/records', params={'token': medic_token},
+                     json=[{'metric': 'weight', 'value': '51kg'}]).json()
+    )
+
+
 if __name__ == '__main__':
     rebuild_db()
 
@@ -103,3 +173,4 @@ if __name__ == '__main__':
 
     record_get_test(BASE, admin_token, astro_token, medic_token)
     record_put_test(BASE, admin_token, astro_token, medic_token)
+    record_batch_test(BASE, admin_token, astro_token, medic_token)
@@ -0,0 +1,113 @@
+import time
+import requests
+from healthapp.restapi.tests.rebuild_db import rebuild_db
+
+
+def sample_put_test(BASE, admin_token, astro_token, medic_token):
+    start = int(time.time()) - 7200
+
+    print('Two hours of heart rate samples at 1 Hz:')
+    print(
+        requests.put(BASE + '/api/record/heart_rate/samples',
+                     json={'samples': [[start + i, 60 + i % 20] for i in range(7200)],
+                           'token': astro_token}).json()
+    )
+
+    print('\nSamples with iso 8601 times:')
+    print(
+        requests.put(BASE + '/api/record/spo2/samples',
+                     json={'samples': [['2021-06-01T12:00:00Z', 98], ['2021-06-01T12:00:01Z', 97]],
+                           'token': astro_token}).json()
+    )
+
+    print('\nNot astronaut:')
+    print(
+        requests.put(BASE + '/api/record/heart_rate/samples',
+                     json={'samples': [[start, 60]], 'token': admin_token}).json()
+    )
+
+    print('\nBad sample:')
+    print(
+        requests.put(BASE + '/api/record/heart_rate/samples',
+                     json={'samples': [[start]], 'token': astro_token}).json()
+    )
+
+    print('\nBad record type:')
+    print(
+        requests.put(BASE + '/api/record/blood/samples',
+                     json={'samples': [[start, 60]], 'token': astro_token}).json()
+    )
+
+    return start
+
+
+def sample_get_test(BASE, admin_token, astro_token, medic_token, start):
+    print('\nFirst ten seconds of heart rate for current user:')
+    print(
+        requests.get(BASE + '/api/record/heart_rate/samples',
+                     {'email': 'astro@email.com', 'from': start, 'to': start + 9,
+                      'token': astro_token}).json()
+    )
+
+    print('\nFirst page of three heart rate samples:')
+    first_page = requests.get(BASE + '/api/record/heart_rate/samples',
+                              {'email': 'astro@email.com', 'from': start, 'limit': 3,
+                               'token': astro_token}).json()
+    print(first_page)
+
+    print('\nNext page of three heart rate samples:')
+    print(
+        requests.get(BASE + '/api/record/heart_rate/samples',
+                     {'email': 'astro@email.com', 'from': start, 'limit': 3,
+                      'cursor': first_page['next'], 'token': astro_token}).json()
+    )
+
+    print('\nTwo hours of heart rate as a series of four points:')
+    print(
+        requests.get(BASE + '/api/record/heart_rate/samples',
+                     {'email': 'astro@email.com', 'from': start, 'points': 4,
+                      'token': medic_token}).json()
+    )
+
+    print('\nSpO2 medic:')
+    print(
+        requests.get(BASE + '/api/record/spo2/samples',
+                     {'email': 'astro@email.com', 'from': '2021-06-01T00:00:00',
+                      'token': medic_token}).json()
+    )
+
+    print('\nInvalid user:')
+    print(
+        requests.get(BASE + '/api/record/heart_rate/samples',
+                     {'email': 'admin@email.com', 'token': astro_token}).json()
+    )
+
+    print('\nBad time:')
+    print(
+        requests.get(BASE + '/api/record/heart_rate/samples',
+                     {'email': 'astro@email.com', 'from': 'yesterday', 'token': medic_token}).json()
+    )
+
+
+if __name__ == '__main__':
+    rebuild_db()
+
+    BASE = 'http://127.0.0.1:5000/'
+
+    admin_token = requests.post(BASE + '/api/login',
+                                {'email': 'admin@email.com',
+                                 'password': 'password'}). \
+        json()['token']
+
+    astro_token = requests.post(BASE + '/api/login',
+                                {'email': 'astro@email.com',
+                                 'password': 'testing'}). \
+        json()['token']
+
+    medic_token = requests.post(BASE + '/api/login',
+                                {'email': 'doc@email.com',
+                                 'password': 'test123'}). \
+        json()['token']
+
+    start = sample_put_test(BASE, admin_token, astro_token, medic_token)
+    sample_get_test(BASE, admin_token, astro_token, medic_token, start)
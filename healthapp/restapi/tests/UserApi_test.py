@@ -10,6 +10,19 @@ def user_get_test(BASE, admin_token, astro_token, medic_token):
         requests.get(BASE + '/api/user', {'email': 'all', 'token': admin_token}).json()
     )
 
+    print('\nFirst page of two users:')
+
+    first_page = requests.get(BASE + '/api/user', {'email': 'all', 'limit': 2,
+                                                   'token': admin_token}).json()
+    print(first_page)
+
+    print('\nNext page of two users:')
+
+    print(
+        requests.get(BASE + '/api/user', {'email': 'all', 'limit': 2, 'cursor': first_page['next'],
+                                          'token': admin_token}).json()
+    )
+
     print('\nSpecific user:')
 
     print(
@@ -1,42 +1,72 @@
-from healthapp import db, bcrypt
-from healthapp.models import User, Post, BloodPressure, Weight
+from flask_migrate import stamp
+from sqlalchemy import text
+from healthapp import app, db, bcrypt, limiter
+from healthapp.models import User, Post, Record
 from healthapp.encryption import encrypt_post, encrypt_medical_record
-from cryptography.fernet import Fernet
+from healthapp.keyring import keyring
+from healthapp.records import record_cache
+from healthapp.identity import identities
 
 def rebuild_db():
+    # the id counters are kept, so the ids of the old users and keys, which a running
+    # server may still have cached, aren't handed out again.
+    sequences = []
+    if db.session.execute(text("SELECT name FROM sqlite_master "
+                               "WHERE name = 'sqlite_sequence'")).first():
+        sequences = db.session.execute(text('SELECT name, seq FROM sqlite_sequence')).all()
+    db.session.remove()
+
     db.drop_all()
 
     db.create_all()
+    for name, seq in sequences:
+        db.session.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                           {'name': name, 'seq': seq})
+    db.session.commit()
+
+    keyring.clear()
+    record_cache.clear()
+    identities.clear()
+    # the limits are shared with the running server, and restart with the database.
+    limiter.reset()
+
+    # marks the new database as up to date with the migrations.
+    with app.app_context():
+        stamp()
 
     hashed_password_admin = bcrypt.generate_password_hash('password').decode('utf-8')
     user_admin = User(first_name='Test', last_name='Admin', email='admin@email.com',
-                      password=hashed_password_admin, role='Admin',
-                      key=Fernet.generate_key().decode('utf-8'))
+                      password=hashed_password_admin, role='Admin')
 
     hashed_password_astro = bcrypt.generate_password_hash('testing').decode('utf-8')
     user_astro = User(first_name='Astro', last_name='Naut', email='astro@email.com',
-                      password=hashed_password_astro, role='Astronaut',
-                      key=Fernet.generate_key().decode('utf-8'))
+                      password=hashed_password_astro, role='Astronaut')
 
     hashed_password_med = bcrypt.generate_password_hash('test123').decode('utf-8')
     user_med = User(first_name='Doctor', last_name='Zoidberg', email='doc@email.com',
-                    password=hashed_password_med, role='Medic',
-                    key=Fernet.generate_key().decode('utf-8'))
+                    password=hashed_password_med, role='Medic')
 
-    post_2 = Post(title='Testing Testing', recipient='admin@email.com', content='', user_id=2)
-    post_3 = Post(title='Test 123', recipient='admin@email.com', content='', user_id=3)
-    post_4 = Post(title='This is a Test', recipient='astro@email.com', content='', user_id=1)
-    post_6 = Post(title='To The Moon', recipient='astro@email.com', content='', user_id=3)
-    post_7 = Post(title='Space Station 123', recipient='doc@email.com', content='', user_id=1)
-    post_8 = Post(title='NASA NASA', recipient='doc@email.com', content='', user_id=2)
+    db.session.add(user_admin)
+    db.session.add(user_astro)
+    db.session.add(user_med)
 
-    bp_1 = BloodPressure(record='', user_id=2)
-    bp_2 = BloodPressure(record='', user_id=2)
-    bp_3 = BloodPressure(record='', user_id=2)
+    for user in [user_admin, user_astro, user_med]:
+        keyring.create_key(user)
 
-    weight_1 = Weight(record='70kg', user_id=2)
-    weight_2 = Weight(record='71kg', user_id=2)
-    weight_3 = Weight(record='69kg', user_id=2)
+    post_2 = Post(title='Testing Testing', recipient=user_admin, content=b'', author=user_astro)
+    post_3 = Post(title='Test 123', recipient=user_admin, content=b'', author=user_med)
+    post_4 = Post(title='This is a Test', recipient=user_astro, content=b'', author=user_admin)
+    post_6 = Post(title='To The Moon', recipient=user_astro, content=b'', author=user_med)
+    post_7 = Post(title='Space Station 123', recipient=user_med, content=b'', author=user_admin)
+    post_8 = Post(title='NASA NASA', recipient=user_med, content=b'', author=user_astro)
+
+    bp_1 = Record(metric_type='blood_pressure', record=b'', author=user_astro)
+    bp_2 = Record(metric_type='blood_pressure', record=b'', author=user_astro)
+    bp_3 = Record(metric_type='blood_pressure', record=b'', author=user_astro)
+
+    weight_1 = Record(metric_type='weight', record=b'70kg', author=user_astro)
+    weight_2 = Record(metric_type='weight', record=b'71kg', author=user_astro)
+    weight_3 = Record(metric_type='weight', record=b'69kg', author=user_astro)
 
     posts = [post_2, post_3, post_4, post_6, post_7, post_8]
 
@@ -44,18 +74,18 @@ def rebuild_db():
 
     data = ['120/80mmHg', '118/84mmHg', '125/77mmHg', '70kg', '71kg', '69kg']
 
-    db.session.add(user_admin)
-    db.session.add(user_astro)
-    db.session.add(user_med)
-
-    for post in posts:
-        post.content = encrypt_post('test test test post post post 123 abc', post.recipient)
-        db.session.add(post)
+    # the posts and records are already in the session through their users, so they mustn't
+    # be flushed by the key lookups before their key ids are set.
+    with db.session.no_autoflush:
+        for post in posts:
+            post.key_id = keyring.current_key_id(post.recipient.id)
+            post.content = encrypt_post('test test test post post post 123 abc', post.key_id)
+            db.session.add(post)
 
-    for i in range(6):
-        records[i].record = encrypt_medical_record(data[i],
-                                                   User.query.filter_by(id=records[i].user_id).first().key)
-        db.session.add(records[i])
+        for i in range(6):
+            records[i].key_id = keyring.current_key_id(records[i].author.id)
+            records[i].record = encrypt_medical_record(data[i], records[i].key_id)
+            db.session.add(records[i])
 
     db.session.commit()
 
@@ -65,5 +95,4 @@ if __name__ == "__main__":
     rebuild_db()
     print(User.query.all())
     print(Post.query.all())
-    print(BloodPressure.query.all())
-    print(Weight.query.all())
+    print(Record.query.all())
@@ -0,0 +1,213 @@
+"""Module containing the json web tokens used to authenticate api requests.
+
+Tokens carry the id, email, and role of the user as claims, so checking a token costs
+a signature check rather than a database query. Changing or deleting a user bumps
+their epoch in the TokenEpoch table, and tokens issued before the bump are rejected.
+The table is shared by every process serving the api, and kept across restarts, so a
+token works on every process until it expires or is revoked. Each process caches the
+epochs for TOKEN_EPOCH_TTL seconds, so checking a token only reads the table when a
+user's epoch isn't cached, and the other processes reject revoked tokens within that time.
+
+Access tokens are short lived, so logins also return a refresh token, which can be
+exchanged for a new access token without the password, and so without a bcrypt check.
+Refresh tokens are random strings stored as their sha-256 hash, last for
+REFRESH_TOKEN_LIFETIME, and are replaced by a new one each time they are used.
+
+Classes:
+    TokenUser -- the user a token was issued to, as read from its claims.
+    TokenRevocations -- the users' token epochs, cached from the TokenEpoch table.
+
+Functions:
+    issue_token -- creates a token for a user.
+    read_token -- checks a token and returns the user it was issued to.
+    issue_refresh_token -- creates a refresh token for a user.
+    use_refresh_token -- exchanges a refresh token for the user it was issued to.
+    revoke_refresh_tokens -- revokes all of a user's refresh tokens.
+"""
+
+import hashlib
+import secrets
+from collections import namedtuple
+from datetime import datetime
+import jwt
+from sqlalchemy.exc import IntegrityError
+from healthapp import app, db
+from healthapp.models import RefreshToken, TokenEpoch, user_deleted_callbacks
+from healthapp.identity import identities
+from healthapp.keyring import TtlCache
+
+# the user a token was issued to. has the attributes of User that the api resources use.
+TokenUser = namedtuple('TokenUser', ['id', 'email', 'role'])
+
+
+class TokenRevocations:
+    """
+    Each user's token epoch. Tokens hold the epoch of their user when they were issued,
+    and revoking a user's tokens bumps it. The epochs are stored in the TokenEpoch table
+    and cached for a few seconds. Only users whose tokens have been revoked are stored.
+    """
+
+    def __init__(self, max_size, ttl):
+        self._epochs = TtlCache(max_size, ttl)     # epoch by user id.
+
+    def epoch(self, user_id):
+        """
+        Returns the user's current epoch.
+
+        Args:
+            user_id -- the id of the user.
+        """
+        epoch = self._epochs.get(user_id)
+
+        if epoch is None:
+            epoch = db.session.query(TokenEpoch.epoch).filter_by(user_id=user_id).scalar() or 0
+            self._epochs.set(user_id, epoch)
+
+        return epoch
+
+    def revoke(self, user_id):
+        """
+        Revokes all the tokens issued to a user so far, and commits the new epoch.
+
+        Args:
+            user_id -- the id of the user.
+        """
+        while True:
+            # the epoch is bumped in one statement, so concurrent revocations each count.
+            bumped = TokenEpoch.query.filter_by(user_id=user_id) \
+                .update({'epoch': TokenEpoch.epoch + 1}, synchronize_session=False)
+
+            # users whose tokens haven't been revoked before don't have a row yet.
+            if not bumped:
+                db.session.add(TokenEpoch(user_id=user_id, epoch=1))
+
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                # another process added the user's row first, so it is bumped instead.
+                db.session.rollback()
+
+        self._epochs.invalidate(user_id)
+
+    def is_current(self, claims):
+        """
+        Returns whether the claims of a token are from the user's current epoch.
+
+        Args:
+            claims -- the decoded claims of the token.
+        """
+        return isinstance(claims.get('id'), int) \
+            and claims.get('epoch') == self.epoch(claims['id'])
+
+
+# revocation table shared by all the api resources.
+revocations = TokenRevocations(app.config['IDENTITY_CACHE_SIZE'], app.config['TOKEN_EPOCH_TTL'])
+user_deleted_callbacks.append(revocations.revoke)
+
+
+def issue_token(user):
+    """Returns a new token for a user, valid for API_TOKEN_LIFETIME.
+
+    Args:
+        user -- the user the token is for.
+    """
+
+    return jwt.encode({'id': user.id,
+                       'email': user.email,
+                       'role': user.role,
+                       'epoch': revocations.epoch(user.id),
+                       'exp': datetime.utcnow() + app.config['API_TOKEN_LIFETIME']},
+                      app.config['SECRET_KEY'], algorithm='HS256')
+
+
+def read_token(token):
+    """Checks a token's signature, expiry time, and epoch, returning the TokenUser it was
+    issued to, or None if it isn't valid.
+
+    Args:
+        token -- the json web token to be checked.
+    """
+
+    try:
+        claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'],
+                            options={'require': ['exp']})
+    except jwt.exceptions.InvalidTokenError:
+        return None
+
+    if not revocations.is_current(claims):
+        return None
+
+    try:
+        return TokenUser(claims['id'], claims['email'], claims['role'])
+    except KeyError:
+        return None
+
+
+def hash_refresh_token(token):
+    """Returns the sha-256 hash a refresh token is stored as. The tokens are random, so
+    a fast hash is enough, unlike passwords.
+
+    Args:
+        token -- the refresh token.
+    """
+
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_refresh_token(user):
+    """Creates a refresh token for a user, valid for REFRESH_TOKEN_LIFETIME, and adds its hash
+    to the session. Returns the token, which is only ever sent to the user.
+
+    Args:
+        user -- the user the token is for.
+    """
+
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    db.session.add(RefreshToken(token_hash=hash_refresh_token(token), user_id=user.id,
+                                created_at=now,
+                                expires_at=now + app.config['REFRESH_TOKEN_LIFETIME']))
+
+    return token
+
+
+def use_refresh_token(token):
+    """Deletes a refresh token, so it can't be used again, and returns the snapshot of the
+    user it was issued to. Returns None if the token doesn't exist or has expired.
+    The deletion is committed along with the user's replacement token.
+
+    Args:
+        token -- the refresh token sent by the user.
+    """
+
+    refresh_token = RefreshToken.query.filter_by(token_hash=hash_refresh_token(token)).first()
+
+    if refresh_token is None:
+        return None
+
+    now = datetime.utcnow()
+
+    # only the request that deletes the token may use it, if it is sent twice at once.
+    used = RefreshToken.query.filter_by(id=refresh_token.id).delete(synchronize_session=False)
+
+    # clears out the user's expired tokens.
+    RefreshToken.query.filter(RefreshToken.user_id == refresh_token.user_id,
+                              RefreshToken.expires_at < now).delete(synchronize_session=False)
+
+    if not used or refresh_token.expires_at < now:
+        db.session.commit()
+        return None
+
+    return identities.get(refresh_token.user_id)
+
+
+def revoke_refresh_tokens(user_id):
+    """Deletes all of a user's refresh tokens, returning the number deleted. The deletion
+    is committed by the caller.
+
+    Args:
+        user_id -- the id of the user.
+    """
+
+    return RefreshToken.query.filter_by(user_id=user_id).delete(synchronize_session=False)
@@ -0,0 +1,291 @@
+"""Module containing functions for rotating the users' encryption keys.
+
+Rotating a key adds a new key for the user, which new data is encrypted with straight
+away. Existing rows keep working, as each row is decrypted with the key named by its
+key_id, and a background job re-encrypts them with the new key in batches of
+KEY_ROTATION_BATCH_SIZE rows, sleeping KEY_ROTATION_BATCH_DELAY seconds between batches
+so the job doesn't hold up requests.
+
+Other processes cache each user's current key id for KEYRING_TTL seconds, so they, and
+requests already running, can go on encrypting new data with an old key for a while
+after the rotation. Old keys are only deleted once no rows use them and the new key was
+created more than KEYRING_TTL plus KEY_RETIREMENT_MARGIN seconds ago. If the rows are
+re-encrypted sooner, the job is run again once that time has passed, picking up any rows
+written with the old key in the meantime.
+
+The job keeps no state of its own: the rows still to be re-encrypted are the ones whose
+key isn't the user's current key. An interrupted job, for example by a restart, is picked
+up again with the resume-key-rotation command.
+
+Functions:
+    pending_rows -- counts a user's rows still encrypted with an old key.
+    reencrypt_batch -- re-encrypts a batch of a user's rows with their current key.
+    retirement_delay -- returns the seconds until a user's old keys can be deleted.
+    retire_keys -- deletes a user's old keys that no rows use any more.
+    reencrypt_user -- re-encrypts all of a user's rows a batch at a time.
+    start_reencryption -- queues a user's rows to be re-encrypted in the background.
+    rotate_key -- gives a user a new key and starts re-encrypting their rows.
+    resume_key_rotation -- cli command finishing any interrupted rotations.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Lock, Timer
+from sqlalchemy import bindparam, exists, func
+from healthapp import app, db
+from healthapp.models import EncryptionKey, Post, Record, SampleBlock
+from healthapp.encryption import encrypt_data, decrypt_tokens
+from healthapp.keyring import keyring
+from healthapp.records import record_cache
+
+logger = logging.getLogger(__name__)
+
+# the encrypted tables, with their ciphertext column and the column naming the user
+# whose key the rows are encrypted with. posts use their recipient's key.
+encrypted_tables = [(Post, 'content', 'recipient_id'),
+                    (Record, 'record', 'user_id'),
+                    (SampleBlock, 'data', 'user_id')]
+
+# a single worker, so only one user's rows are re-encrypted at a time.
+rotation_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='key-rotation')
+# ids of the users queued for re-encryption, so a user isn't queued twice.
+queued_users = set()
+queued_users_lock = Lock()
+
+
+def pending_rows(user_id):
+    """Returns the number of rows in each table still encrypted with one of the user's
+    old keys.
+
+    Args:
+        user_id -- the id of the user.
+    """
+
+    key_id = keyring.current_key_id(user_id)
+
+    return {model.__tablename__: model.query.filter(getattr(model, owner_column) == user_id,
+                                                    model.key_id != key_id).count()
+            for model, _, owner_column in encrypted_tables}
+
+
+def reencrypt_batch(user_id, batch_size):
+    """Re-encrypts up to batch_size of a user's rows that use an old key with their current
+    key, and commits them. Returns the number of rows read, which is 0 once none are left.
+
+    A row is only overwritten if its ciphertext hasn't changed since it was read, so posts
+    edited and samples added during the batch aren't lost. Rows skipped for that reason
+    are read again by the next batch.
+
+    Args:
+        user_id -- the id of the user whose rows are re-encrypted.
+        batch_size -- the most rows to re-encrypt.
+    """
+
+    key_id = keyring.current_key_id(user_id)
+    row_count = 0
+
+    for model, data_column, owner_column in encrypted_tables:
+        if row_count >= batch_size:
+            break
+
+        data = getattr(model, data_column)
+        rows = db.session.query(model.id, model.key_id, data) \
+            .filter(getattr(model, owner_column) == user_id, model.key_id != key_id) \
+            .order_by(model.id).limit(batch_size - row_count).all()
+
+        if not rows:
+            continue
+
+        # decrypts the batch with each row's own key, and encrypts it with the current key.
+        keys = keyring.get_keys([row.key_id for row in rows])
+        plaintexts = decrypt_tokens([(keys[row.key_id], row[2]) for row in rows], decode=False)
+
+        table = model.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.id == bindparam('row_id'))
+            .where(table.c.key_id == bindparam('old_key_id'))
+            .where(table.c[data_column] == bindparam('old_data'))
+            .values({'key_id': key_id, data_column: bindparam('new_data')}),
+            [{'row_id': row.id, 'old_key_id': row.key_id, 'old_data': row[2],
+              'new_data': encrypt_data(plaintext, key_id)}
+             for row, plaintext in zip(rows, plaintexts)])
+
+        row_count += len(rows)
+
+    db.session.commit()
+
+    return row_count
+
+
+def retirement_delay(user_id):
+    """Returns the number of seconds until the user's old keys can be deleted, which is 0
+    once no process can still have one of them cached as the user's current key.
+
+    Args:
+        user_id -- the id of the user.
+    """
+
+    # the newest key is read from the database, in case this process's cache is stale.
+    created_at = db.session.query(EncryptionKey.created_at).filter_by(user_id=user_id) \
+        .order_by(EncryptionKey.id.desc()).limit(1).scalar()
+
+    if created_at is None:
+        raise KeyError(f'User {user_id} has no encryption key')
+
+    retire_at = created_at + timedelta(seconds=app.config['KEYRING_TTL']
+                                       + app.config['KEY_RETIREMENT_MARGIN'])
+
+    return max((retire_at - datetime.utcnow()).total_seconds(), 0)
+
+
+def retire_keys(user_id):
+    """Deletes the user's keys, other than their current key, that no rows are encrypted
+    with, once retirement_delay allows. Returns the number of keys deleted.
+
+    Args:
+        user_id -- the id of the user whose old keys are deleted.
+    """
+
+    if retirement_delay(user_id) > 0:
+        return 0
+
+    key_id = db.session.query(func.max(EncryptionKey.id)).filter_by(user_id=user_id).scalar()
+    old_keys = EncryptionKey.query.filter(EncryptionKey.user_id == user_id,
+                                          EncryptionKey.id != key_id)
+
+    # keys still used by any row are kept, including rows written since the last batch.
+    for model, _, _ in encrypted_tables:
+        old_keys = old_keys.filter(~exists().where(model.key_id == EncryptionKey.id))
+
+    old_key_ids = [old_key_id for old_key_id, in old_keys.with_entities(EncryptionKey.id)]
+
+    if old_key_ids:
+        EncryptionKey.query.filter(EncryptionKey.id.in_(old_key_ids)) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+
+        for old_key_id in old_key_ids:
+            keyring.invalidate(key_id=old_key_id)
+
+    return len(old_key_ids)
+
+
+def reencrypt_user(user_id):
+    """Re-encrypts all of a user's rows that use an old key, one batch at a time, then
+    deletes the old keys, or runs the job again once they can be deleted.
+    Returns the number of rows read.
+
+    Args:
+        user_id -- the id of the user whose rows are re-encrypted.
+    """
+
+    batch_size = app.config['KEY_ROTATION_BATCH_SIZE']
+    start = time.perf_counter()
+    total = 0
+
+    try:
+        while True:
+            row_count = reencrypt_batch(user_id, batch_size)
+            total += row_count
+
+            if row_count == 0:
+                break
+
+            # gives the requests waiting on the database a turn between batches.
+            time.sleep(app.config['KEY_ROTATION_BATCH_DELAY'])
+
+        delay = retirement_delay(user_id)
+
+        if delay > 0:
+            # the job is run again once the old keys can be deleted.
+            retired = 0
+            timer = Timer(delay, start_reencryption, (user_id,))
+            timer.daemon = True
+            timer.start()
+        else:
+            retired = retire_keys(user_id)
+
+    # the user has been deleted since the job was queued.
+    except KeyError:
+        db.session.rollback()
+        return total
+
+    logger.info('Re-encrypted %d rows and retired %d keys of user %d in %.3f s',
+                total, retired, user_id, time.perf_counter() - start)
+
+    return total
+
+
+def run_reencryption(user_id):
+    """Runs reencrypt_user on the rotation worker, inside an app context of its own.
+
+    Args:
+        user_id -- the id of the user whose rows are re-encrypted.
+    """
+
+    with queued_users_lock:
+        queued_users.discard(user_id)
+
+    with app.app_context():
+        try:
+            reencrypt_user(user_id)
+        except Exception:   # pylint: disable=broad-except
+            # the rows are left as they are, and are picked up when the job is resumed.
+            logger.exception('Re-encrypting the rows of user %d failed', user_id)
+
+
+def start_reencryption(user_id):
+    """Queues a user's rows to be re-encrypted with their current key in the background.
+
+    Args:
+        user_id -- the id of the user whose rows are re-encrypted.
+    """
+
+    with queued_users_lock:
+        if user_id in queued_users:
+            return
+
+        queued_users.add(user_id)
+
+    rotation_pool.submit(run_reencryption, user_id)
+
+
+def rotate_key(user):
+    """Gives a user a new key, which their new data is encrypted with from now on, and
+    starts re-encrypting their existing rows with it in the background. Returns the new key.
+
+    Args:
+        user -- the user whose key is rotated.
+    """
+
+    key = keyring.create_key(user)
+    db.session.commit()
+
+    # other threads may have cached the old key as current before the commit.
+    keyring.invalidate(user_id=user.id)
+    # drops the user's decrypted records, in case the key was rotated because it leaked.
+    record_cache.invalidate_user(user.id)
+    start_reencryption(user.id)
+
+    return key
+
+
+@app.cli.command('resume-key-rotation')
+def resume_key_rotation():
+    """Re-encrypts the rows of every user with more than one key, finishing rotations
+    interrupted by a restart."""
+
+    user_ids = [user_id for user_id, in db.session.query(EncryptionKey.user_id)
+                .group_by(EncryptionKey.user_id).having(func.count(EncryptionKey.id) > 1)]
+
+    for user_id in user_ids:
+        print(f'User {user_id}: re-encrypted {reencrypt_user(user_id)} rows.')
+
+        # the command doesn't wait for keys too new to retire.
+        delay = retirement_delay(user_id)
+        if delay > 0:
+            print(f'User {user_id}: old keys are kept for another {delay:.0f} s, '
+                  f'run the command again to delete them.')
@@ -0,0 +1,345 @@
+"""Module containing functions for storing and reading high frequency time-series samples.
+
+Storing each sample as its own record costs a Fernet token, and a decryption, per
+sample. Instead, consecutive samples of one record type are packed into blocks of up
+to SAMPLE_BLOCK_SIZE samples, which are compressed and encrypted as a whole. Each
+block's time range is stored alongside it, so reading a time range only loads and
+decrypts the blocks that overlap it.
+
+Topping up the latest block is a read, modify, and write, so the block is only
+overwritten if its ciphertext hasn't changed since it was read, in the same way as key
+rotation. If another upload got there first, the latest block is read again, up to
+TOP_UP_ATTEMPTS times, after which the samples are saved in new blocks of their own.
+
+Reads of the samples themselves are paginated, so one request can't decrypt and return
+an unbounded range. Blocks are decrypted in time order until they hold the page, and the
+cursor to the next page, built by healthapp.pagination, holds the time of the next sample
+and the number of samples at that time already returned.
+
+Functions:
+    parse_timestamp -- reads a sample time from an iso 8601 string or unix timestamp.
+    pack_samples -- compresses and encrypts a list of samples.
+    unpack_samples -- decompresses the decrypted samples of a block.
+    block_columns -- builds the columns of a block holding samples and their time range.
+    save_samples -- saves samples, topping up the latest block if no other upload has.
+    add_samples -- packs new samples into blocks and saves them.
+    read_samples -- finds and decrypts the samples within a time range as (time, value) pairs.
+    get_samples -- finds and decrypts a page of the samples within a time range.
+    get_sample_series -- summarises the samples within a time range as a downsampled series.
+"""
+
+import json
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from flask import abort
+from healthapp import app, db
+from healthapp.models import SampleBlock
+from healthapp.encryption import encrypt_data, decrypt_tokens
+from healthapp.keyring import keyring
+from healthapp.pagination import decode_cursor, encode_cursor
+from healthapp.series import downsample
+
+# times the latest block is read again when another upload tops it up at the same time.
+TOP_UP_ATTEMPTS = 3
+
+# position of the next page of samples: the time of its first sample, and the number of
+# samples at that time on the pages before it. stored in cursors as these two columns.
+SamplePosition = namedtuple('SamplePosition', ['start_time', 'sample_count'])
+position_columns = (SampleBlock.start_time, SampleBlock.sample_count)
+
+
+def parse_timestamp(value):
+    """Returns a sample time as a naive utc datetime, as stored in the database.
+    Raises a ValueError if the time can't be read.
+
+    Args:
+        value -- an iso 8601 string, or the number of seconds since the unix epoch.
+    """
+
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f'Invalid time: {value}')
+
+    # unix timestamps sent as query string arguments arrive as strings.
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = None
+
+    if seconds is not None:
+        try:
+            return datetime.utcfromtimestamp(seconds)
+        except (OverflowError, OSError) as error:
+            raise ValueError(f'Invalid time: {value}') from error
+
+    # fromisoformat doesn't accept the Z suffix for utc.
+    timestamp = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+
+    # times with an offset are converted to utc.
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return timestamp
+
+
+def pack_samples(samples, key_id):
+    """Compresses and encrypts samples, returning the encrypted block as bytes.
+    The times are stored as millisecond offsets from the first sample, which compress
+    far better than full timestamps.
+
+    Args:
+        samples -- list of (time, value) pairs, sorted by time.
+        key_id -- the id of the current key of the user the samples belong to.
+    """
+
+    start = samples[0][0]
+    offsets = [[round((time - start).total_seconds() * 1000), value] for time, value in samples]
+    payload = zlib.compress(json.dumps(offsets, separators=(',', ':')).encode())
+
+    return encrypt_data(payload, key_id)
+
+
+def unpack_samples(block, payload):
+    """Decompresses the decrypted data of a block, returning its list of (time, value) pairs.
+
+    Args:
+        block -- the block the data belongs to.
+        payload -- the decrypted data of the block.
+    """
+
+    return [(block.start_time + timedelta(milliseconds=offset), value)
+            for offset, value in json.loads(zlib.decompress(payload))]
+
+
+def block_columns(samples, key_id):
+    """Returns the columns of a block holding a sorted list of samples, along with their
+    time range.
+
+    Args:
+        samples -- list of (time, value) pairs, sorted by time.
+        key_id -- the id of the current key of the user the samples belong to.
+    """
+
+    return {'start_time': samples[0][0],
+            'end_time': samples[-1][0],
+            'sample_count': len(samples),
+            'key_id': key_id,
+            'data': pack_samples(samples, key_id)}
+
+
+def save_samples(record_type, user, samples, top_up=True):
+    """Packs sorted samples into blocks and commits them. Samples following on from the
+    user's latest block top it up before any new blocks are started. Returns False, having
+    saved nothing, if another upload changed the latest block after it was read.
+
+    Args:
+        record_type -- the type of the samples.
+        user -- the user the samples belong to.
+        samples -- list of (time, value) pairs, sorted by time.
+        top_up -- whether the latest block may be topped up.
+    """
+
+    block_size = app.config['SAMPLE_BLOCK_SIZE']
+    key_id = keyring.current_key_id(user.id)
+
+    # the latest block is topped up if it isn't full and the new samples come after it.
+    last_block = db.session.query(SampleBlock.id, SampleBlock.start_time, SampleBlock.end_time,
+                                  SampleBlock.sample_count, SampleBlock.key_id,
+                                  SampleBlock.data) \
+        .filter_by(user_id=user.id, metric_type=record_type.name) \
+        .order_by(SampleBlock.end_time.desc()).first()
+
+    if top_up and last_block and last_block.sample_count < block_size \
+            and samples[0][0] >= last_block.end_time:
+        space = block_size - last_block.sample_count
+        payload = decrypt_tokens([(keyring.get_key(last_block.key_id), last_block.data)],
+                                 decode=False)[0]
+        columns = block_columns(unpack_samples(last_block, payload) + samples[:space], key_id)
+
+        # the block is only overwritten if no other upload has changed it since it was read.
+        table = SampleBlock.__table__
+        result = db.session.execute(table.update()
+                                    .where(table.c.id == last_block.id)
+                                    .where(table.c.data == last_block.data)
+                                    .values(columns))
+
+        if result.rowcount == 0:
+            db.session.rollback()
+            return False
+
+        samples = samples[space:]
+
+    # the remaining samples are split into new blocks.
+    for i in range(0, len(samples), block_size):
+        db.session.add(SampleBlock(metric_type=record_type.name, user_id=user.id,
+                                   **block_columns(samples[i:i + block_size], key_id)))
+
+    db.session.commit()
+
+    return True
+
+
+def add_samples(record_type, user, samples):
+    """Packs new samples into blocks and saves them to the database. Samples following
+    on from the user's latest block top it up before any new blocks are started.
+    Returns the number of samples saved, or raises a ValueError if any sample is invalid.
+
+    Args:
+        record_type -- the type of the samples.
+        user -- the user the samples belong to.
+        samples -- list of [time, value] pairs, where the time is an iso 8601 string or
+                   unix timestamp, and the value is a string or number.
+    """
+
+    parsed_samples = []
+
+    for sample in samples:
+        if not isinstance(sample, (list, tuple)) or len(sample) != 2:
+            raise ValueError('Samples must be [time, value] pairs.')
+
+        time, value = sample
+        if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+            raise ValueError(f'Invalid sample value: {value}')
+
+        parsed_samples.append((parse_timestamp(time), value))
+
+    if not parsed_samples:
+        return 0
+
+    parsed_samples.sort(key=lambda sample: sample[0])
+
+    # the last attempt saves the samples in new blocks, which can't conflict.
+    for attempt in range(TOP_UP_ATTEMPTS + 1):
+        if save_samples(record_type, user, parsed_samples, top_up=attempt < TOP_UP_ATTEMPTS):
+            break
+
+    return len(samples)
+
+
+def read_samples(record_type, user, start=None, end=None, count=None):
+    """Finds and decrypts a user's samples of one type within a time range, returning them
+    as (time, value) pairs, oldest first. Only the blocks overlapping the range are loaded,
+    and they are decrypted in batches, in time order, until they hold the first count
+    samples of the range.
+
+    Args:
+        record_type -- the type of the samples.
+        user -- the user the samples belong to.
+        start -- the earliest time to include, or None for no limit.
+        end -- the latest time to include, or None for no limit.
+        count -- the number of samples to return, or None for all of them.
+    """
+
+    query = db.session.query(SampleBlock.id, SampleBlock.start_time, SampleBlock.end_time,
+                             SampleBlock.sample_count) \
+        .filter_by(user_id=user.id, metric_type=record_type.name)
+
+    # a block overlaps the range if it starts before the end and ends after the start.
+    if start is not None:
+        query = query.filter(SampleBlock.end_time >= start)
+    if end is not None:
+        query = query.filter(SampleBlock.start_time <= end)
+
+    # the time ranges of the blocks are read first, so only the blocks needed are loaded.
+    ranges = query.order_by(SampleBlock.start_time, SampleBlock.id).all()
+    samples = []
+    loaded = 0
+
+    while loaded < len(ranges):
+        # takes blocks until they hold enough samples, then any blocks starting before the
+        # last of them ends, since blocks uploaded out of order can overlap.
+        batch_end = loaded
+        batch_samples = 0
+        latest_end = None
+
+        while batch_end < len(ranges) and (
+                batch_end == loaded or count is None or batch_samples < count - len(samples)
+                or ranges[batch_end].start_time <= latest_end):
+            batch_samples += ranges[batch_end].sample_count
+            latest_end = max(latest_end or ranges[batch_end].end_time, ranges[batch_end].end_time)
+            batch_end += 1
+
+        batch = ranges[loaded:batch_end]
+        blocks = {block.id: block for block in
+                  SampleBlock.query.filter(SampleBlock.id.in_([row.id for row in batch]))}
+        blocks = [blocks[row.id] for row in batch]
+        keys = keyring.get_keys([block.key_id for block in blocks])
+        payloads = decrypt_tokens([(keys[block.key_id], block.data) for block in blocks],
+                                  decode=False)
+
+        for block, payload in zip(blocks, payloads):
+            samples.extend(sample for sample in unpack_samples(block, payload)
+                           if (start is None or sample[0] >= start)
+                           and (end is None or sample[0] <= end))
+
+        # overlapping blocks can be out of order, so the samples are put back in time order.
+        samples.sort(key=lambda sample: sample[0])
+        loaded = batch_end
+
+        # the first count samples are complete once the next block starts after them all.
+        if count is not None and len(samples) >= count \
+                and (loaded == len(ranges) or samples[count - 1][0] < ranges[loaded].start_time):
+            return samples[:count]
+
+    return samples
+
+
+def get_samples(record_type, user, start=None, end=None, cursor=None, limit=None):
+    """Finds and decrypts a page of a user's samples of one type within a time range,
+    oldest first. Returns the samples and the cursor to the next page, which is None when
+    there are no more samples. An invalid cursor returns a bad request error.
+
+    Args:
+        record_type -- the type of the samples.
+        user -- the user the samples belong to.
+        start -- the earliest time to include, or None for no limit.
+        end -- the latest time to include, or None for no limit.
+        cursor -- the cursor returned with the previous page, or None for the first page.
+        limit -- the most samples on the page, MAX_SAMPLES_PER_REQUEST if not given.
+    """
+
+    limit = limit or app.config['MAX_SAMPLES_PER_REQUEST']
+    skip = 0
+
+    if cursor:
+        try:
+            position = SamplePosition(*decode_cursor(cursor, position_columns))
+        except ValueError:
+            return abort(400, 'Invalid page cursor.')
+
+        # the page starts at the cursor's time, after the samples at that time already sent.
+        if start is None or position.start_time > start:
+            start = position.start_time
+            skip = position.sample_count
+
+    # one extra sample is read to find out if there is a next page.
+    samples = read_samples(record_type, user, start, end, skip + limit + 1)[skip:]
+    next_cursor = None
+
+    if len(samples) > limit:
+        next_time = samples[limit][0]
+        sent = sum(1 for time, _ in samples[:limit] if time == next_time)
+
+        # samples at the cursor's time skipped on this page were sent on earlier pages.
+        if next_time == start:
+            sent += skip
+
+        next_cursor = encode_cursor(SamplePosition(next_time, sent), position_columns)
+
+    return [{'date_posted': time.isoformat(), 'record': value}
+            for time, value in samples[:limit]], next_cursor
+
+
+def get_sample_series(record_type, user, points, start=None, end=None):
+    """Summarises a user's samples of one type within a time range in up to the given
+    number of time buckets, oldest first, using healthapp.series.downsample.
+
+    Args:
+        record_type -- the type of the samples.
+        user -- the user the samples belong to.
+        points -- the most buckets to return.
+        start -- the earliest time to include, or None for no limit.
+        end -- the latest time to include, or None for no limit.
+    """
+
+    return downsample(read_samples(record_type, user, start, end), points)
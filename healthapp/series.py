@@ -0,0 +1,97 @@
+"""Module containing functions for downsampling records and samples into plottable series.
+
+Dashboards plotting months of readings only need a few hundred points. Rather than
+sending every reading, the time range is split into equal buckets, and the number of
+readings and their minimum, maximum, and mean are returned for each bucket that has any.
+Records are stored as text, such as 70kg or 120/80mmhg, so the numbers are read out of
+them, and readings with several numbers, like blood pressure, are summarised per number.
+Readings without a number are left out.
+
+Functions:
+    reading_values -- reads the numbers out of a record or sample value.
+    downsample -- summarises a series of readings in a number of time buckets.
+"""
+
+import re
+
+# a number within the text of a record, such as the 120 and 80 of 120/80mmhg.
+number_pattern = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def reading_values(value):
+    """Returns the numbers in a reading as a tuple, from the text of a record, a number,
+    or a list of numbers.
+
+    Args:
+        value -- the decrypted record or sample value.
+    """
+
+    if isinstance(value, bool):
+        return ()
+
+    if isinstance(value, (int, float)):
+        return (float(value),)
+
+    if isinstance(value, str):
+        return tuple(float(number) for number in number_pattern.findall(value))
+
+    if isinstance(value, list):
+        return tuple(float(number) for number in value
+                     if isinstance(number, (int, float)) and not isinstance(number, bool))
+
+    return ()
+
+
+def downsample(readings, points):
+    """Splits the time range of a series of readings into equal buckets, and returns the
+    start and end time, count, minimum, maximum, and mean of the readings in each bucket
+    that has any, oldest first. The minimum, maximum, and mean are lists, with an entry
+    for each number in the readings.
+
+    Args:
+        readings -- list of (time, value) pairs, oldest first.
+        points -- the number of buckets.
+    """
+
+    readings = [(time, reading_values(value)) for time, value in readings]
+    readings = [(time, values) for time, values in readings if values]
+
+    if not readings:
+        return []
+
+    first = readings[0][0]
+    span = (readings[-1][0] - first).total_seconds()
+    buckets = {}
+
+    # one pass over the readings, adding each one to the totals of its bucket.
+    for time, values in readings:
+        index = min(int((time - first).total_seconds() / span * points), points - 1) \
+            if span else 0
+        bucket = buckets.get(index)
+
+        if bucket is None:
+            bucket = buckets[index] = {'start': time, 'end': time, 'count': 0,
+                                       'min': [], 'max': [], 'sum': [], 'counts': []}
+
+        bucket['end'] = time
+        bucket['count'] += 1
+
+        for position, value in enumerate(values):
+            if position == len(bucket['sum']):
+                bucket['min'].append(value)
+                bucket['max'].append(value)
+                bucket['sum'].append(value)
+                bucket['counts'].append(1)
+            else:
+                bucket['min'][position] = min(bucket['min'][position], value)
+                bucket['max'][position] = max(bucket['max'][position], value)
+                bucket['sum'][position] += value
+                bucket['counts'][position] += 1
+
+    return [{'start': bucket['start'].isoformat(),
+             'end': bucket['end'].isoformat(),
+             'count': bucket['count'],
+             'min': bucket['min'],
+             'max': bucket['max'],
+             'mean': [total / count for total, count in zip(bucket['sum'], bucket['counts'])]}
+            for _, bucket in sorted(buckets.items())]
@@ -1,16 +1,17 @@
 """Module containing functions for downloading data
 
+Downloads are streamed to the user as csv as the rows are decrypted, rather than written
+to a file first, using the exports in healthapp.exports.
+
 Functions:
     download_record -- downloads specified records of a user.
 """
 
-import csv
-from pathlib import Path
 from flask_login import current_user
-from flask import send_file
-from healthapp.encryption import decrypt_post, decrypt_medical_record
-from healthapp.models import User, Post, Weight, BloodPressure
-from healthapp import db
+from flask import Response, abort, stream_with_context
+from healthapp.exports import post_lines, record_lines
+from healthapp.identity import identities
+from healthapp.records import get_record_type
 
 
 def download_record(user_email, record_type):
@@ -18,72 +19,22 @@ def download_record(user_email, record_type):
 
     Args:
         user_email -- the email of the user whose data is to be downloaded.
-        record_type - the type of record to be downloaded.
+        record_type - name of the record type to be downloaded, or Posts.
     """
-    path = Path(__file__).parent / "../ExportedData.csv"   # path csv is temporarily saved to.
-    user = User.query.filter_by(email=user_email).first()   # user that owns the record
-
-    if record_type == 'Posts':
-        # pulls all post between the specified user and the current user from the database.
-        encrypted_posts = db.session.query(Post) \
-            .where(((Post.user_id == user.id) & (Post.recipient == current_user.email))
-                   | ((Post.user_id == current_user.id) & (Post.recipient == user.email))) \
-            .order_by(Post.date_posted.desc()).all()
-
-        posts = []  # empty list that decrypted posts are appended to.
-
-        for post in encrypted_posts:
-            post_list = [post]  # decrypt_posts() requires a list as an argument.
-
-            if post_list[0].recipient == current_user.email:
-                # if current user is post recipient then their key is used to decrypt.
-                posts.append(decrypt_post(post_list, current_user.key)[0])
-
-            if post_list[0].recipient == user.email:
-                # if specified user is post recipient then their key is used to decrypt.
-                posts.append(decrypt_post(post_list, user.key)[0])
+    user = identities.get_by_email(user_email)   # user that owns the record
 
-        with open(path, 'w') as csvfile:
-            # writes the decrypted posts to the csv at the path.
-            # field names are column names.
-            writer = csv.DictWriter(
-                csvfile,
-                fieldnames=['id', 'author', 'recipient', 'date_posted', 'title', 'content']
-            )
+    if user is None:
+        return abort(404)
 
-            writer.writeheader()
-
-            for post in posts:
-                writer.writerow(post)
-
-    elif record_type == 'Blood Pressure':
-        # pulls all blood pressure records for the given user from the database.
-        encrypted_bp = BloodPressure.query.filter_by(user_id=user.id).all()
-
-        # decrypts records using the specified user's key
-        posts = decrypt_medical_record(encrypted_bp, user.key)
-
-        with open(path, 'w') as csvfile:
-            # writes the decrypted posts to the csv at the path.
-            # field names are column names.
-            writer = csv.DictWriter(csvfile, fieldnames=['id', 'author', 'date_posted', 'record'])
-            writer.writeheader()
-            for post in posts:
-                writer.writerow(post)
-
-    elif record_type == 'Weight':
-        # pulls all weight records for the given user from the database.
-        encrypted_weight = Weight.query.filter_by(user_id=user.id).all()
-
-        # decrypts records using the specified user's key
-        posts = decrypt_medical_record(encrypted_weight, user.key)
+    if record_type == 'Posts':
+        # all posts between the specified user and the current user.
+        lines = post_lines(current_user, user)
 
-        with open(path, 'w') as csvfile:
-            # writes the decrypted posts to the csv at the path.
-            # field names are column names.
-            writer = csv.DictWriter(csvfile, fieldnames=['id', 'author', 'date_posted', 'record'])
-            writer.writeheader()
-            for post in posts:
-                writer.writerow(post)
+    else:
+        # all the records of the given type for the user, decrypted with the user's keys.
+        lines = record_lines(user, get_record_type(record_type))
 
-    return send_file(path, as_attachment=True)  # sends csv file to be downloaded.
+    # streams the csv to be downloaded, keeping the request context for the database session.
+    # each chunk is read in a transaction of its own, so writers aren't held up meanwhile.
+    return Response(stream_with_context(lines), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=ExportedData.csv'})
@@ -4,14 +4,13 @@ Classes:
     RegistrationForm -- User registration form.
     LoginForm -- User login form.
     PostForm -- User post form.
-    BloodPressureForm -- Astronaut form for adding a blood pressure record.
-    Weight -- Astronaut form for adding a weight record.
+    RecordForm -- Astronaut form for adding a medical record of any type.
 """
 
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, TextAreaField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
-from healthapp.models import User
+from healthapp.identity import identities
 
 
 class RegistrationForm(FlaskForm):
@@ -34,7 +33,7 @@ class RegistrationForm(FlaskForm):
             email -- email entered into the form to be checked.
         """
         # searches for user in the database.
-        user = User.query.filter_by(email=email.data).first()
+        user = identities.get_by_email(email.data)
 
         if user:
             # sends error message if user is found in the database.
@@ -76,23 +75,16 @@ class PostForm(FlaskForm):
             recipient -- recipient email to be checked.
         """
         # finds user with the entered email in the database.
-        user = User.query.filter_by(email=recipient.data).first()
+        user = identities.get_by_email(recipient.data)
 
         if not user:
             # sends error message if user is not found.
             raise ValidationError('Recipient email not registered')
 
 
-class BloodPressureForm(FlaskForm):
-    """Astronaut form for adding a blood pressure record."""
+class RecordForm(FlaskForm):
+    """Astronaut form for adding a medical record. The field label is set to the
+    name of the record type by the page using the form."""
 
-    blood_pressure = StringField('Blood Pressure', validators=[DataRequired(),
-                                                               Length(min=1, max=12)])
-    submit = SubmitField('Submit')
-
-
-class WeightForm(FlaskForm):
-    """Astronaut form for adding a weight record."""
-
-    weight = StringField('Weight', validators=[DataRequired(), Length(min=1, max=12)])
+    record = StringField('Record', validators=[DataRequired(), Length(min=1, max=12)])
     submit = SubmitField('Submit')
@@ -5,13 +5,11 @@ Functions:
     login -- loads the user log in page.
     logout -- logs out the user.
     new_post -- loads page for creating a new post.
-    blood_pressure -- loads page for creating new blood pressure record.
-    weight -- loads page for creating new weight record.
+    inject_record_types -- makes the registered record types available to all templates.
+    records -- loads page for creating new records of a given type.
     astronauts -- loads page showing all astronauts.
     medics -- loads page showing all medics.
-    astronauts_blood_pressure -- loads page showing all blood pressure records
-    for a given astronaut.
-    astronauts_weight -- loads page showing all weight records for a given astronaut.
+    astronaut_records -- loads page showing the records of a given type for a given astronaut.
     user_posts -- loads page showing all posts between the current user and a given user.
     download_data -- downloads the records on a given page.
     user_account -- loads page for a given user and all posts between them and the current user.
@@ -22,23 +20,30 @@ Functions:
 
 """
 
-import os
-from pathlib import Path
-from flask import render_template, url_for, flash, redirect, request, abort, after_this_request
+from flask import render_template, url_for, flash, redirect, request, abort
 from flask_login import login_user, current_user, logout_user, login_required
-from cryptography.fernet import Fernet
-from healthapp import app, db, bcrypt
-from healthapp.models import User, Post, BloodPressure, Weight, delete_user_from_db
+from healthapp import app, db
+from healthapp.models import User, Post, delete_user_from_db
 
-from healthapp.webapp.forms import RegistrationForm, LoginForm, \
-    PostForm, BloodPressureForm, WeightForm
+from healthapp.webapp.forms import RegistrationForm, LoginForm, PostForm, RecordForm
 
-from healthapp.encryption import encrypt_medical_record,\
-    decrypt_medical_record, encrypt_post, decrypt_post
+from healthapp.encryption import encrypt_post
+from healthapp.keyring import keyring
+from healthapp.identity import identities
+from healthapp.passwords import hash_password, check_password
+from healthapp.messages import get_message_page, find_message, decrypt_messages, add_message
+from healthapp.records import record_types, get_record_type, add_record, get_record_page
+from healthapp.pagination import paginate
 
 from healthapp.webapp.downloads import download_record
 
 
+@app.context_processor
+def inject_record_types():
+    """Makes the registered record types available to all templates, for the nav bar."""
+    return {'record_types': record_types}
+
+
 @app.route("/")
 @app.route("/home")
 @login_required
@@ -48,27 +53,12 @@ def home():
     If user isn't authenticated the n redirects to login page.
     """
 
-    # pulls encrypted posts either to or from the current user from the database.
-    encrypted_posts = db.session.query(Post) \
-            .where((Post.recipient == current_user.email) | (Post.user_id == current_user.id))\
-            .order_by(Post.date_posted.desc()).all()
+    # pulls and decrypts a page of the posts either to or from the current user.
+    posts, next_cursor = get_message_page(current_user, None, request.args.get('cursor'),
+                                          app.config['PAGE_SIZE'])
 
-    posts = []  # empty lists for decrypted posts to be appended to.
-
-    for encrypted_post in encrypted_posts:
-        post_list = [encrypted_post]    # decrypt() post takes a list as an argument.
-        if post_list[0].recipient == current_user.email:
-            # decrypts post using the current user's key.
-            posts.append(decrypt_post(post_list, current_user.key)[0])
-
-        else:
-            # pulls the recipient's user data form the database.
-            user = User.query.filter_by(email=encrypted_post.recipient).first()
-            # decrypts the post using the recipient's key.
-            posts.append(decrypt_post(post_list, user.key)[0])
-
-    # passes posts and title into the html template.
-    return render_template('home.html', posts=posts, title='Home')
+    # passes posts, the next page cursor, and title into the html template.
+    return render_template('home.html', posts=posts, next_cursor=next_cursor, title='Home')
 
 
 @app.route("/login", methods=['GET', 'POST'])
@@ -89,7 +79,7 @@ def login():
         # the email address entered is loaded form the database.
         user = User.query.filter_by(email=form.email.data).first()
 
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        if user and check_password(user.password, form.password.data):
             # if the user with the email address is found, and the password
             # is checked successfully then the user is logged in.
             login_user(user)
@@ -122,15 +112,9 @@ def new_post():
     form = PostForm()   # Post form to be passed into the template.
     if form.validate_on_submit():
         # if form data is validated successfully, encrypts post content
-        # using the recipients key.
-        encrypted_content = encrypt_post(form.content.data, form.recipient.data)
-
-        # Post object using the form data and the encrypted content.
-        encrypted_post = Post(recipient=form.recipient.data, title=form.title.data,
-                              content=encrypted_content, author=current_user)
-        # adds the post to the database and commits the change.
-        db.session.add(encrypted_post)
-        db.session.commit()
+        # using the recipients key, and saves the post to the database.
+        recipient = identities.get_by_email(form.recipient.data)
+        add_message(current_user, recipient, form.title.data, form.content.data)
 
         # redirects to homepage and flashes post created message.
         flash('Post created.', 'success')
@@ -140,78 +124,46 @@ def new_post():
     return render_template('create_post.html', title='New Post', form=form, legend='New Post')
 
 
-@app.route("/bloodpressure", methods=['GET', 'POST'])
+# the blood pressure and weight pages kept their own urls before the record types were
+# registered, so these still work.
+@app.route("/bloodpressure", methods=['GET', 'POST'], defaults={'record_type': 'blood_pressure'})
+@app.route("/weight", methods=['GET', 'POST'], defaults={'record_type': 'weight'})
+@app.route("/records/<string:record_type>", methods=['GET', 'POST'])
 @login_required
-def blood_pressure():
+def records(record_type):
     """
-    Loads page for astronaut to submit new blood pressure record.
-    Takes data from the submitted BloodPressure form, encrypts it,
+    Loads page for astronaut to submit new records of the given type.
+    Takes data from the submitted Record form, encrypts it,
     and saves it to the database.
+
+    Args:
+        record_type -- name of the registered record type.
     """
     if current_user.role != 'Astronaut':
         return abort(403)   # access denied if current user is not an astronaut.
 
-    form = BloodPressureForm()  # BloodPressure form to be passed into the template.
-    if form.validate_on_submit():
-        # if form data is validated successfully, encrypts record
-        # using the users key.
-        encrypted_blood_pressure = encrypt_medical_record(form.blood_pressure.data,
-                                                          current_user.key)
-        # BloodPressure object using the form data and the encrypted content.
-        bp = BloodPressure(record=encrypted_blood_pressure, user_id=current_user.id)
-        db.session.add(bp)
-        db.session.commit()
-        # redirects to blood pressure page and flashes record created message.
-        flash('Blood pressure submitted.', 'success')
-        return redirect(url_for('blood_pressure'))
-
-    # pulls the current user's blood pressure records from the database.
-    encrypted_bp = BloodPressure.query. \
-        filter_by(user_id=current_user.id).order_by(BloodPressure.date_posted.desc()).all()
-    # decrypts the records.
-    posts = decrypt_medical_record(encrypted_bp,
-                                   current_user.key)
-    # passes the decrypted data into the html, along with
-    # the page title, form legend, and form.
-    return render_template('blood_pressure.html', title='Blood Pressure',
-                           form=form, posts=posts, legend='New Blood Pressure')
-
-
-@app.route("/weight", methods=['GET', 'POST'])
-@login_required
-def weight():
-    """
-    Loads page for astronaut to submit new weight record.
-    Takes data from the submitted Weight form, encrypts it,
-    and saves it to the database.
-    """
-
-    if current_user.role != 'Astronaut':
-        return abort(403) # access denied if current user is not an astronaut.
+    record_type = get_record_type(record_type)
+    if not record_type:
+        return abort(404)   # not found error if the record type isn't registered.
 
-    form = WeightForm()
+    form = RecordForm()     # Record form to be passed into the template.
+    form.record.label.text = record_type.label
     if form.validate_on_submit():
-        # if form data is validated successfully, encrypts record
-        # using the users key.
-        encrypted_weight = encrypt_medical_record(form.weight.data, current_user.key)
-        # Weight object using the form data and the encrypted content.
-        weight_new = Weight(record=encrypted_weight, user_id=current_user.id)
-        db.session.add(weight_new)
-        db.session.commit()
-        # redirects to weight page and flashes record created message.
-        flash('Weight submitted.', 'success')
-        return redirect(url_for('weight'))
-
-    # pulls the current user's weight records from the database.
-    encrypted_weight = Weight.query.filter_by(user_id=current_user.id). \
-        order_by(Weight.date_posted.desc()).all()
-    # decrypts the records.
-    posts = decrypt_medical_record(encrypted_weight,
-                                   current_user.key)
-    # passes the decrypted data into the html, along with
-    # the page title, form legend, and form.
-    return render_template('weight.html', title='Weight',
-                           posts=posts, form=form, legend='New Weight')
+        # if form data is validated successfully, encrypts the record
+        # using the users key and saves it to the database.
+        add_record(record_type, current_user, form.record.data)
+        # redirects to the record page and flashes record created message.
+        flash(f'{record_type.label} submitted.', 'success')
+        return redirect(url_for('records', record_type=record_type.name))
+
+    # pulls and decrypts a page of the current user's records of this type.
+    posts, next_cursor = get_record_page(record_type, current_user,
+                                         request.args.get('cursor'), app.config['PAGE_SIZE'])
+    # passes the decrypted data into the html, along with the record type,
+    # next page cursor, page title, form legend, and form.
+    return render_template('record.html', title=record_type.label, form=form, posts=posts,
+                           record_type=record_type, next_cursor=next_cursor,
+                           legend=f'New {record_type.label}')
 
 
 @app.route("/astronauts")
@@ -224,10 +176,13 @@ def astronauts():
     """
 
     if current_user.role in ['Admin', 'Medic']:
-        # pulls all users with the astronaut role from the database.
-        all_astronauts = User.query.filter_by(role='Astronaut').all()
-        # passes astronauts data and page title into the html.
-        return render_template('users_list.html', posts=all_astronauts, title='Astronauts')
+        # pulls a page of the users with the astronaut role from the database.
+        all_astronauts, next_cursor = paginate(User.query.filter_by(role='Astronaut'), (User.id,),
+                                               request.args.get('cursor'),
+                                               app.config['PAGE_SIZE'], descending=False)
+        # passes astronauts data, next page cursor, and page title into the html.
+        return render_template('users_list.html', posts=all_astronauts,
+                               next_cursor=next_cursor, title='Astronauts')
 
     return abort(403)   # access denied error if current user has an incorrect role.
 
@@ -242,74 +197,47 @@ def medics():
     """
 
     if current_user.role in ['Admin', 'Astronaut']:
-        # pulls all users with the medic role from the database.
-        all_medics = User.query.filter_by(role='Medic').all()
-        # passes medic data and page title into the html.
-        return render_template('users_list.html', posts=all_medics, title='Astronauts')
+        # pulls a page of the users with the medic role from the database.
+        all_medics, next_cursor = paginate(User.query.filter_by(role='Medic'), (User.id,),
+                                           request.args.get('cursor'),
+                                           app.config['PAGE_SIZE'], descending=False)
+        # passes medic data, next page cursor, and page title into the html.
+        return render_template('users_list.html', posts=all_medics,
+                               next_cursor=next_cursor, title='Astronauts')
 
     return abort(403)   # access denied error if current user has an incorrect role.
 
 
-@app.route("/accounts/<string:email>/bloodpressure")
+@app.route("/accounts/<string:email>/bloodpressure", defaults={'record_type': 'blood_pressure'})
+@app.route("/accounts/<string:email>/weight", defaults={'record_type': 'weight'})
+@app.route("/accounts/<string:email>/records/<string:record_type>")
 @login_required
-def astronauts_blood_pressure(email):
+def astronaut_records(email, record_type):
     """
-    Loads page displaying the blood pressure records of a given astronaut,
+    Loads page displaying the records of the given type for a given astronaut,
     proving that the current user has the correct role, or is the astronaut.
 
     Args:
         email -- email of the astronaut whose records are being viewed.
+        record_type -- name of the registered record type.
     """
 
     if current_user.role in ['Admin', 'Medic'] \
             or current_user.email == email:
         # finds the user in the database associated with the passed in email address.
-        user = User.query.filter_by(email=email).first()
-        if user:
-            # finds all the blood pressure records associated with the user.
-            encrypted_bp = BloodPressure.query.\
-                filter_by(user_id=user.id).order_by(BloodPressure.date_posted.desc()).all()
-            # decrypts the  users records.
-            records = decrypt_medical_record(encrypted_bp,
-                                             User.query.filter_by(email=email).first().key)
-            # passes records, user, and title into the html.
-            return render_template('single_medical_record.html', posts=records,
-                                   user=user, title='Blood Pressure')
-
-        else:
-            return abort(404)   # not found error if user not found.
-
-    return abort(403)   # access denied error if current user has an incorrect role.
-
-
-@app.route("/accounts/<string:email>/weight")
-@login_required
-def astronauts_weight(email):
-    """
-    Loads page displaying the weight records of a given astronaut,
-    proving that the current user has the correct role.
-
-    Args:
-        email -- email of the astronaut whose records are being viewed.
-    """
-
-    if current_user.role in ['Admin', 'Medic'] \
-            or current_user.email == email:
-        # finds the user in the database associated with the passed in email address.
-        user = User.query.filter_by(email=email).first()
-        if user:
-            # finds all the blood pressure records associated with the user.
-            encrypted_weight = Weight.query.filter_by(user_id=user.id).\
-                order_by(Weight.date_posted.desc()).all()
-            # decrypts the  users records.
-            posts = decrypt_medical_record(encrypted_weight,
-                                           User.query.filter_by(email=email).first().key)
-            # passes records, user, and title into the html.
+        user = identities.get_by_email(email)
+        record_type = get_record_type(record_type)
+        if user and record_type:
+            # finds and decrypts a page of the user's records of this type.
+            posts, next_cursor = get_record_page(record_type, user, request.args.get('cursor'),
+                                                 app.config['PAGE_SIZE'])
+            # passes records, record type, next page cursor, user, and title into the html.
             return render_template('single_medical_record.html', posts=posts,
-                                   user=user, title='Weight')
+                                   record_type=record_type, next_cursor=next_cursor, user=user,
+                                   title=record_type.label)
 
         else:
-            return abort(404)   # not found error if user not found.
+            return abort(404)   # not found error if user or record type not found.
 
     return abort(403)   # access denied error if current user has an incorrect role.
 
@@ -326,28 +254,15 @@ def user_posts(email):
     """
 
     # finds the user in the database associated with the passed in email address.
-    user = User.query.filter_by(email=email).first()
+    user = identities.get_by_email(email)
     if user:
-        # finds all post in the database between the current user and the user passed in.
-        encrypted_posts = db.session.query(Post)\
-            .where(((Post.user_id == user.id) & (Post.recipient == current_user.email))
-                   | ((Post.user_id == current_user.id) & (Post.recipient == user.email)))\
-            .order_by(Post.date_posted.desc()).all()
-
-        posts = []  # empty list for decrypted posts to be appended to.
-
-        for encrypted_post in encrypted_posts:
-            post_list = [encrypted_post]    # decrypt_post() takes a list as an argument
-
-            # posts are decrypted with the appropriate key based on the recipient.
-            if encrypted_post.recipient == current_user.email:
-                posts.append(decrypt_post(post_list, current_user.key)[0])
+        # finds and decrypts a page of the posts between the current user and the user passed in.
+        posts, next_cursor = get_message_page(current_user, user, request.args.get('cursor'),
+                                              app.config['PAGE_SIZE'])
 
-            if encrypted_post.recipient == user.email:
-                posts.append(decrypt_post(post_list, user.key)[0])
-
-        # passes posts, user, and title info into the html.
-        return render_template('user_posts.html', posts=posts, user=user, title='Posts')
+        # passes posts, next page cursor, user, and title info into the html.
+        return render_template('user_posts.html', posts=posts, next_cursor=next_cursor,
+                               user=user, title='Posts')
 
     return abort(404)   # not found error if user not found.
 
@@ -361,15 +276,11 @@ def download_data(email, record_type):
 
     Args:
         email -- email of the owner of the records.
-        record_type -- record type to be downloaded.
+        record_type -- name of the record type to be downloaded, or Posts.
     """
 
-    # this runs after the initial request is complete.
-    @after_this_request
-    def delete_file(response):
-        # deletes the temporary csv file.
-        os.remove(Path(__file__).parent / "../ExportedData.csv" )
-        return response
+    if record_type != 'Posts' and not get_record_type(record_type):
+        return abort(404)   # not found error if the record type isn't registered.
 
     if current_user.email == email\
             or current_user.role in ['Admin', 'Medic']\
@@ -392,31 +303,15 @@ def user_account(email):
     """
 
     # pulls the user data from the database associated with the email passed in.
-    user = User.query.filter_by(email=email).first()
+    user = identities.get_by_email(email)
     if user:
-        # finds all posts between the current user and the user passed in.
-        encrypted_posts = db.session.query(Post) \
-            .where(((Post.user_id == user.id) & (Post.recipient == current_user.email))
-                   | ((Post.user_id == current_user.id) & (Post.recipient == user.email))) \
-            .order_by(Post.date_posted.desc()).all()
-
-        posts = []  # empty list for decrypted posts to be appended to.
-
-        # posts are decrypted with the appropriate key based on the
-        # recipient and appended to the posts list.
-        for encrypted_post in encrypted_posts:
-            post_list = [encrypted_post]    # decrypt_post() takes a list as an argument
+        # finds and decrypts a page of the posts between the current user and the user passed in.
+        posts, next_cursor = get_message_page(current_user, user, request.args.get('cursor'),
+                                              app.config['PAGE_SIZE'])
 
-            # posts are decrypted with the appropriate key based on the recipient
-            # and appended to the posts list.
-            if post_list[0].recipient == current_user.email:
-                posts.append(decrypt_post(post_list, current_user.key)[0])
-
-            if post_list[0].recipient == user.email:
-                posts.append(decrypt_post(post_list, user.key)[0])
-
-        # passes posts, user, and title info into the html.
-        return render_template('user_account.html', user=user, posts=posts, title='Account')
+        # passes posts, next page cursor, user, and title info into the html.
+        return render_template('user_account.html', user=user, posts=posts,
+                               next_cursor=next_cursor, title='Account')
 
     return abort(404)   # not found error if user not found.
 
@@ -436,19 +331,20 @@ def register():
     if form.validate_on_submit():
         # hashes the input password using bcrypt and decodes
         # it to a utf-8 string to be passed into the database.
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_password = hash_password(form.password.data)
 
-        # new User object instantiated using the form data,
-        # hashed password, and a newly generated encryption key.
+        # new User object instantiated using the form data and hashed password.
         user = User(first_name=form.first_name.data,
                     last_name=form.last_name.data,
                     email=form.email.data,
-                    password=hashed_password,
-                    key=Fernet.generate_key().decode('utf-8'))
+                    password=hashed_password)
 
-        # adds the new user to the database and commits the change.
+        # adds the new user and a newly generated encryption key to the database
+        # and commits the change.
         db.session.add(user)
+        keyring.create_key(user)
         db.session.commit()
+        identities.invalidate(user_id=user.id, email=user.email)
 
         # flashes account created message and redirects to and empty user registration form.
         flash(f'Account created for {form.first_name.data} {form.last_name.data}.', 'success')
@@ -497,10 +393,12 @@ def users():
     """
 
     if current_user.role == 'Admin':
-        # finds all users currently listed in the database.
-        all_users = User.query.all()
-        # renders list of all users.
-        return render_template('users_list.html', posts=all_users, title='Users')
+        # finds a page of the users currently listed in the database.
+        all_users, next_cursor = paginate(User.query, (User.id,), request.args.get('cursor'),
+                                          app.config['PAGE_SIZE'], descending=False)
+        # renders list of users.
+        return render_template('users_list.html', posts=all_users, next_cursor=next_cursor,
+                               title='Users')
 
     return abort(403)   # access denied error if current user has an incorrect role.
 
@@ -516,19 +414,17 @@ def post(post_id):
     """
 
     # pulls post to be viewed from the database.
-    # not found error is no post with that id found.
-    encrypted_post = Post.query.get_or_404(post_id)
-    # recipient user associated with the post.
-    user = User.query.filter_by(email=encrypted_post.recipient).first()
+    encrypted_post = find_message(post_id)
 
-    if current_user.email == encrypted_post.recipient \
-            or current_user.email == encrypted_post.author.email \
-            or current_user.role == 'Admin':
+    if not encrypted_post:
+        abort(404)  # not found error is no post with that id found.
 
-        post_list = [encrypted_post]  # decrypt_post() takes a list as an argument.
+    if current_user.id == encrypted_post.recipient_id \
+            or current_user.id == encrypted_post.user_id \
+            or current_user.role == 'Admin':
 
         # post is decrypted with the appropriate key based on the recipient.
-        decrypted_post = decrypt_post(post_list, user.key)[0]
+        decrypted_post = decrypt_messages([encrypted_post])[0]
 
         return render_template('post.html', title=encrypted_post.title, post=decrypted_post)
 
@@ -546,28 +442,25 @@ def update_post(post_id):
     """
 
     # finds post in the database.
-    # not found error if no post with the passed in id is in the database.
-    encrypted_post = Post.query.get_or_404(post_id)
+    encrypted_post = find_message(post_id)
 
-    if encrypted_post.author != current_user:
-        abort(403)  # access denied error if current user is not the post author.
+    if not encrypted_post:
+        abort(404)  # not found error if no post with the passed in id is in the database.
 
-    # post recipient info from database.
-    user = User.query.filter_by(email=encrypted_post.recipient).first()
+    if encrypted_post.user_id != current_user.id:
+        abort(403)  # access denied error if current user is not the post author.
 
     form = PostForm()   # form used for validation.
 
-    # decrypts post.
-    decrypted_post = decrypt_post([encrypted_post], user.key)[0]
-
     if form.validate_on_submit():
         # updates new recipient and title in database.
-        encrypted_post.recipient = form.recipient.data
+        encrypted_post = Post.query.get(post_id)
+        encrypted_post.recipient_id = identities.get_by_email(form.recipient.data).id
         encrypted_post.title = form.title.data
 
-        # encrypts new post content and adds to database
-        encrypted_content = encrypt_post(form.content.data, form.recipient.data)
-        encrypted_post.content = encrypted_content
+        # encrypts new post content with the recipient's key and adds to database
+        encrypted_post.key_id = keyring.current_key_id(encrypted_post.recipient_id)
+        encrypted_post.content = encrypt_post(form.content.data, encrypted_post.key_id)
 
         # commits changes to database.
         db.session.commit()
@@ -577,9 +470,12 @@ def update_post(post_id):
         return redirect(url_for('post', post_id=encrypted_post.id))
 
     elif request.method == 'GET':
+        # decrypts post.
+        decrypted_post = decrypt_messages([encrypted_post])[0]
+
         # prefills form with the decrypted data from the database.
-        form.recipient.data = encrypted_post.recipient
-        form.title.data = encrypted_post.title
+        form.recipient.data = decrypted_post['recipient']
+        form.title.data = decrypted_post['title']
         form.content.data = decrypted_post['content']
 
     return render_template('create_post.html', title='Update Post', form=form, legend='Update Post')
@@ -599,7 +495,7 @@ def delete_post(post_id):
     # not found error if no post with the passed in id is in the database.
     post_to_delete = Post.query.get_or_404(post_id)
 
-    if post_to_delete.author != current_user:
+    if post_to_delete.user_id != current_user.id:
         abort(403)  # access denied error if current user is not the post author.
 
     # deletes the post from the database and commits the change to the database.
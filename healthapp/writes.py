@@ -0,0 +1,137 @@
+"""Module containing the write queue, which saves new records and posts.
+
+Each new record or post was saved with a commit of its own, and on sqlite every commit
+waits for the database write lock and for the data to be flushed to disk. With
+GROUP_COMMIT turned on, new rows are instead handed to a single writer thread, which
+gathers the rows sent by all the requests over GROUP_COMMIT_WINDOW seconds, up to
+GROUP_COMMIT_MAX_ROWS of them, and inserts them in one transaction. Each request waits
+until the transaction holding its row is committed, so a saved row is never lost, but
+many requests share the cost of each commit.
+
+If a transaction fails, its rows are inserted again one at a time, so only the requests
+whose rows are at fault get the error. With GROUP_COMMIT turned off, which is the default,
+rows are saved with the request's own session as before.
+
+Classes:
+    WriteQueue -- inserts the rows of concurrent requests in shared transactions.
+
+Functions:
+    insert_row -- saves a new row, returning its id once it is committed.
+"""
+
+import logging
+import queue
+import time
+from concurrent.futures import Future
+from threading import Lock, Thread
+from healthapp import app, db
+
+logger = logging.getLogger(__name__)
+
+
+class WriteQueue:
+    """
+    Queue of rows waiting to be inserted, and the writer thread inserting them. The thread
+    is started when the first row is queued.
+    """
+
+    def __init__(self, window, max_rows):
+        self.window = window    # seconds spent gathering rows for each transaction.
+        self.max_rows = max_rows    # most rows inserted per transaction.
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = Lock()
+
+    def insert(self, table, values):
+        """
+        Queues a row to be inserted, and waits for the transaction holding it to be
+        committed. Returns the id of the row, or raises the error inserting it.
+
+        Args:
+            table -- the table the row is inserted into.
+            values -- the values of the row's columns.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='write-queue', daemon=True)
+                self._thread.start()
+
+        future = Future()
+        self._queue.put((table, values, future))
+
+        return future.result()
+
+    def _next_batch(self):
+        """Waits for a row to be queued, then gathers the rows queued within the window."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_rows:
+            timeout = deadline - time.monotonic()
+
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        """Inserts the queued rows a batch at a time, for as long as the app runs."""
+        with app.app_context():
+            while True:
+                batch = self._next_batch()
+
+                try:
+                    self._commit(batch)
+                except Exception:   # pylint: disable=broad-except
+                    # the rows are inserted one at a time, so each gets its own result.
+                    logger.exception('Inserting %d rows in one transaction failed', len(batch))
+
+                    for row in batch:
+                        try:
+                            self._commit([row])
+                        except Exception as error:  # pylint: disable=broad-except
+                            row[2].set_exception(error)
+
+    @staticmethod
+    def _commit(batch):
+        """Inserts a batch of rows in one transaction, and hands each request its row's id
+        once the transaction is committed."""
+        with db.engine.begin() as connection:
+            row_ids = [connection.execute(table.insert().values(values)).inserted_primary_key[0]
+                       for table, values, _ in batch]
+
+        for (_, _, future), row_id in zip(batch, row_ids):
+            future.set_result(row_id)
+
+
+# write queue shared by all the requests.
+write_queue = WriteQueue(app.config['GROUP_COMMIT_WINDOW'], app.config['GROUP_COMMIT_MAX_ROWS'])
+
+
+def insert_row(model, values):
+    """Saves a new row, returning its id once it has been committed. The row is inserted
+    through the write queue if GROUP_COMMIT is turned on, and with the request's own
+    session otherwise.
+
+    Args:
+        model -- the model of the row.
+        values -- the values of the row's columns.
+    """
+
+    if app.config['GROUP_COMMIT']:
+        return write_queue.insert(model.__table__, values)
+
+    row = model(**values)
+    db.session.add(row)
+
+    # the id is read before the commit, which would expire the row.
+    db.session.flush()
+    row_id = row.id
+    db.session.commit()
+
+    return row_id
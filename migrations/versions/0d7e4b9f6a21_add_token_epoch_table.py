@@ -0,0 +1,28 @@
+"""add token epoch table
+
+Revision ID: 0d7e4b9f6a21
+Revises: f3c8a5d27e19
+Create Date: 2026-10-17 15:06:12.843907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d7e4b9f6a21'
+down_revision = 'f3c8a5d27e19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('token_epoch',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('epoch', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('token_epoch')
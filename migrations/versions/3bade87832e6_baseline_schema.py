@@ -0,0 +1,76 @@
+"""baseline schema
+
+Creates the tables as they were before migrations were introduced. Databases
+created with db.create_all() already have these tables, so any that exist are
+left as they are and the upgrade only records the revision.
+
+Revision ID: 3bade87832e6
+Revises: 
+Create Date: 2026-10-17 01:38:55.090421
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3bade87832e6'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing_tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if 'user' not in existing_tables:
+        op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('first_name', sa.String(), nullable=False),
+        sa.Column('last_name', sa.String(), nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('password', sa.String(), nullable=False),
+        sa.Column('role', sa.String(), nullable=False),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email')
+        )
+
+    if 'blood_pressure' not in existing_tables:
+        op.create_table('blood_pressure',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('record', sa.String(), nullable=False),
+        sa.Column('date_posted', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'post' not in existing_tables:
+        op.create_table('post',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('recipient', sa.String(), nullable=False),
+        sa.Column('date_posted', sa.DateTime(), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'weight' not in existing_tables:
+        op.create_table('weight',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('record', sa.String(), nullable=False),
+        sa.Column('date_posted', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('weight')
+    op.drop_table('post')
+    op.drop_table('blood_pressure')
+    op.drop_table('user')
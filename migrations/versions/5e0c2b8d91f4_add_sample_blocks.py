@@ -0,0 +1,41 @@
+"""add sample blocks for high frequency time-series data
+
+Revision ID: 5e0c2b8d91f4
+Revises: a7d3f19c4e62
+Create Date: 2026-10-17 03:48:02.661930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e0c2b8d91f4'
+down_revision = 'a7d3f19c4e62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sample_block',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('metric_type', sa.String(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('end_time', sa.DateTime(), nullable=False),
+    sa.Column('sample_count', sa.Integer(), nullable=False),
+    sa.Column('data', sa.Text(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    with op.batch_alter_table('sample_block', schema=None) as batch_op:
+        batch_op.create_index('ix_sample_block_user_id_metric_type_start_time',
+                              ['user_id', 'metric_type', 'start_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sample_block', schema=None) as batch_op:
+        batch_op.drop_index('ix_sample_block_user_id_metric_type_start_time')
+
+    op.drop_table('sample_block')
@@ -0,0 +1,93 @@
+"""move user keys to an encryption key table
+
+Creates the encryption_key table with one key for each user, copied from user.key,
+points every post, record, and sample block at the key it was encrypted with, and
+drops user.key.
+
+Revision ID: 7b3e91d0c5a2
+Revises: d2f6a4c8e013
+Create Date: 2026-10-17 05:14:51.370522
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e91d0c5a2'
+down_revision = 'd2f6a4c8e013'
+branch_labels = None
+depends_on = None
+
+# lightweight table definitions for the data migration.
+user = sa.table('user', sa.column('id', sa.Integer), sa.column('key', sa.String))
+encryption_key = sa.table('encryption_key', sa.column('id', sa.Integer),
+                          sa.column('key', sa.String), sa.column('created_at', sa.DateTime),
+                          sa.column('user_id', sa.Integer))
+
+# each encrypted table, and the column of the user whose key it is encrypted with.
+encrypted_tables = [('post', 'recipient_id'), ('record', 'user_id'), ('sample_block', 'user_id')]
+
+
+def upgrade():
+    op.create_table('encryption_key',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    with op.batch_alter_table('encryption_key', schema=None) as batch_op:
+        batch_op.create_index('ix_encryption_key_user_id', ['user_id'], unique=False)
+
+    # copies each user's key into the new table.
+    op.execute(encryption_key.insert().from_select(
+        ['key', 'created_at', 'user_id'],
+        sa.select(user.c.key, sa.literal(datetime.utcnow()), user.c.id)))
+
+    for table_name, user_column in encrypted_tables:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('key_id', sa.Integer(), nullable=True))
+
+        # every row was encrypted with the only key its user has so far.
+        table = sa.table(table_name, sa.column(user_column, sa.Integer),
+                         sa.column('key_id', sa.Integer))
+        op.execute(table.update().values(
+            key_id=sa.select(encryption_key.c.id)
+            .where(encryption_key.c.user_id == table.c[user_column]).scalar_subquery()))
+
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.alter_column('key_id', existing_type=sa.Integer(), nullable=False)
+            batch_op.create_foreign_key(f'fk_{table_name}_key_id_encryption_key',
+                                        'encryption_key', ['key_id'], ['id'])
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('key')
+
+
+def downgrade():
+    # only a single key per user can be kept, so data encrypted with an older key
+    # can't be read after the downgrade.
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('key', sa.String(), nullable=True))
+
+    op.execute(user.update().values(
+        key=sa.select(encryption_key.c.key).where(encryption_key.c.user_id == user.c.id)
+        .order_by(encryption_key.c.id.desc()).limit(1).scalar_subquery()))
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('key', existing_type=sa.String(), nullable=False)
+
+    for table_name, _ in encrypted_tables:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_constraint(f'fk_{table_name}_key_id_encryption_key',
+                                     type_='foreignkey')
+            batch_op.drop_column('key_id')
+
+    with op.batch_alter_table('encryption_key', schema=None) as batch_op:
+        batch_op.drop_index('ix_encryption_key_user_id')
+
+    op.drop_table('encryption_key')
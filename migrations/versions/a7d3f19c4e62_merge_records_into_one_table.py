@@ -0,0 +1,89 @@
+"""merge blood pressure and weight into a single record table
+
+Creates the record table, copies every blood_pressure and weight row into it
+tagged with its metric type, and drops the old tables.
+
+Revision ID: a7d3f19c4e62
+Revises: c41d2e7b9a05
+Create Date: 2026-10-17 03:05:17.204816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3f19c4e62'
+down_revision = 'c41d2e7b9a05'
+branch_labels = None
+depends_on = None
+
+# the tables each metric type was stored in before the record table.
+metric_tables = {'blood_pressure': 'blood_pressure', 'weight': 'weight'}
+
+
+def old_table(name):
+    """Lightweight definition of one of the old record tables for the data migration."""
+    return sa.table(name, sa.column('record', sa.String), sa.column('date_posted', sa.DateTime),
+                    sa.column('user_id', sa.Integer))
+
+
+record = sa.table('record', sa.column('metric_type', sa.String), sa.column('record', sa.String),
+                  sa.column('date_posted', sa.DateTime), sa.column('user_id', sa.Integer))
+
+
+def upgrade():
+    op.create_table('record',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('metric_type', sa.String(), nullable=False),
+    sa.Column('record', sa.String(), nullable=False),
+    sa.Column('date_posted', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # copies the rows of each old table, oldest first so the new ids keep their order.
+    for metric_type, table_name in metric_tables.items():
+        table = old_table(table_name)
+        op.execute(record.insert().from_select(
+            ['metric_type', 'record', 'date_posted', 'user_id'],
+            sa.select(sa.literal(metric_type), table.c.record, table.c.date_posted,
+                      table.c.user_id).order_by(table.c.date_posted)))
+
+    with op.batch_alter_table('record', schema=None) as batch_op:
+        batch_op.create_index('ix_record_user_id_metric_type_date_posted',
+                              ['user_id', 'metric_type', 'date_posted'], unique=False)
+
+    op.drop_table('weight')
+    op.drop_table('blood_pressure')
+
+
+def downgrade():
+    for table_name in metric_tables.values():
+        op.create_table(table_name,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('record', sa.String(), nullable=False),
+        sa.Column('date_posted', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.create_index(f'ix_{table_name}_user_id_date_posted',
+                                  ['user_id', 'date_posted'], unique=False)
+
+    # copies the records back to their old tables. record types added after the
+    # record table have nowhere to go, and are lost.
+    for metric_type, table_name in metric_tables.items():
+        table = old_table(table_name)
+        op.execute(table.insert().from_select(
+            ['record', 'date_posted', 'user_id'],
+            sa.select(record.c.record, record.c.date_posted, record.c.user_id)
+            .where(record.c.metric_type == metric_type).order_by(record.c.date_posted)))
+
+    with op.batch_alter_table('record', schema=None) as batch_op:
+        batch_op.drop_index('ix_record_user_id_metric_type_date_posted')
+
+    op.drop_table('record')
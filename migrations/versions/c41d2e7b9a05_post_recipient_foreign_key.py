@@ -0,0 +1,60 @@
+"""replace post recipient email with a foreign key
+
+Adds post.recipient_id, fills it from the recipient email of each existing
+post, and drops the old post.recipient column and its index.
+
+Revision ID: c41d2e7b9a05
+Revises: 8f5e0aaff3b8
+Create Date: 2026-10-17 02:10:42.518337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d2e7b9a05'
+down_revision = '8f5e0aaff3b8'
+branch_labels = None
+depends_on = None
+
+# lightweight table definitions for the data migration.
+post = sa.table('post', sa.column('recipient', sa.String), sa.column('recipient_id', sa.Integer))
+user = sa.table('user', sa.column('id', sa.Integer), sa.column('email', sa.String))
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('recipient_id', sa.Integer(), nullable=True))
+
+    # looks up the id of each post's recipient from their email.
+    op.execute(post.update().values(
+        recipient_id=sa.select(user.c.id).where(user.c.email == post.c.recipient).scalar_subquery()))
+
+    # posts sent to users that no longer exist can't be decrypted, so are removed.
+    op.execute(post.delete().where(post.c.recipient_id.is_(None)))
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.alter_column('recipient_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_post_recipient_id_user', 'user', ['recipient_id'], ['id'])
+        batch_op.drop_index('ix_post_recipient_date_posted')
+        batch_op.create_index('ix_post_recipient_id_date_posted', ['recipient_id', 'date_posted'],
+                              unique=False)
+        batch_op.drop_column('recipient')
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('recipient', sa.String(), nullable=True))
+
+    # looks up the email of each post's recipient from their id.
+    op.execute(post.update().values(
+        recipient=sa.select(user.c.email).where(user.c.id == post.c.recipient_id).scalar_subquery()))
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.alter_column('recipient', existing_type=sa.String(), nullable=False)
+        batch_op.drop_index('ix_post_recipient_id_date_posted')
+        batch_op.create_index('ix_post_recipient_date_posted', ['recipient', 'date_posted'],
+                              unique=False)
+        batch_op.drop_constraint('fk_post_recipient_id_user', type_='foreignkey')
+        batch_op.drop_column('recipient_id')
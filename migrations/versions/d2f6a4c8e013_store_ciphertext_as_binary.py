@@ -0,0 +1,76 @@
+"""store ciphertext as raw binary
+
+Converts the encrypted post content, records, and sample blocks from url-safe
+base64 Fernet tokens in text columns to the raw token bytes in binary columns.
+
+Revision ID: d2f6a4c8e013
+Revises: 5e0c2b8d91f4
+Create Date: 2026-10-17 04:22:39.118204
+
+"""
+import base64
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f6a4c8e013'
+down_revision = '5e0c2b8d91f4'
+branch_labels = None
+depends_on = None
+
+# the encrypted column of each table, and its type before the upgrade.
+encrypted_columns = [('post', 'content', sa.Text()),
+                     ('record', 'record', sa.String()),
+                     ('sample_block', 'data', sa.Text())]
+
+# number of rows converted per statement.
+batch_size = 1000
+
+
+def convert_column(table_name, column_name, new_column_name, convert):
+    """Fills a new column with the converted value of an existing one, in batches of rows."""
+    table = sa.table(table_name, sa.column('id', sa.Integer), sa.column(column_name),
+                     sa.column(new_column_name))
+    update = table.update().where(table.c.id == sa.bindparam('row_id')) \
+        .values({new_column_name: sa.bindparam('value')})
+    bind = op.get_bind()
+    last_id = 0
+
+    while True:
+        rows = bind.execute(sa.select(table.c.id, table.c[column_name])
+                            .where(table.c.id > last_id).order_by(table.c.id)
+                            .limit(batch_size)).fetchall()
+        if not rows:
+            break
+
+        bind.execute(update, [{'row_id': row_id, 'value': convert(value)}
+                              for row_id, value in rows])
+        last_id = rows[-1][0]
+
+
+def replace_column(table_name, column_name, new_type, convert):
+    """Replaces a column with one of a new type, holding the converted values."""
+    new_column_name = f'{column_name}_new'
+
+    with op.batch_alter_table(table_name, schema=None) as batch_op:
+        batch_op.add_column(sa.Column(new_column_name, new_type, nullable=True))
+
+    convert_column(table_name, column_name, new_column_name, convert)
+
+    with op.batch_alter_table(table_name, schema=None) as batch_op:
+        batch_op.drop_column(column_name)
+        batch_op.alter_column(new_column_name, new_column_name=column_name,
+                              existing_type=new_type, nullable=False)
+
+
+def upgrade():
+    for table_name, column_name, _ in encrypted_columns:
+        replace_column(table_name, column_name, sa.LargeBinary(),
+                       lambda token: base64.urlsafe_b64decode(token.encode()))
+
+
+def downgrade():
+    for table_name, column_name, old_type in encrypted_columns:
+        replace_column(table_name, column_name, old_type,
+                       lambda token: base64.urlsafe_b64encode(token).decode('utf-8'))
@@ -0,0 +1,39 @@
+"""add refresh token table
+
+Revision ID: e4a9c1f7b2d6
+Revises: 7b3e91d0c5a2
+Create Date: 2026-10-17 07:02:38.519147
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a9c1f7b2d6'
+down_revision = '7b3e91d0c5a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('refresh_token',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('token_hash', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('token_hash')
+    )
+
+    with op.batch_alter_table('refresh_token', schema=None) as batch_op:
+        batch_op.create_index('ix_refresh_token_user_id', ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('refresh_token', schema=None) as batch_op:
+        batch_op.drop_index('ix_refresh_token_user_id')
+
+    op.drop_table('refresh_token')
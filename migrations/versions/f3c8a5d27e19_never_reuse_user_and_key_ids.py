@@ -0,0 +1,38 @@
+"""never reuse user and encryption key ids
+
+Revision ID: f3c8a5d27e19
+Revises: b5d8e2f41a97
+Create Date: 2026-10-17 14:22:37.518406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8a5d27e19'
+down_revision = 'b5d8e2f41a97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # sqlite only allows autoincrement to be set when a table is created, so the tables
+    # are copied into new ones. the counters start after the largest existing ids.
+    with op.batch_alter_table('user', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+    with op.batch_alter_table('encryption_key', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+
+def downgrade():
+    with op.batch_alter_table('encryption_key', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+        pass
+
+    with op.batch_alter_table('user', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+        pass